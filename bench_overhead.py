@@ -0,0 +1,403 @@
+# Overhead regression benchmark for the metrics pipeline
+#
+# Measures what the evaluation layer itself costs per request, so changes to
+# the harness can be checked before they reach a device where every
+# millisecond and every percent of CPU is taken from the model:
+#
+#   stages  each step of a request in isolation, in-process: monitor start/stop,
+#           collect_metrics (all derived metrics), log_request_metrics (summary
+#           update and writer enqueue) and JSON serialization of the response.
+#           Reported as p50/p99/mean in microseconds and bytes allocated per
+#           call (tracemalloc peak).
+#   sampler CPU used by the background resource sampler while a request is open
+#
+# Stages and sampler run against a fake Ollama process tree (an "ollama-bench
+# serve" process with --fake-runners children holding --fake-runner-mb each),
+# so per-process tracking costs what it would next to a loaded model.
+#   e2e     the server in front of the Ollama stub (ollama_stub.py): latency
+#           added over calling the stub directly, server CPU per request, and
+#           p99 under a burst of concurrent requests
+#
+# Baselines are stored as JSON (--update-baseline writes them). A run compared
+# against a baseline fails (exit status 1) when a metric is worse by more than
+# the budget: --budget as a fraction (default 0.25), overridable per metric in
+# the baseline file's "budgets" section, e.g. {"collect_metrics.p50_us": 0.1}.
+# Differences below a noise floor are ignored; the floor depends on the metric's
+# unit (NOISE_FLOORS) and can be set per metric in the baseline file's
+# "noise_floors" section. Baselines are machine-specific; keep one per device
+# class.
+
+# Run:
+#   python bench_overhead.py --update-baseline              # record
+#   python bench_overhead.py                                # check
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import psutil
+
+from bench_proxy import launch, wait_for_port, sequential_latencies, burst, percentile
+
+# Where the server under test writes its metrics; set before it is imported
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_overhead_")
+os.environ.setdefault("METRICS_CSV", os.path.join(_TMP_DIR, "metrics.csv"))
+os.environ.setdefault("METRICS_DB", os.path.join(_TMP_DIR, "metrics.db"))
+# Track the fake Ollama tree below instead of a real Ollama
+FAKE_OLLAMA_NAME = "ollama-bench"
+os.environ.setdefault("OLLAMA_PROCESS_PREFIX", FAKE_OLLAMA_NAME)
+
+# Metrics compared against the baseline; lower is better for all of them
+STAGE_KEYS = ("p50_us", "p99_us", "alloc_bytes")
+SAMPLER_KEYS = ("sampler_cpu_percent", "avg_sample_cost_us")
+E2E_KEYS = ("overhead_p50_ms", "overhead_p99_ms", "server_cpu_ms_per_request", "burst_p99_ms")
+
+# Smallest difference that counts, by the unit named in the metric
+NOISE_FLOORS = {
+    "us": 5.0,
+    "ms": 0.5,
+    "bytes": 512.0,
+    "percent": 0.05,      # percentage points
+}
+
+SAMPLE_RESULT = {
+    "model": "stub",
+    "response": " The capital of France is Paris." * 8,
+    "done": True,
+    "total_duration": 2_500_000_000,
+    "load_duration": 40_000_000,
+    "prompt_eval_count": 12,
+    "prompt_eval_duration": 300_000_000,
+    "eval_count": 64,
+    "eval_duration": 2_100_000_000,
+}
+
+###############################################################################
+# Fake Ollama process tree
+###############################################################################
+# argv: serve <runners> <MB per runner>; each runner touches its memory so
+# RSS/PSS are real
+FAKE_SERVER = """
+import subprocess, sys, time
+runner = "import sys, time; block = b'x' * (int(sys.argv[1]) << 20); time.sleep(1e9)"
+children = [subprocess.Popen([sys.executable, "-c", runner, sys.argv[3]]) for _ in range(int(sys.argv[2]))]
+time.sleep(1e9)
+"""
+
+
+def start_fake_ollama(runners, runner_mb, timeout_s=30.0):
+    """
+    Starts the fake tree under an executable named FAKE_OLLAMA_NAME and waits
+    until every runner has allocated its memory.
+    """
+    exe = os.path.join(_TMP_DIR, FAKE_OLLAMA_NAME)
+    if not os.path.exists(exe):
+        os.symlink(sys.executable, exe)
+    server = subprocess.Popen([exe, "-c", FAKE_SERVER, "serve", str(runners), str(runner_mb)])
+    process = psutil.Process(server.pid)
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        children = process.children()
+        if len(children) == runners and all(
+            c.memory_info().rss >= runner_mb << 20 for c in children
+        ):
+            break
+        time.sleep(0.1)
+    return server
+
+
+def stop_fake_ollama(server):
+    for child in psutil.Process(server.pid).children(recursive=True):
+        child.kill()
+    server.kill()
+    server.wait()
+
+###############################################################################
+# Stage benchmarks
+###############################################################################
+def bench_stage(fn, iterations, warmup):
+    """
+    Timing over `iterations` calls, then a separate tracemalloc pass so the
+    tracing overhead does not leak into the timings.
+    """
+    for _ in range(warmup):
+        fn()
+    durations_us = []
+    for _ in range(iterations):
+        start_ns = time.perf_counter_ns()
+        fn()
+        durations_us.append((time.perf_counter_ns() - start_ns) / 1000)
+
+    alloc_iterations = max(1, iterations // 10)
+    tracemalloc.start()
+    peak_bytes = 0
+    for _ in range(alloc_iterations):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        fn()
+        peak_bytes += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "mean_us": sum(durations_us) / len(durations_us),
+        "p50_us": percentile(durations_us, 50),
+        "p99_us": percentile(durations_us, 99),
+        "alloc_bytes": peak_bytes / alloc_iterations,
+    }
+
+
+def run_stages(args):
+    import llm_metrics_11 as core
+
+    req = core.PromptRequest("What is the capital of France?")
+    # A finished monitor with real samples behind it, reused by the
+    # read-only stages; long enough for the sampler to find the fake tree
+    monitor = core.ResourceMonitor()
+    monitor.start()
+    deadline = time.monotonic() + 10
+    while len(core.SAMPLER.stats()["ollama_pids"]) < args.fake_runners + 1 and time.monotonic() < deadline:
+        time.sleep(0.1)
+    time.sleep(0.5)
+    monitor.stop()
+    metrics = core.collect_metrics(req, SAMPLE_RESULT, monitor, 2.6)
+
+    def monitor_start_stop():
+        m = core.ResourceMonitor()
+        m.start()
+        m.stop()
+
+    stages = {
+        "monitor_start_stop": monitor_start_stop,
+        "collect_metrics": lambda: core.collect_metrics(req, SAMPLE_RESULT, monitor, 2.6),
+        "log_request_metrics": lambda: core.log_request_metrics(req, metrics),
+        "serialize_json": lambda: json.dumps(metrics),
+    }
+    results = {}
+    for name, fn in stages.items():
+        results[name] = bench_stage(fn, args.iterations, args.warmup)
+    results["per_request_total"] = {
+        key: sum(results[name][key] for name in stages) for key in ("mean_us",) + STAGE_KEYS
+    }
+    core.METRICS_WRITER.close()
+    return results
+
+
+def run_sampler(args):
+    """
+    Sampler cost while one request window is open (it idles otherwise).
+    """
+    from resource_sampler import ResourceSampler, ResourceMonitor
+
+    sampler = ResourceSampler()
+    monitor = ResourceMonitor(sampler)
+    monitor.start()
+    time.sleep(args.sampler_seconds)
+    # Before stop(), while the sampler is still at its active interval
+    stats = sampler.stats()
+    monitor.stop()
+    sampler.stop()
+    return {
+        "interval_s": stats["current_interval_s"],
+        "samples_taken": stats["samples_taken"],
+        "avg_sample_cost_us": stats["avg_sample_cost_us"],
+        "sampler_cpu_percent": stats["sampler_cpu_percent"],
+    }
+
+###############################################################################
+# End-to-end benchmark
+###############################################################################
+async def _e2e(args, server_pid, server_url, stub_url):
+    payload_stub = {"model": "stub", "prompt": "What is the capital of France?", "stream": False}
+    payload_server = {"prompt": "What is the capital of France?"}
+
+    direct = await sequential_latencies(stub_url, payload_stub, args.requests)
+    process = psutil.Process(server_pid)
+    cpu_before = process.cpu_times()
+    proxied = await sequential_latencies(server_url, payload_server, args.requests)
+    cpu_after = process.cpu_times()
+    burst_result = await burst(server_url, payload_server, args.concurrency)
+
+    cpu_s = (cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system)
+    return {
+        "server": args.server,
+        "requests": len(proxied),
+        "overhead_p50_ms": (percentile(proxied, 50) - percentile(direct, 50)) * 1000,
+        "overhead_p99_ms": (percentile(proxied, 99) - percentile(direct, 99)) * 1000,
+        # The warm-up request of sequential_latencies is inside the CPU window
+        "server_cpu_ms_per_request": cpu_s * 1000 / (len(proxied) + 1) if proxied else 0,
+        "burst_concurrency": args.concurrency,
+        "burst_failed": burst_result["failed"],
+        "burst_p99_ms": burst_result["p99_s"] * 1000,
+    }
+
+
+def run_e2e(args):
+    script = {"async": "llm_metrics_async.py", "flask": "llm_metrics_11.py"}[args.server]
+    stub_url = f"http://127.0.0.1:{args.stub_port}/api/generate"
+    stub = launch(["ollama_stub.py", "--port", str(args.stub_port),
+                   "--tokens", "16", "--tokens-per-second", "400", "--num-parallel", "100000"])
+    server = None
+    try:
+        wait_for_port(args.stub_port)
+        server = launch([script], {
+            "PORT": str(args.server_port),
+            "OLLAMA_API_URL": stub_url,
+            "METRICS_CSV": os.path.join(_TMP_DIR, "e2e.csv"),
+            "METRICS_DB": os.path.join(_TMP_DIR, "e2e.db"),
+            "SCHEDULER_CONCURRENCY": "0",
+        })
+        wait_for_port(args.server_port)
+        server_url = f"http://127.0.0.1:{args.server_port}/process_prompt"
+        # One INFO line per request from httpx would be timed along with it
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        return asyncio.run(_e2e(args, server.pid, server_url, stub_url))
+    finally:
+        for proc in (server, stub):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+###############################################################################
+# Baseline comparison
+###############################################################################
+def flatten(results):
+    """
+    {"stages": {"collect_metrics": {"p50_us": ..}}} -> {"collect_metrics.p50_us": ..}
+    for the compared keys only.
+    """
+    flat = {}
+    for name, stage in results.get("stages", {}).items():
+        for key in STAGE_KEYS:
+            flat[f"{name}.{key}"] = stage[key]
+    for key in SAMPLER_KEYS:
+        if "sampler" in results:
+            flat[f"sampler.{key}"] = results["sampler"][key]
+    for key in E2E_KEYS:
+        if "e2e" in results:
+            flat[f"e2e.{key}"] = results["e2e"][key]
+    return flat
+
+
+def noise_floor(metric, floors):
+    """
+    Smallest difference in `metric` that counts: the baseline's own setting,
+    else NOISE_FLOORS for the unit in its name ("p50_us", "cpu_ms_per_request"),
+    else 0.
+    """
+    if metric in floors:
+        return floors[metric]
+    for part in metric.rsplit(".", 1)[-1].split("_"):
+        if part in NOISE_FLOORS:
+            return NOISE_FLOORS[part]
+    return 0.0
+
+
+def compare(results, baseline, budget):
+    """
+    [(metric, baseline, current, allowed, regressed)] for metrics present in both.
+    """
+    budgets = baseline.get("budgets", {})
+    floors = baseline.get("noise_floors", {})
+    current = flatten(results)
+    rows = []
+    for metric, base in flatten(baseline["results"]).items():
+        if metric not in current:
+            continue
+        allowed = base * (1 + budgets.get(metric, budget))
+        value = current[metric]
+        regressed = value > allowed and value - base > noise_floor(metric, floors)
+        rows.append((metric, base, value, allowed, regressed))
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'metric':<42}{'baseline':>12}{'current':>12}{'allowed':>12}")
+    for metric, base, value, allowed, regressed in rows:
+        flag = "  REGRESSED" if regressed else ""
+        print(f"{metric:<42}{base:>12.2f}{value:>12.2f}{allowed:>12.2f}{flag}")
+
+###############################################################################
+# MAIN
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Per-request overhead benchmark with regression budget")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--budget", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--sampler-seconds", type=float, default=3.0)
+    parser.add_argument("--fake-runners", type=int, default=4,
+                        help="runner processes in the fake Ollama tree")
+    parser.add_argument("--fake-runner-mb", type=int, default=256,
+                        help="memory each fake runner holds")
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--server", choices=["async", "flask"], default="async")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--stub-port", type=int, default=11510)
+    parser.add_argument("--server-port", type=int, default=5010)
+    parser.add_argument("--output", help="write this run's results as JSON")
+    args = parser.parse_args()
+
+    fake_ollama = start_fake_ollama(args.fake_runners, args.fake_runner_mb)
+    try:
+        results = {
+            "machine": {
+                "node": platform.node(),
+                "machine": platform.machine(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+            },
+            "fake_ollama": {"runners": args.fake_runners, "runner_mb": args.fake_runner_mb},
+            "stages": run_stages(args),
+            "sampler": run_sampler(args),
+        }
+    finally:
+        stop_fake_ollama(fake_ollama)
+    if not args.skip_e2e:
+        results["e2e"] = run_e2e(args)
+
+    print(json.dumps({k: v for k, v in results.items() if k not in ("machine", "fake_ollama")}, indent=4))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+    if args.update_baseline:
+        budgets = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                budgets = json.load(f).get("budgets", {})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"budgets": budgets, "results": results}, f, indent=4)
+        print(f"Baseline saved to '{args.baseline}'.")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at '{args.baseline}'; run with --update-baseline first.")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["results"].get("machine") != results["machine"]:
+        print("Warning: baseline was recorded on a different machine or Python version.")
+    if baseline["results"].get("fake_ollama") != results["fake_ollama"]:
+        print("Warning: baseline was recorded against a different fake Ollama tree.")
+    rows = compare(results, baseline, args.budget)
+    print_comparison(rows)
+    regressions = [row for row in rows if row[4]]
+    if regressions:
+        print(f"{len(regressions)} metric(s) over budget.")
+        sys.exit(1)
+    print("Within budget.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# Proxy overhead and concurrency ceiling benchmark
+#
+# Compares the original Flask-under-WsgiToAsgi server (llm_metrics_11.py) with
+# the native async server (llm_metrics_async.py), both pointed at the local
+# Ollama stub (ollama_stub.py), so no model or GPU is needed.
+#
+#   proxy overhead      median/p99 latency through the server minus the same
+#                       request sent straight to the stub, sequentially
+#   concurrency ceiling largest burst of simultaneous requests that all succeed
+#                       with p99 within --ceiling-factor x the single-request
+#                       latency (the stub itself never queues, so anything
+#                       above that is queueing inside the server)
+
+# Run:
+#   python bench_proxy.py --output bench_proxy_results.json
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+###############################################################################
+# Process helpers
+###############################################################################
+def wait_for_port(port, timeout_s=30.0):
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout_s}s")
+
+
+def launch(args, env_overrides=None):
+    env = dict(os.environ)
+    env.update(env_overrides or {})
+    return subprocess.Popen(
+        [sys.executable] + args,
+        cwd=HERE,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = (pct / 100.0) * (len(ordered) - 1)
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+###############################################################################
+# Measurements
+###############################################################################
+async def timed_post(client, url, payload):
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, json=payload)
+        ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+async def sequential_latencies(url, payload, n):
+    async with httpx.AsyncClient(timeout=None) as client:
+        await timed_post(client, url, payload)  # warm-up (connection, imports)
+        latencies = []
+        for _ in range(n):
+            ok, elapsed = await timed_post(client, url, payload)
+            if ok:
+                latencies.append(elapsed)
+        return latencies
+
+
+async def burst(url, payload, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(timed_post(client, url, payload) for _ in range(concurrency))
+        )
+        wall_s = time.perf_counter() - start
+    latencies = [elapsed for ok, elapsed in results if ok]
+    return {
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "failed": concurrency - len(latencies),
+        "wall_s": wall_s,
+        "throughput_rps": len(latencies) / wall_s if wall_s > 0 else 0,
+        "p50_s": percentile(latencies, 50),
+        "p99_s": percentile(latencies, 99),
+    }
+
+
+async def bench_target(name, url, payload, baseline_s, args):
+    latencies = await sequential_latencies(url, payload, args.sequential)
+    single_s = percentile(latencies, 50)
+    report = {
+        "target": name,
+        "sequential_p50_s": single_s,
+        "sequential_p99_s": percentile(latencies, 99),
+        "proxy_overhead_p50_ms": (single_s - baseline_s["p50"]) * 1000,
+        "proxy_overhead_p99_ms": (percentile(latencies, 99) - baseline_s["p99"]) * 1000,
+        "bursts": [],
+        "concurrency_ceiling": 0,
+    }
+    for concurrency in args.levels:
+        result = await burst(url, payload, concurrency)
+        report["bursts"].append(result)
+        healthy = (result["failed"] == 0
+                   and result["p99_s"] <= args.ceiling_factor * single_s)
+        if not healthy:
+            break
+        report["concurrency_ceiling"] = concurrency
+    return report
+
+###############################################################################
+# MAIN
+###############################################################################
+async def run(args):
+    payload_stub = {"model": "stub", "prompt": "What is the capital of France?", "stream": False}
+    payload_server = {"prompt": "What is the capital of France?"}
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}/api/generate"
+    baseline = await sequential_latencies(stub_url, payload_stub, args.sequential)
+    baseline_s = {"p50": percentile(baseline, 50), "p99": percentile(baseline, 99)}
+
+    reports = [{
+        "target": "stub (direct)",
+        "sequential_p50_s": baseline_s["p50"],
+        "sequential_p99_s": baseline_s["p99"],
+    }]
+
+    targets = [
+        ("flask+WsgiToAsgi", "llm_metrics_11.py", args.sync_port),
+        ("native async", "llm_metrics_async.py", args.async_port),
+    ]
+    csv_dir = tempfile.mkdtemp(prefix="bench_proxy_")
+    for name, script, port in targets:
+        proc = launch([script], {
+            "PORT": str(port),
+            "OLLAMA_API_URL": stub_url,
+            "METRICS_CSV": os.path.join(csv_dir, f"{port}.csv"),
+            "METRICS_DB": os.path.join(csv_dir, f"{port}.db"),
+            # Measure the proxy alone, without admission queueing
+            "SCHEDULER_CONCURRENCY": "0",
+        })
+        try:
+            wait_for_port(port)
+            url = f"http://127.0.0.1:{port}/process_prompt"
+            reports.append(await bench_target(name, url, payload_server, baseline_s, args))
+        finally:
+            proc.terminate()
+            proc.wait()
+    return reports
+
+
+def print_reports(reports):
+    print(f"{'target':<20}{'seq p50 ms':>12}{'seq p99 ms':>12}"
+          f"{'ovh p50 ms':>12}{'ovh p99 ms':>12}{'ceiling':>10}")
+    for r in reports:
+        print(f"{r['target']:<20}"
+              f"{r['sequential_p50_s'] * 1000:>12.2f}"
+              f"{r['sequential_p99_s'] * 1000:>12.2f}"
+              f"{r.get('proxy_overhead_p50_ms', 0):>12.2f}"
+              f"{r.get('proxy_overhead_p99_ms', 0):>12.2f}"
+              f"{r.get('concurrency_ceiling', '-'):>10}")
+    for r in reports:
+        for b in r.get("bursts", []):
+            print(f"  {r['target']:<18} c={b['concurrency']:<5} ok={b['succeeded']:<5} "
+                  f"fail={b['failed']:<5} rps={b['throughput_rps']:8.1f} "
+                  f"p50={b['p50_s'] * 1000:8.1f}ms p99={b['p99_s'] * 1000:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync vs async proxy against the Ollama stub")
+    parser.add_argument("--stub-port", type=int, default=11500)
+    parser.add_argument("--sync-port", type=int, default=5001)
+    parser.add_argument("--async-port", type=int, default=5002)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--sequential", type=int, default=30,
+                        help="sequential requests used for the overhead numbers")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 32, 64, 128, 256, 512])
+    parser.add_argument("--ceiling-factor", type=float, default=2.0)
+    parser.add_argument("--output", help="write the full report as JSON")
+    args = parser.parse_args()
+
+    stub = launch(["ollama_stub.py", "--port", str(args.stub_port),
+                   "--tokens", str(args.tokens),
+                   "--num-parallel", "100000",
+                   "--tokens-per-second", str(args.tokens_per_second)])
+    try:
+        wait_for_port(args.stub_port)
+        reports = asyncio.run(run(args))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print_reports(reports)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=4)
+
+if __name__ == "__main__":
+    main()
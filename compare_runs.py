@@ -0,0 +1,416 @@
+# Run-to-run comparison with bootstrap confidence intervals
+#
+# Compares a baseline run with one or more candidate runs (e.g. before and
+# after a model, quantization or firmware change) and says, per metric,
+# whether the candidate is worse, better, unchanged or whether the data cannot
+# tell yet. The exit status is 1 when any metric regressed, so a rollout can
+# be gated on it.
+#
+# Runs are read as streams, one row at a time, keeping only the compared
+# metrics:
+#   *.csv            metrics_log.csv (any schema version)
+#   *.json           a JSON array of results, e.g. llm_test_results.json
+#   *.jsonl/.ndjson  one result per line, e.g. saved /process_batch output
+# Append "#key=value,..." to select rows, e.g. metrics_log.csv#tag=sweep:1a2b
+# or metrics_log.csv#model=qwen2.5:0.5b-instruct-q8_0.
+#
+# Rows are aligned by prompt (by batch index or position when a file has no
+# prompts), and only prompts present in both runs are compared. Each prompt
+# counts once, however many repetitions it has:
+#   paired      (>= PAIRED_MIN_PROMPTS common prompts) resamples prompts, keeping
+#               each prompt's baseline and candidate means together
+#   stratified  (fewer prompts) resamples the repetitions within each prompt,
+#               independently for both runs; prompts with more than
+#               STRATIFIED_EXACT_MAX repetitions draw their resampled mean from
+#               its normal approximation instead
+# Resampling is vectorized with NumPy.
+#
+# Verdict per metric, with the change expressed as "relative change in the
+# worse direction" and --threshold as the smallest change that matters:
+#   regression    CI entirely on the worse side and the estimate beyond the threshold
+#   improvement   the same on the better side
+#   no change     CI entirely within +-threshold
+#   inconclusive  anything else; more repetitions are needed
+#
+# Run:
+#   python compare_runs.py baseline.json candidate.json
+#   python compare_runs.py metrics_log.csv#tag=fw-1.2 metrics_log.csv#tag=fw-1.3 \
+#       --metrics tokens_per_second energy_per_token_j --bootstrap 10000 --threshold 0.03
+
+import argparse
+import csv
+import json
+import math
+import sys
+
+try:
+    import numpy as np
+except ImportError:  # the server imports this module; only bootstrap() needs NumPy
+    np = None
+
+###############################################################################
+# SETTINGS
+###############################################################################
+# Compared by default, with the direction that counts as better
+DEFAULT_METRICS = {
+    "tokens_per_second": "higher",
+    "prompt_eval_tokens_per_s": "higher",
+    "time_to_first_token_s": "lower",
+    "local_inference_time_s": "lower",
+    "energy_per_token_j": "lower",
+    "avg_power_w": "lower",
+    "peak_ram_usage_mb": "lower",
+}
+DEFAULT_BOOTSTRAP = 10000
+# Fewer resamples than this give no usable percentile interval
+MIN_BOOTSTRAP = 100
+DEFAULT_THRESHOLD = 0.05
+PAIRED_MIN_PROMPTS = 5
+STRATIFIED_EXACT_MAX = 500
+
+# Upper bound on resampled values held at once (memory, not speed)
+MAX_CHUNK_VALUES = 4_000_000
+
+###############################################################################
+# Reading runs
+###############################################################################
+def iter_json_array(path, chunk_size=1 << 16):
+    """
+    Yields the elements of a top-level JSON array one at a time, reading the
+    file in chunks.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, started, eof = "", 0, False, False
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                if not started:
+                    if buf[pos] != "[":
+                        raise ValueError(f"{path}: expected a JSON array")
+                    started = True
+                    pos += 1
+                    continue
+                if buf[pos] == "]":
+                    return
+                try:
+                    item, pos = decoder.raw_decode(buf, pos)
+                    yield item
+                    continue
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+            if eof:
+                raise ValueError(f"{path}: truncated JSON array")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+
+def iter_json_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_csv(path):
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def flatten_result(result):
+    """
+    A /process_prompt style result ({"ollama_metrics": {...}, ...}) as one
+    flat dict; CSV rows are already flat and pass through unchanged.
+    """
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(value)
+        else:
+            flat[key] = value
+    return flat
+
+
+def parse_run_spec(spec):
+    """
+    "path#key=value,key=value" -> (path, {key: value}).
+    """
+    path, _, query = spec.partition("#")
+    filters = {}
+    for item in query.split(","):
+        if item:
+            key, sep, value = item.partition("=")
+            if not sep:
+                raise ValueError(f"Expected key=value in '{spec}'")
+            filters[key] = value
+    return path, filters
+
+
+def iter_rows(path):
+    if path.endswith(".csv"):
+        return iter_csv(path)
+    if path.endswith((".jsonl", ".ndjson")):
+        return iter_json_lines(path)
+    return iter_json_array(path)
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def group_by_prompt(rows, metrics, filters=None):
+    """
+    {metric: {prompt key: [values]}} from an iterable of result rows.
+    Error rows and rows failing the filters are skipped.
+    """
+    grouped = {name: {} for name in metrics}
+    for position, row in enumerate(rows):
+        row = flatten_result(row)
+        if row.get("error") or row.get("batch_summary"):
+            continue
+        if filters and any(str(row.get(k)) != v for k, v in filters.items()):
+            continue
+        if row.get("prompt"):
+            key = row["prompt"]
+        elif row.get("index") is not None:
+            key = f"#{row['index']}"
+        else:
+            key = f"#{position}"
+        for name in metrics:
+            value = _number(row.get(name))
+            if value is not None:
+                grouped[name].setdefault(key, []).append(value)
+    return grouped
+
+
+def load_run(spec, metrics):
+    path, filters = parse_run_spec(spec)
+    return group_by_prompt(iter_rows(path), metrics, filters)
+
+###############################################################################
+# Statistics
+###############################################################################
+def _chunks(total, values_per_replicate):
+    size = max(1, MAX_CHUNK_VALUES // max(1, values_per_replicate))
+    for start in range(0, total, size):
+        yield min(size, total - start)
+
+
+def _paired_replicates(base_means, cand_means, n_boot, rng):
+    """
+    Resamples prompts: (baseline, candidate) average over prompts per replicate.
+    """
+    n = len(base_means)
+    base_out, cand_out = [], []
+    for size in _chunks(n_boot, n):
+        idx = rng.integers(0, n, size=(size, n))
+        base_out.append(base_means[idx].mean(axis=1))
+        cand_out.append(cand_means[idx].mean(axis=1))
+    return np.concatenate(base_out), np.concatenate(cand_out)
+
+
+def _stratified_replicates(groups, n_boot, rng):
+    """
+    Resamples repetitions within each prompt: average over prompts of the
+    resampled prompt means, per replicate.
+    """
+    total = np.zeros(n_boot)
+    for values in groups:
+        n = len(values)
+        if n == 1:
+            total += values[0]
+            continue
+        if n > STRATIFIED_EXACT_MAX:
+            # The bootstrap distribution of a mean over this many values is
+            # normal for all practical purposes, and drawing it is O(n_boot)
+            total += rng.normal(values.mean(), values.std() / math.sqrt(n), n_boot)
+            continue
+        start = 0
+        for size in _chunks(n_boot, n):
+            idx = rng.integers(0, n, size=(size, n))
+            total[start:start + size] += values[idx].mean(axis=1)
+            start += size
+    return total / len(groups)
+
+
+def _percentile_ci(samples, confidence):
+    tail = (1 - confidence) / 2 * 100
+    lo, hi = np.percentile(samples, [tail, 100 - tail])
+    return float(lo), float(hi)
+
+
+def bootstrap(baseline, candidate, n_boot=DEFAULT_BOOTSTRAP, confidence=0.95, seed=0):
+    """
+    baseline, candidate: {prompt key: [values]} of one metric.
+    Returns estimates and bootstrap CIs of the difference in means
+    (candidate - baseline) and of the relative change, or None when the runs
+    share no prompt.
+    """
+    if np is None:
+        raise RuntimeError("NumPy is required for bootstrap comparisons")
+    if n_boot < MIN_BOOTSTRAP:
+        raise ValueError(f"bootstrap must be at least {MIN_BOOTSTRAP} resamples")
+    keys = [k for k in baseline if k in candidate]
+    if not keys:
+        return None
+    base_groups = [np.asarray(baseline[k], dtype=float) for k in keys]
+    cand_groups = [np.asarray(candidate[k], dtype=float) for k in keys]
+    base_means = np.array([g.mean() for g in base_groups])
+    cand_means = np.array([g.mean() for g in cand_groups])
+    base_mean, cand_mean = float(base_means.mean()), float(cand_means.mean())
+    rng = np.random.default_rng(seed)
+
+    if len(keys) >= PAIRED_MIN_PROMPTS:
+        method = "paired"
+        base_boot, cand_boot = _paired_replicates(base_means, cand_means, n_boot, rng)
+        diffs = cand_means - base_means
+        sd = float(diffs.std(ddof=1))
+    else:
+        method = "stratified"
+        base_boot = _stratified_replicates(base_groups, n_boot, rng)
+        cand_boot = _stratified_replicates(cand_groups, n_boot, rng)
+        # Pooled within-prompt standard deviation of both runs
+        residuals = np.concatenate([g - g.mean() for g in base_groups + cand_groups])
+        dof = len(residuals) - 2 * len(keys)
+        sd = float(math.sqrt((residuals ** 2).sum() / dof)) if dof > 0 else 0.0
+
+    delta = cand_mean - base_mean
+    result = {
+        "method": method,
+        "prompts": len(keys),
+        "baseline_n": sum(len(g) for g in base_groups),
+        "candidate_n": sum(len(g) for g in cand_groups),
+        "baseline_mean": base_mean,
+        "candidate_mean": cand_mean,
+        "delta": delta,
+        "delta_ci": _percentile_ci(cand_boot - base_boot, confidence),
+        "relative": delta / base_mean if base_mean else None,
+        "relative_ci": None,
+        "cohens_d": delta / sd if sd > 0 else None,
+    }
+    if base_mean and np.all(base_boot != 0):
+        result["relative_ci"] = _percentile_ci(cand_boot / base_boot - 1, confidence)
+    return result
+
+
+def verdict(result, direction, threshold=DEFAULT_THRESHOLD):
+    if result is None or result["relative"] is None or result["relative_ci"] is None:
+        return "inconclusive"
+    sign = -1 if direction == "higher" else 1
+    # Relative change in the worse direction, with its CI
+    worse = sign * result["relative"]
+    lo, hi = sorted(sign * v for v in result["relative_ci"])
+    if lo > 0 and worse > threshold:
+        return "regression"
+    if hi < 0 and worse < -threshold:
+        return "improvement"
+    if -threshold <= lo and hi <= threshold:
+        return "no change"
+    return "inconclusive"
+
+
+def compare(baseline, candidate, metrics, n_boot=DEFAULT_BOOTSTRAP, threshold=DEFAULT_THRESHOLD,
+            confidence=0.95, seed=0):
+    """
+    baseline, candidate: group_by_prompt() results. metrics: {name: direction}.
+    Returns {metric: result with "direction" and "verdict"}.
+    """
+    out = {}
+    for name, direction in metrics.items():
+        result = bootstrap(baseline.get(name, {}), candidate.get(name, {}), n_boot, confidence, seed)
+        if result is None:
+            out[name] = {"direction": direction, "verdict": "missing"}
+            continue
+        out[name] = dict(result, direction=direction, verdict=verdict(result, direction, threshold))
+    return out
+
+###############################################################################
+# Report
+###############################################################################
+def print_report(name, comparison):
+    print(f"\n{name}")
+    print(f"{'metric':<28}{'prompts':>8}{'baseline':>13}{'candidate':>13}"
+          f"{'change':>9}{'95% CI':>20}{'d':>7}  verdict")
+    for metric, r in comparison.items():
+        if r["verdict"] == "missing":
+            print(f"{metric:<28}{'-':>8}{'':>70}  not in both runs")
+            continue
+        rel = f"{r['relative'] * 100:+.1f}%" if r["relative"] is not None else "-"
+        ci = (f"[{r['relative_ci'][0] * 100:+.1f}%, {r['relative_ci'][1] * 100:+.1f}%]"
+              if r["relative_ci"] is not None else "-")
+        d = f"{r['cohens_d']:.2f}" if r["cohens_d"] is not None else "-"
+        print(f"{metric:<28}{r['prompts']:>8}{r['baseline_mean']:>13.4g}{r['candidate_mean']:>13.4g}"
+              f"{rel:>9}{ci:>20}{d:>7}  {r['verdict']}")
+
+###############################################################################
+# MAIN
+###############################################################################
+def parse_metrics(items):
+    """
+    ["tokens_per_second", "ttft:lower", ...] -> {name: direction}; metrics
+    without a direction take the default one, or "lower".
+    """
+    if not items:
+        return dict(DEFAULT_METRICS)
+    metrics = {}
+    for item in items:
+        name, _, direction = item.partition(":")
+        direction = direction or DEFAULT_METRICS.get(name, "lower")
+        if direction not in ("higher", "lower"):
+            raise ValueError(f"Direction of {name} must be higher or lower")
+        metrics[name] = direction
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare runs with bootstrap confidence intervals")
+    parser.add_argument("baseline", help="baseline run: file[#key=value,...]")
+    parser.add_argument("candidates", nargs="+", help="runs compared against the baseline")
+    parser.add_argument("--metrics", nargs="*", help="name[:higher|lower] (default: a standard set)")
+    parser.add_argument("--bootstrap", type=int, default=DEFAULT_BOOTSTRAP, help="resamples")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="smallest relative change that counts")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the comparison as JSON")
+    args = parser.parse_args()
+
+    if np is None:
+        parser.error("compare_runs needs NumPy (pip install numpy)")
+    if args.bootstrap < MIN_BOOTSTRAP:
+        parser.error(f"--bootstrap must be at least {MIN_BOOTSTRAP}")
+    try:
+        metrics = parse_metrics(args.metrics)
+    except ValueError as e:
+        parser.error(str(e))
+
+    baseline = load_run(args.baseline, metrics)
+    report = {"baseline": args.baseline, "threshold": args.threshold, "comparisons": {}}
+    for spec in args.candidates:
+        comparison = compare(baseline, load_run(spec, metrics), metrics,
+                             args.bootstrap, args.threshold, args.confidence, args.seed)
+        report["comparisons"][spec] = comparison
+        print_report(f"{args.baseline} -> {spec}", comparison)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    regressions = [
+        f"{spec}: {metric}"
+        for spec, comparison in report["comparisons"].items()
+        for metric, r in comparison.items() if r["verdict"] == "regression"
+    ]
+    if regressions:
+        print(f"\nRegressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
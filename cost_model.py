@@ -0,0 +1,497 @@
+# Request cost prediction fitted from logged metrics
+#
+# Predicts the latency and energy of a request before it runs, for routing,
+# capacity planning and the scheduler's queue-wait estimates. Each (node,
+# model) pair gets its own cost model, built from these fits:
+#   prompt tokens     prompt_eval_count ~ prompt characters (there is no
+#                     tokenizer here; CHARS_PER_TOKEN until fitted)
+#   prompt eval time  prompt_eval_duration ~ prompt tokens
+#   decode time       eval_duration ~ output tokens
+#   load time         load_duration, separately for cold and warm starts
+#   overhead          the rest of local_inference_time_s (HTTP, sampling)
+#   energy            total_energy_j ~ prompt tokens + output tokens + load time
+#   output tokens     mean eval_count, used when max_tokens does not bound it
+#
+# The fits are least squares, updated one row at a time, and older rows lose
+# weight by COST_MODEL_DECAY per new row, so the models follow a device that
+# heats up or a runtime upgrade. They start from the newest rows of the store,
+# then CostModel works as a metrics writer sink: every completed request is
+# first predicted (using its actual output length and start type), its
+# prediction error is recorded, and only then is it added to the fits.
+#
+# Settings (environment variables):
+#   COST_MODEL_HISTORY_ROWS  newest stored rows fitted at startup     (default 5000)
+#   COST_MODEL_DECAY         weight an older row keeps per new row    (default 0.995,
+#                            i.e. the last ~200 requests dominate)
+#   COST_MODEL_MIN_SAMPLES   rows before a model gives estimates      (default 5)
+#
+# Run:
+#   python cost_model.py fit --db metrics.db
+#   python cost_model.py fit --csv metrics_log.csv --model llama3.2:1b-instruct-q4_K_M
+#   python cost_model.py estimate --db metrics.db --model <model> --prompt "..." --max-tokens 256
+
+import argparse
+import csv
+import json
+import os
+import threading
+
+from model_manager import classify_start
+
+###############################################################################
+# SETTINGS
+###############################################################################
+COST_MODEL_HISTORY_ROWS = int(os.environ.get("COST_MODEL_HISTORY_ROWS", 5000))
+COST_MODEL_DECAY = float(os.environ.get("COST_MODEL_DECAY", 0.995))
+COST_MODEL_MIN_SAMPLES = int(os.environ.get("COST_MODEL_MIN_SAMPLES", 5))
+
+# Prompt length -> tokens before the node has its own fit
+CHARS_PER_TOKEN = 4.0
+
+# Stored columns the fits read (besides the prompt text)
+HISTORY_COLUMNS = [
+    "node_id", "model", "prompt_eval_count", "eval_count", "prompt_eval_duration_ns",
+    "eval_duration_ns", "load_duration_ns", "local_inference_time_s", "total_energy_j",
+    "start_type", "context_tokens_sent",
+]
+
+
+def _number(row, name):
+    """
+    Row value as a float; None when missing or empty (CSV rows are strings).
+    """
+    value = row.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+###############################################################################
+# Online least squares
+###############################################################################
+class LinearFit:
+    """
+    y ~ intercept + slopes . x over exponentially weighted rows, kept as
+    running means and co-moments (Welford), so updates are O(features^2) and
+    stable. With no features it is a weighted mean. A feature that has not
+    varied gets slope 0.
+    """
+    def __init__(self, n_features, decay=COST_MODEL_DECAY):
+        self.n_features = n_features
+        self.decay = decay
+        self.count = 0
+        self.weight = 0.0
+        self.mean = [0.0] * (n_features + 1)           # features, then y
+        self.comoment = [[0.0] * (n_features + 1) for _ in range(n_features + 1)]
+        self._coefficients = None
+
+    def add(self, x, y):
+        values = list(x) + [y]
+        self.count += 1
+        self.weight = self.decay * self.weight + 1.0
+        before = [v - m for v, m in zip(values, self.mean)]
+        self.mean = [m + d / self.weight for m, d in zip(self.mean, before)]
+        after = [v - m for v, m in zip(values, self.mean)]
+        for row, b in zip(self.comoment, before):
+            for j, a in enumerate(after):
+                row[j] = self.decay * row[j] + b * a
+        self._coefficients = None
+
+    def coefficients(self):
+        """
+        (intercept, slopes), cached until the next add().
+        """
+        if self._coefficients is None:
+            self._coefficients = self._solve()
+        return self._coefficients
+
+    def _solve(self):
+        k = self.n_features
+        c = self.comoment
+        varied = [
+            i for i in range(k)
+            if c[i][i] > 1e-12 * max(1.0, self.mean[i] ** 2) * self.weight
+        ]
+        slopes = [0.0] * k
+        if varied:
+            # Normal equations on the centred co-moments, a touch of ridge
+            # against features that move together (e.g. a fixed prompt/output ratio)
+            a = [[c[i][j] + (1e-9 * c[i][i] if i == j else 0.0) for j in varied] + [c[i][k]]
+                 for i in varied]
+            n = len(varied)
+            for col in range(n):
+                pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+                a[col], a[pivot] = a[pivot], a[col]
+                for r in range(col + 1, n):
+                    f = a[r][col] / a[col][col]
+                    for j in range(col, n + 1):
+                        a[r][j] -= f * a[col][j]
+            solution = [0.0] * n
+            for r in reversed(range(n)):
+                solution[r] = (a[r][n] - sum(a[r][j] * solution[j] for j in range(r + 1, n))) / a[r][r]
+            for i, s in zip(varied, solution):
+                slopes[i] = s
+        intercept = self.mean[k] - sum(s * m for s, m in zip(slopes, self.mean))
+        return intercept, slopes
+
+    def predict(self, x=()):
+        intercept, slopes = self.coefficients()
+        return intercept + sum(s * v for s, v in zip(slopes, x))
+
+
+class ErrorStats:
+    """
+    Exponentially weighted prediction errors (predicted - actual).
+    """
+    def __init__(self, decay=COST_MODEL_DECAY):
+        self.decay = decay
+        self.count = 0
+        self.weight = 0.0
+        self.error_sum = 0.0
+        self.abs_error_sum = 0.0
+        self.abs_pct_sum = 0.0
+        self.pct_weight = 0.0
+        self.last = None
+
+    def add(self, predicted, actual):
+        error = predicted - actual
+        self.count += 1
+        self.weight = self.decay * self.weight + 1.0
+        self.error_sum = self.decay * self.error_sum + error
+        self.abs_error_sum = self.decay * self.abs_error_sum + abs(error)
+        self.pct_weight *= self.decay
+        self.abs_pct_sum *= self.decay
+        if actual > 0:
+            self.pct_weight += 1.0
+            self.abs_pct_sum += abs(error) / actual
+        self.last = {"predicted": predicted, "actual": actual}
+
+    def to_json(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "bias": self.error_sum / self.weight,
+            "mean_abs_error": self.abs_error_sum / self.weight,
+            "mean_abs_pct_error": self.abs_pct_sum / self.pct_weight if self.pct_weight else None,
+            "last": self.last,
+        }
+
+###############################################################################
+# Cost model of one (node, model)
+###############################################################################
+class _ModelCost:
+    def __init__(self, decay):
+        self.tokens = LinearFit(1, decay)        # prompt tokens ~ prompt chars
+        self.prompt_eval = LinearFit(1, decay)   # seconds ~ prompt tokens
+        self.decode = LinearFit(1, decay)        # seconds ~ output tokens
+        self.cold_load = LinearFit(0, decay)     # seconds
+        self.warm_load = LinearFit(0, decay)
+        self.overhead = LinearFit(0, decay)      # seconds
+        self.output = LinearFit(0, decay)        # output tokens
+        self.energy = LinearFit(3, decay)        # joules ~ prompt tokens, output tokens, load s
+        self.latency_error = ErrorStats(decay)
+        self.energy_error = ErrorStats(decay)
+
+    def output_tokens(self, max_tokens):
+        output_tokens = max(0.0, self.output.predict())
+        return min(output_tokens, max_tokens) if max_tokens else output_tokens
+
+    def prompt_tokens(self, chars, min_samples):
+        if self.tokens.count >= min_samples:
+            return max(1.0, self.tokens.predict([chars]))
+        return max(1.0, chars / CHARS_PER_TOKEN)
+
+    def predict(self, prompt_tokens, output_tokens, cold):
+        load = self.cold_load if cold and self.cold_load.count else self.warm_load
+        breakdown = {
+            "load": max(0.0, load.predict()) if load.count else 0.0,
+            "prompt_eval": max(0.0, self.prompt_eval.predict([prompt_tokens])),
+            "decode": max(0.0, self.decode.predict([output_tokens])),
+            "overhead": max(0.0, self.overhead.predict()) if self.overhead.count else 0.0,
+        }
+        energy = None
+        if self.energy.count:
+            energy = max(0.0, self.energy.predict([prompt_tokens, output_tokens, breakdown["load"]]))
+        return sum(breakdown.values()), energy, breakdown
+
+    def observe(self, row, min_samples):
+        prompt_tokens = _number(row, "prompt_eval_count")
+        output_tokens = _number(row, "eval_count")
+        prompt_ns = _number(row, "prompt_eval_duration_ns")
+        eval_ns = _number(row, "eval_duration_ns")
+        if None in (prompt_tokens, output_tokens, prompt_ns, eval_ns):
+            return
+        load_s = (_number(row, "load_duration_ns") or 0.0) / 1e9
+        latency_s = _number(row, "local_inference_time_s")
+        energy_j = _number(row, "total_energy_j")
+        cold = (row.get("start_type") or classify_start(load_s * 1e9)) == "cold"
+        prompt = row.get("prompt")
+        chars = len(prompt) if isinstance(prompt, str) and prompt else None
+
+        # Score the prediction this request would have had, before learning from it
+        if self.decode.count >= min_samples:
+            predicted_tokens = self.prompt_tokens(chars, min_samples) if chars else prompt_tokens
+            latency, energy, _ = self.predict(predicted_tokens, output_tokens, cold)
+            if latency_s is not None:
+                self.latency_error.add(latency, latency_s)
+            if energy is not None and energy_j is not None:
+                self.energy_error.add(energy, energy_j)
+
+        # A session turn's prompt_eval_count is not its prompt's token count
+        if chars and prompt_tokens > 0 and not _number(row, "context_tokens_sent"):
+            self.tokens.add([chars], prompt_tokens)
+        self.prompt_eval.add([prompt_tokens], prompt_ns / 1e9)
+        self.decode.add([output_tokens], eval_ns / 1e9)
+        (self.cold_load if cold else self.warm_load).add((), load_s)
+        self.output.add((), output_tokens)
+        if latency_s is not None:
+            self.overhead.add((), latency_s - load_s - (prompt_ns + eval_ns) / 1e9)
+        if energy_j is not None:
+            self.energy.add([prompt_tokens, output_tokens, load_s], energy_j)
+
+    def to_json(self):
+        tokens_a, (tokens_b,) = self.tokens.coefficients()
+        prompt_a, (prompt_b,) = self.prompt_eval.coefficients()
+        decode_a, (decode_b,) = self.decode.coefficients()
+        energy_a, energy_b = self.energy.coefficients()
+        return {
+            "samples": self.decode.count,
+            "cold_samples": self.cold_load.count,
+            "prompt_tokens": {"samples": self.tokens.count, "fixed": tokens_a, "per_char": tokens_b},
+            "prompt_eval_s": {"fixed": prompt_a, "per_token": prompt_b},
+            "decode_s": {"fixed": decode_a, "per_token": decode_b},
+            "cold_load_s": self.cold_load.predict() if self.cold_load.count else None,
+            "warm_load_s": self.warm_load.predict() if self.warm_load.count else None,
+            "overhead_s": self.overhead.predict() if self.overhead.count else None,
+            "mean_output_tokens": self.output.predict(),
+            "energy_j": {
+                "samples": self.energy.count,
+                "fixed": energy_a,
+                "per_prompt_token": energy_b[0],
+                "per_output_token": energy_b[1],
+                "per_load_s": energy_b[2],
+            },
+            "error": {
+                "latency_s": self.latency_error.to_json(),
+                "energy_j": self.energy_error.to_json(),
+            },
+        }
+
+###############################################################################
+# CostModel
+###############################################################################
+class CostModel:
+    """
+    Cost models of every (node, model) seen, and a metrics writer sink
+    (write_batch/close) that keeps them current. With node_id set, every row
+    counts for that node (a node's own log, where older rows carry no
+    node_id); without it rows are keyed by their node_id (the collector).
+    """
+    def __init__(self, node_id=None, decay=COST_MODEL_DECAY, min_samples=COST_MODEL_MIN_SAMPLES):
+        self.node_id = node_id
+        self.decay = decay
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._models = {}       # (node, model) -> _ModelCost
+
+    def write_batch(self, rows):
+        with self._lock:
+            for row in rows:
+                model = row.get("model")
+                if not model:
+                    continue
+                key = (self.node_id or row.get("node_id") or "", model)
+                cost = self._models.get(key)
+                if cost is None:
+                    cost = self._models[key] = _ModelCost(self.decay)
+                cost.observe(row, self.min_samples)
+
+    def close(self):
+        pass
+
+    def load_history(self, store, limit=COST_MODEL_HISTORY_ROWS):
+        """
+        Fits the newest `limit` rows of a MetricsStore, oldest first.
+        Returns the number of rows read.
+        """
+        rows = store.query(columns=HISTORY_COLUMNS, limit=limit, include_text=True, latest=True)
+        self.write_batch(rows)
+        return len(rows)
+
+    def _ready(self, node, model):
+        """
+        The cost model of (node, model) once it has min_samples rows. Must
+        hold self._lock.
+        """
+        cost = self._models.get((node or "", model))
+        if cost is None or cost.decode.count < self.min_samples:
+            return None
+        return cost
+
+    def latency_s(self, node, model, prompt, max_tokens=None):
+        """
+        Expected warm-start latency alone, or None; cheap enough for the
+        request path (the scheduler's wait estimates).
+        """
+        with self._lock:
+            cost = self._ready(node, model)
+            if cost is None:
+                return None
+            prompt_tokens = cost.prompt_tokens(len(prompt), self.min_samples)
+            return cost.predict(prompt_tokens, cost.output_tokens(max_tokens), False)[0]
+
+    def prompt_eval_s_per_token(self, node, model):
+        """
+        Fitted marginal prompt-eval time per token, or None without a fit.
+        """
+        with self._lock:
+            cost = self._ready(node, model)
+            if cost is None:
+                return None
+            slope = cost.prompt_eval.coefficients()[1][0]
+            return slope if slope > 0 else None
+
+    def nodes(self, model):
+        with self._lock:
+            return sorted(node for node, m in self._models if m == model)
+
+    def estimate(self, node, model, prompt=None, prompt_tokens=None, max_tokens=None, cold=False):
+        """
+        Predicted latency and energy of one request, or None until the model
+        has min_samples rows on that node. Output length is the mean seen so
+        far, capped at max_tokens; with max_tokens the cost of using them all
+        is reported too.
+        """
+        with self._lock:
+            cost = self._ready(node, model)
+            if cost is None:
+                return None
+            if prompt_tokens is None:
+                prompt_tokens = cost.prompt_tokens(len(prompt or ""), self.min_samples)
+            output_tokens = cost.output_tokens(max_tokens)
+            latency_s, energy_j, breakdown = cost.predict(prompt_tokens, output_tokens, cold)
+            estimate = {
+                "node": node,
+                "model": model,
+                "samples": cost.decode.count,
+                "cold": cold,
+                "prompt_tokens": round(prompt_tokens),
+                "output_tokens": round(output_tokens),
+                "latency_s": latency_s,
+                "energy_j": energy_j,
+                "breakdown_s": breakdown,
+                "error": {
+                    "latency_s": cost.latency_error.to_json(),
+                    "energy_j": cost.energy_error.to_json(),
+                },
+            }
+            if max_tokens:
+                estimate["max_tokens"] = max_tokens
+                estimate["max_latency_s"], estimate["max_energy_j"], _ = cost.predict(
+                    prompt_tokens, max_tokens, cold
+                )
+        return estimate
+
+    def describe(self, model=None):
+        """
+        Fitted coefficients and prediction errors, as {node: {model: ...}}.
+        """
+        with self._lock:
+            described = {}
+            for (node, m), cost in sorted(self._models.items()):
+                if model in (None, m):
+                    described.setdefault(node, {})[m] = cost.to_json()
+            return described
+
+
+def parse_estimate_request(data):
+    """
+    Keyword arguments for CostModel.estimate() from a POST /estimate body:
+    prompt or prompt_tokens, optional max_tokens (or options.num_predict)
+    and cold. Raises ValueError with a client-facing message.
+    """
+    prompt = data.get("prompt")
+    prompt_tokens = data.get("prompt_tokens")
+    if prompt is not None and not isinstance(prompt, str):
+        raise ValueError("prompt must be a string")
+    if prompt_tokens is not None and (
+            isinstance(prompt_tokens, bool) or not isinstance(prompt_tokens, int) or prompt_tokens < 0):
+        raise ValueError("prompt_tokens must be a non-negative integer")
+    if not prompt and prompt_tokens is None:
+        raise ValueError("prompt or prompt_tokens is required")
+    options = data.get("options") or {}
+    if not isinstance(options, dict):
+        raise ValueError("options must be an object")
+    max_tokens = data.get("max_tokens", options.get("num_predict"))
+    if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int)):
+        raise ValueError("max_tokens must be an integer")
+    cold = data.get("cold")
+    if cold is not None and not isinstance(cold, bool):
+        raise ValueError("cold must be true or false")
+    # num_predict -1 means no limit in Ollama
+    return {
+        "prompt": prompt,
+        "prompt_tokens": prompt_tokens,
+        "max_tokens": max_tokens if max_tokens and max_tokens > 0 else None,
+        "cold": cold,
+    }
+
+###############################################################################
+# MAIN
+###############################################################################
+def _history(args):
+    if args.csv:
+        with open(args.csv, "r", newline="", encoding="utf-8") as f:
+            rows = [row for row in csv.DictReader(f) if args.model in (None, row.get("model"))]
+        return rows[-args.rows:]
+    from metrics_store import MetricsStore
+    rows = MetricsStore(args.db).query(
+        model=args.model, columns=HISTORY_COLUMNS, limit=args.rows, include_text=True, latest=True
+    )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit request cost models from logged metrics")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("fit", "print fitted models and their replay error"),
+                            ("estimate", "predict one request")):
+        p = sub.add_parser(name, help=help_text)
+        source = p.add_mutually_exclusive_group()
+        source.add_argument("--db", default=os.environ.get("METRICS_DB", "metrics.db"))
+        source.add_argument("--csv")
+        p.add_argument("--model")
+        p.add_argument("--rows", type=int, default=COST_MODEL_HISTORY_ROWS)
+        p.add_argument("--decay", type=float, default=COST_MODEL_DECAY)
+    p_est = sub.choices["estimate"]
+    p_est.add_argument("--node", help="node id (default: the only node in the history)")
+    p_est.add_argument("--prompt", default="")
+    p_est.add_argument("--prompt-tokens", type=int)
+    p_est.add_argument("--max-tokens", type=int)
+    p_est.add_argument("--cold", action="store_true")
+    args = parser.parse_args()
+
+    model = CostModel(decay=args.decay)
+    model.write_batch(_history(args))
+    if args.command == "fit":
+        print(json.dumps(model.describe(args.model), indent=4))
+        return
+
+    if not args.model or (not args.prompt and args.prompt_tokens is None):
+        parser.error("estimate needs --model and --prompt or --prompt-tokens")
+    nodes = [args.node] if args.node is not None else model.nodes(args.model)
+    if not nodes:
+        raise SystemExit(f"No history for {args.model}")
+    if len(nodes) > 1:
+        parser.error(f"--node is required, history has: {', '.join(nodes)}")
+    estimate = model.estimate(nodes[0], args.model, args.prompt, args.prompt_tokens,
+                              args.max_tokens, args.cold)
+    if estimate is None:
+        raise SystemExit(f"Not enough history for {args.model}")
+    print(json.dumps(estimate, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+# Fleet mode: edge nodes push their metrics to one collector
+#
+# Node side: with FLEET_COLLECTOR_URL set, FleetPushSink joins the metrics
+# writer's sinks. Every batch of finished rows is wrapped with the node's id
+# and hardware profile, gzip-compressed and handed to a sender thread that
+# POSTs it to the collector's /fleet/ingest. While the collector is
+# unreachable, batches are spooled to FLEET_SPOOL_DIR and re-sent oldest first
+# with exponential backoff; batches still unsent at shutdown are spooled too.
+# The collector ignores rows it already has (by request_id), so a batch sent
+# twice after a lost reply is harmless.
+#
+# Collector side: a small service on the same store and summary code,
+#   python fleet.py collector --port 6000 --db fleet.db
+# merging every node's rows into one indexed SQLite store and keeping
+# per-node and fleet-wide per-model summaries:
+#   POST /fleet/ingest    gzip JSON batch from a node
+#   GET  /fleet/nodes     nodes seen, with hardware and push counters
+#   GET  /fleet/summary   ?node=&model=&window_s=&quantiles=
+#   GET  /metrics/query   as on a node, plus ?node=
+#   POST /estimate        per-node latency/energy predictions, fastest first
+#   GET  /estimate/models per-node cost model fits (see cost_model.py)
+#
+# Settings (environment variables):
+#   NODE_ID                 this node's id in every row      (default: host name)
+#   FLEET_COLLECTOR_URL     collector base URL; unset disables pushing
+#   FLEET_SPOOL_DIR         spool for unsent batches         (default fleet_spool)
+#   FLEET_SPOOL_MAX_BYTES   oldest batches are dropped past this (default 100 MB)
+#   FLEET_MAX_PENDING       batches held in memory before spooling (default 64)
+#   FLEET_RETRY_S           first retry delay, doubled up to FLEET_RETRY_MAX_S
+#                           (defaults 2 and 300)
+#   FLEET_TIMEOUT_S         HTTP timeout per push            (default 10)
+#   FLEET_SEND_TEXT         0 = leave prompt and response out of pushed rows (default 1)
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import platform
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+
+import psutil
+import requests
+import uvicorn
+from asgiref.wsgi import WsgiToAsgi
+from flask import Flask, request, jsonify
+
+from cost_model import CostModel, parse_estimate_request
+from metrics_store import MetricsStore
+from metrics_summary import MetricsSummary, DEFAULT_QUANTILES
+from metrics_writer import CSV_FIELDNAMES
+from power_sources import POWER_SOURCE, DEVICE_PROFILE
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# SETTINGS
+###############################################################################
+NODE_ID = os.environ.get("NODE_ID") or socket.gethostname()
+FLEET_COLLECTOR_URL = os.environ.get("FLEET_COLLECTOR_URL") or None
+FLEET_SPOOL_DIR = os.environ.get("FLEET_SPOOL_DIR", "fleet_spool")
+FLEET_SPOOL_MAX_BYTES = int(os.environ.get("FLEET_SPOOL_MAX_BYTES", 100 * 1024 * 1024))
+FLEET_MAX_PENDING = int(os.environ.get("FLEET_MAX_PENDING", 64))
+FLEET_RETRY_S = float(os.environ.get("FLEET_RETRY_S", 2.0))
+FLEET_RETRY_MAX_S = float(os.environ.get("FLEET_RETRY_MAX_S", 300.0))
+FLEET_TIMEOUT_S = float(os.environ.get("FLEET_TIMEOUT_S", 10.0))
+FLEET_SEND_TEXT = os.environ.get("FLEET_SEND_TEXT", "1") == "1"
+
+PUSHED_FIELDS = [f for f in CSV_FIELDNAMES if FLEET_SEND_TEXT or f not in ("prompt", "response")]
+# unix_time keeps the collector's time index exact
+PUSHED_FIELDS.append("unix_time")
+
+
+def hardware_profile():
+    return {
+        "system": platform.system(),
+        "release": platform.release(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "ram_mb": round(psutil.virtual_memory().total / (1024**2)),
+        "power_source": POWER_SOURCE,
+        "device_profile": DEVICE_PROFILE,
+    }
+
+
+def encode_batch(node, rows):
+    """
+    gzip JSON body of one push: {"node": {...}, "batch_id": ..., "rows": [...]}.
+    """
+    body = {
+        "node": node,
+        "batch_id": uuid.uuid4().hex,
+        "sent_at": time.time(),
+        "rows": [{f: row.get(f) for f in PUSHED_FIELDS if row.get(f) not in (None, "")} for row in rows],
+    }
+    return gzip.compress(json.dumps(body).encode("utf-8"), compresslevel=6)
+
+###############################################################################
+# Node side
+###############################################################################
+class FleetPushSink:
+    """
+    Metrics writer sink: write_batch() only compresses the batch and queues
+    it; a sender thread owns the network and the spool.
+    """
+    def __init__(self, collector_url, node_id=NODE_ID, spool_dir=FLEET_SPOOL_DIR,
+                 spool_max_bytes=FLEET_SPOOL_MAX_BYTES, max_pending=FLEET_MAX_PENDING,
+                 retry_s=FLEET_RETRY_S, retry_max_s=FLEET_RETRY_MAX_S, timeout_s=FLEET_TIMEOUT_S):
+        self.url = collector_url.rstrip("/") + "/fleet/ingest"
+        self.node = {"node_id": node_id, "hardware": hardware_profile()}
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self.max_pending = max_pending
+        self.retry_s = retry_s
+        self.retry_max_s = retry_max_s
+        self.timeout_s = timeout_s
+
+        self._pending = deque()           # (payload, row count), oldest first
+        self._lock = threading.Lock()
+        # The writer thread spools when the queue is full, the sender when a push fails
+        self._spool_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._session = requests.Session()
+
+        self.batches_sent = 0
+        self.rows_sent = 0
+        self.send_errors = 0
+        self.batches_spooled = 0
+        self.batches_dropped = 0
+        self.last_error = None
+        self.last_sent_at = None
+
+    # ----------- Writer thread -----------
+    def write_batch(self, rows):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="fleet-push", daemon=True)
+            self._thread.start()
+        payload = encode_batch(self.node, rows)
+        with self._lock:
+            if len(self._pending) < self.max_pending:
+                self._pending.append((payload, len(rows)))
+                payload = None
+        if payload is not None:
+            self._spool(payload, len(rows))
+        self._wake.set()
+
+    def close(self):
+        """
+        Stops the sender, then makes one last attempt to send; what is still
+        unsent stays in the spool for the next start.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout_s + 5)
+        self._drain()
+
+    # ----------- Spool -----------
+    def _spool_files(self):
+        if not os.path.isdir(self.spool_dir):
+            return []
+        return sorted(name for name in os.listdir(self.spool_dir) if name.endswith(".json.gz"))
+
+    def _spool(self, payload, n_rows):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        # Time-ordered names; the row count rides along for the stats
+        name = f"{time.time_ns():020d}-{n_rows}.json.gz"
+        tmp_path = os.path.join(self.spool_dir, name + ".tmp")
+        with self._spool_lock:
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(self.spool_dir, name))
+            self.batches_spooled += 1
+            self._trim_spool()
+
+    def _trim_spool(self):
+        files = self._spool_files()
+        sizes = [os.path.getsize(os.path.join(self.spool_dir, name)) for name in files]
+        total = sum(sizes)
+        for name, size in zip(files, sizes):
+            if total <= self.spool_max_bytes:
+                break
+            os.remove(os.path.join(self.spool_dir, name))
+            total -= size
+            self.batches_dropped += 1
+            logger.warning(f"Fleet spool over {self.spool_max_bytes} bytes; dropped {name}")
+
+    # ----------- Sender thread -----------
+    def _send(self, payload):
+        response = self._session.post(
+            self.url, data=payload, timeout=self.timeout_s,
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+        # 4xx other than 429: the collector will never take this batch
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            logger.error(f"Collector rejected a batch ({response.status_code}): {response.text[:200]}")
+            return
+        response.raise_for_status()
+
+    def _drain(self):
+        """
+        Sends spooled batches, then queued ones, oldest first. Returns False
+        on the first failure, leaving the rest for the next attempt.
+        """
+        for name in self._spool_files():
+            path = os.path.join(self.spool_dir, name)
+            try:
+                with self._spool_lock, open(path, "rb") as f:
+                    payload = f.read()
+            except FileNotFoundError:
+                continue    # trimmed meanwhile
+            if not self._try_send(payload, int(name.split("-")[1].split(".")[0])):
+                return False
+            with self._spool_lock:
+                if os.path.exists(path):
+                    os.remove(path)
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return True
+                payload, n_rows = self._pending[0]
+            if not self._try_send(payload, n_rows):
+                # Keep memory bounded while the collector is away
+                with self._lock:
+                    spill = list(self._pending)
+                    self._pending.clear()
+                for item in spill:
+                    self._spool(*item)
+                return False
+            with self._lock:
+                self._pending.popleft()
+
+    def _try_send(self, payload, n_rows):
+        try:
+            self._send(payload)
+        except requests.RequestException as e:
+            self.send_errors += 1
+            self.last_error = str(e)
+            return False
+        self.batches_sent += 1
+        self.rows_sent += n_rows
+        self.last_sent_at = time.time()
+        return True
+
+    def _run(self):
+        delay = self.retry_s
+        while not self._stop.is_set():
+            if self._drain():
+                delay = self.retry_s
+                self._wake.wait()
+            else:
+                logger.warning(f"Fleet push failed ({self.last_error}); retrying in {delay:.0f}s")
+                self._stop.wait(delay)
+                delay = min(self.retry_max_s, delay * 2)
+            self._wake.clear()
+
+    def stats(self):
+        files = self._spool_files()
+        return {
+            "collector": self.url,
+            "node_id": self.node["node_id"],
+            "pending_batches": len(self._pending),
+            "spooled_batches": len(files),
+            "batches_sent": self.batches_sent,
+            "rows_sent": self.rows_sent,
+            "batches_spooled": self.batches_spooled,
+            "batches_dropped": self.batches_dropped,
+            "send_errors": self.send_errors,
+            "last_error": self.last_error,
+            "last_sent_at": self.last_sent_at,
+        }
+
+###############################################################################
+# Collector
+###############################################################################
+def create_collector_app(db_path):
+    """
+    Flask app of the collector, writing into the SQLite store at db_path.
+    """
+    app = Flask("fleet_collector")
+    store = MetricsStore(db_path)
+    store_lock = threading.Lock()      # one writer connection
+    fleet_summary = MetricsSummary()
+    node_summaries = {}
+    nodes = {}
+    nodes_lock = threading.Lock()
+    cost_model = CostModel()
+    logger.info(f"Cost models fitted from {cost_model.load_history(store)} stored requests")
+
+    @app.route('/fleet/ingest', methods=['POST'])
+    def ingest():
+        body = request.get_data()
+        try:
+            if request.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            batch = json.loads(body)
+            node_id = batch["node"]["node_id"]
+            rows = batch["rows"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            return jsonify({"error": f"Malformed batch: {e}"}), 400
+        if not node_id or not isinstance(rows, list):
+            return jsonify({"error": "node_id and rows are required"}), 400
+        received = len(rows)
+
+        for row in rows:
+            row["node_id"] = node_id
+        with store_lock:
+            # Rows of a batch re-sent after a lost reply are already stored
+            rows = store.write_batch(rows)
+        with nodes_lock:
+            node_summary = node_summaries.get(node_id)
+            if node_summary is None:
+                node_summary = node_summaries[node_id] = MetricsSummary()
+            info = nodes.setdefault(node_id, {"batches": 0, "rows": 0, "duplicate_rows": 0, "models": set()})
+            info["hardware"] = batch["node"].get("hardware")
+            info["batches"] += 1
+            info["rows"] += len(rows)
+            info["duplicate_rows"] += received - len(rows)
+            info["last_seen"] = time.time()
+            info["models"].update(row.get("model") for row in rows if row.get("model"))
+        for row in rows:
+            node_summary.observe(row)
+            fleet_summary.observe(row)
+        cost_model.write_batch(rows)
+        return jsonify({"batch_id": batch.get("batch_id"), "rows": received, "new_rows": len(rows)})
+
+    @app.route('/fleet/nodes', methods=['GET'])
+    def list_nodes():
+        with nodes_lock:
+            return jsonify({
+                node_id: dict(info, models=sorted(info["models"]))
+                for node_id, info in nodes.items()
+            })
+
+    @app.route('/fleet/summary', methods=['GET'])
+    def summary():
+        """
+        Per-node and fleet-wide per-model aggregates, by arrival at the collector.
+        """
+        args = request.args
+        try:
+            window_s = float(args["window_s"]) if "window_s" in args else None
+            quantiles = (
+                tuple(float(q) for q in args["quantiles"].split(",") if q)
+                if "quantiles" in args else DEFAULT_QUANTILES
+            )
+        except ValueError:
+            return jsonify({"error": "window_s and quantiles must be numbers"}), 400
+        model, node = args.get("model"), args.get("node")
+        with nodes_lock:
+            selected = {n: s for n, s in node_summaries.items() if node in (None, n)}
+        return jsonify({
+            "fleet": fleet_summary.summary(model, window_s, quantiles),
+            "nodes": {n: s.summary(model, window_s, quantiles) for n, s in selected.items()},
+        })
+
+    @app.route('/estimate', methods=['POST'])
+    def estimate():
+        """
+        A request's predicted cost on every node that has served its model
+        (or only on "node"), fastest first: the placement input for a router.
+        Same body as a node's POST /estimate; cold defaults to false.
+        """
+        data = request.get_json(silent=True) or {}
+        try:
+            kwargs = parse_estimate_request(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        model = data.get("model")
+        if not model or not isinstance(model, str):
+            return jsonify({"error": "model is required"}), 400
+        kwargs["cold"] = bool(kwargs["cold"])
+        node = data.get("node")
+        estimates = [
+            e for e in (
+                cost_model.estimate(n, model, **kwargs)
+                for n in ([node] if node else cost_model.nodes(model))
+            ) if e is not None
+        ]
+        if not estimates:
+            return jsonify({"error": f"No node has enough history for {model} yet"}), 404
+        estimates.sort(key=lambda e: e["latency_s"])
+        return jsonify({"model": model, "estimates": estimates})
+
+    @app.route('/estimate/models', methods=['GET'])
+    def estimate_models():
+        return jsonify(cost_model.describe(request.args.get("model")))
+
+    @app.route('/metrics/query', methods=['GET'])
+    def query():
+        args = request.args
+        columns = [c for c in args.get("columns", "").split(",") if c]
+        try:
+            rows = store.query(
+                model=args.get("model"), since=args.get("since"), until=args.get("until"),
+                tag=args.get("tag"), node=args.get("node"), columns=columns,
+                limit=args.get("limit", 1000), include_text=args.get("include_text") == "1",
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"count": len(rows), "rows": rows})
+
+    return app
+
+###############################################################################
+# MAIN
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Fleet metrics collector")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_col = sub.add_parser("collector", help="run the collector service")
+    p_col.add_argument("--host", default="0.0.0.0")
+    p_col.add_argument("--port", type=int, default=int(os.environ.get("PORT", 6000)))
+    p_col.add_argument("--db", default=os.environ.get("FLEET_DB", "fleet.db"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    app = create_collector_app(args.db)
+    logger.info(f"Fleet collector on port {args.port}, store {args.db}")
+    uvicorn.run(WsgiToAsgi(app), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
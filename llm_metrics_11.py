@@ -3,29 +3,42 @@
 # 8/1/2025
 # parthapratimray1986@gmail.com
 
-##### Modify base_power and max_power of your device ######
-# base_power = 2.7
-# max_power = 6.7
+##### Power measurement of your device ##################
+# Real sensors (RAPL, hwmon/INA2xx) are used when present.
+# Otherwise set base_power_w / max_power_w for your device
+# in device_profiles.json (see power_sources.py)
 ###########################################################
 
 # curl -X POST http://localhost:5000/process_prompt \
 #      -H "Content-Type: application/json" \
 #      -d '{ "prompt": "What is capital of India?" }'
 
-import psutil
-import threading
 import time
 import requests
 import logging
-from math import sqrt
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 
-import csv
+import json
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from asgiref.wsgi import WsgiToAsgi   # for WSGI -> ASGI wrapping
 import uvicorn                       # for running the server
 
+from resource_sampler import ResourceMonitor, SAMPLER
+from metrics_writer import MetricsWriter, CsvSink, flatten_metrics
+from metrics_store import MetricsStore, QUERY_MAX_ROWS
+from metrics_summary import MetricsSummary, DEFAULT_QUANTILES
+from metric_registry import NOVEL_METRICS
+from compare_runs import compare, group_by_prompt, parse_metrics, DEFAULT_BOOTSTRAP, DEFAULT_THRESHOLD, MIN_BOOTSTRAP
+from trace_store import TraceStore, TRACE_MODE, trace_record, downsample, parse_day
+from fleet import FleetPushSink, FLEET_COLLECTOR_URL, NODE_ID
+from cost_model import CostModel, parse_estimate_request
+from session_store import SessionStore, SESSION_ID_MAX_LENGTH
+from model_manager import ModelManager, classify_start
+from scheduler import Scheduler, Rejected, PRIORITIES
+
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
@@ -33,199 +46,75 @@ logger = logging.getLogger(__name__)
 # MODEL SETTINGS
 ###############################################################################
 MODEL_NAME = "llama3.2:1b-instruct-q4_K_M"
-CSV_FILENAME = "metrics_log.csv"
-
-###############################################################################
-# ResourceMonitor
-###############################################################################
-class ResourceMonitor:
-    """
-    Monitors system-wide CPU usage, memory usage, and approximates power consumption.
-    Gathers arrays so we can compute standard deviations, peaks, etc.
-    """
-    def __init__(self, interval=1.0):
-        self.interval = interval
-        self.running = False
-
-        self.cpu_usage_readings = []
-        self.mem_usage_readings = []
-        self.power_readings = []
-
-        self.monitor_thread = None
+# Ollama options a request may set, with their expected types
+OLLAMA_OPTIONS = {
+    "num_ctx": int,
+    "num_thread": int,
+    "num_predict": int,
+    "temperature": float,
+    "seed": int,
+}
+CSV_FILENAME = os.environ.get("METRICS_CSV", "metrics_log.csv")
+# csv | sqlite | both (SQLite is needed for GET /metrics/query)
+METRICS_BACKEND = os.environ.get("METRICS_BACKEND", "both")
+OLLAMA_API_URL = os.environ.get("OLLAMA_API_URL", "http://localhost:11434/api/generate")
+# (connect, read) timeouts for calls to Ollama; read is the longest pause
+# between two bytes, so it bounds a hung runner rather than a long generation
+OLLAMA_CONNECT_TIMEOUT_S = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT_S", 5))
+OLLAMA_READ_TIMEOUT_S = float(os.environ.get("OLLAMA_READ_TIMEOUT_S", 600))
+OLLAMA_TIMEOUT = (OLLAMA_CONNECT_TIMEOUT_S, OLLAMA_READ_TIMEOUT_S)
+# /process_batch: prompts sent to Ollama at once (match its OLLAMA_NUM_PARALLEL)
+BATCH_PARALLELISM = int(os.environ.get("BATCH_PARALLELISM", os.environ.get("OLLAMA_NUM_PARALLEL", 1)))
+BATCH_MAX_PROMPTS = int(os.environ.get("BATCH_MAX_PROMPTS", 10000))
+# Upper bound on a batch's "parallelism" (one worker thread each)
+BATCH_MAX_PARALLELISM = int(os.environ.get("BATCH_MAX_PARALLELISM", max(BATCH_PARALLELISM, 16)))
+# Server root for the model management calls (/api/ps, preload, unload)
+OLLAMA_BASE_URL = OLLAMA_API_URL.rsplit("/api/", 1)[0]
 
-    def start(self):
-        self.running = True
-        psutil.cpu_percent(interval=None)  # warm-up
-        self.monitor_thread = threading.Thread(target=self._monitor, daemon=True)
-        self.monitor_thread.start()
+# keep_alive policy, preloading and cold-start counts (see model_manager.py)
+MODEL_MANAGER = ModelManager(OLLAMA_BASE_URL)
 
-    def stop(self):
-        self.running = False
-        if self.monitor_thread:
-            self.monitor_thread.join()
+# Per-model slots and priority queues in front of Ollama (see scheduler.py)
+SCHEDULER = Scheduler()
 
-    def _monitor(self):
-        while self.running:
-            try:
-                cpu_percent = psutil.cpu_percent(interval=None)
-                self.cpu_usage_readings.append(cpu_percent)
-
-                mem_info = psutil.virtual_memory()
-                used_mb = (mem_info.total - mem_info.available) / (1024**2)
-                self.mem_usage_readings.append(used_mb)
-
-                # approximate power based on CPU usage
-                power_w = self._estimate_power(cpu_percent)
-                self.power_readings.append(power_w)
-
-                time.sleep(self.interval)
-            except Exception as e:
-                logger.error(f"Resource monitoring error: {e}")
-
-    @staticmethod
-    def _estimate_power(cpu_percent):
-        """
-        Approximate system power (Watts) from CPU usage on a Pi-like device.
-        Adjust base_power and max_power if you have real measurements.
-        """
-        base_power = 2.7
-        max_power = 6.7
-        return base_power + (max_power - base_power)*(cpu_percent/100)
-
-    # ----------- Accessors -----------
-    def get_cpu_usage_array(self):
-        return self.cpu_usage_readings
-
-    def get_avg_cpu(self):
-        if not self.cpu_usage_readings:
-            return 0
-        return sum(self.cpu_usage_readings) / len(self.cpu_usage_readings)
-
-    def get_peak_cpu(self):
-        return max(self.cpu_usage_readings) if self.cpu_usage_readings else 0
-
-    def get_avg_mem_mb(self):
-        if not self.mem_usage_readings:
-            return 0
-        return sum(self.mem_usage_readings) / len(self.mem_usage_readings)
-
-    def get_peak_mem_mb(self):
-        return max(self.mem_usage_readings) if self.mem_usage_readings else 0
-
-    def get_avg_power(self):
-        if not self.power_readings:
-            return 0
-        return sum(self.power_readings) / len(self.power_readings)
-
-    def get_peak_power(self):
-        return max(self.power_readings) if self.power_readings else 0
-
-    def get_min_power(self):
-        return min(self.power_readings) if self.power_readings else 0
-
-    def get_std_dev_memory(self):
-        if len(self.mem_usage_readings) < 2:
-            return 0
-        avg_m = self.get_avg_mem_mb()
-        var_m = sum((m - avg_m)**2 for m in self.mem_usage_readings)/(len(self.mem_usage_readings)-1)
-        return sqrt(var_m)
-
-    def get_std_dev_power(self):
-        if len(self.power_readings) < 2:
-            return 0
-        avg_p = self.get_avg_power()
-        var_p = sum((p - avg_p)**2 for p in self.power_readings)/(len(self.power_readings)-1)
-        return sqrt(var_p)
+# Ollama context of each conversation session (see session_store.py)
+SESSIONS = SessionStore()
 
 ###############################################################################
-# CSV Logging Utilities
+# CSV Logging
 ###############################################################################
-def log_metrics_to_csv(
-    timestamp_str,
-    model_name,
-    prompt,
-    response_text,
-    ollama_metrics,
-    resource_usage,
-    all_novel_metrics
-):
-    """
-    Appends a single row to a CSV file with all relevant metrics.
-    The columns (fieldnames) are defined in a fixed order.
-    """
-
-    # Combine all metrics into one dict for easy CSV writing
-    row_data = {}
-    row_data["timestamp"] = timestamp_str
-    row_data["model"] = model_name
-    row_data["prompt"] = prompt
-    row_data["response"] = response_text
-
-    # Ollama-based metrics
-    for k, v in ollama_metrics.items():
-        row_data[k] = v
-
-    # Resource usage metrics
-    for k, v in resource_usage.items():
-        row_data[k] = v
-
-    # Novel derived metrics
-    for k, v in all_novel_metrics.items():
-        row_data[k] = v
-
-    # Define a consistent column order
-    fieldnames = list(row_data.keys())
-
-    # Write or append to CSV
-    file_exists = os.path.isfile(CSV_FILENAME)
-    with open(CSV_FILENAME, mode='a', newline='', encoding='utf-8') as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        # If file is new, write header
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(row_data)
+# Rows are queued and written in batches by a background thread with a fixed,
+# versioned column list (see metrics_writer.py), to the CSV and/or the indexed
+# SQLite store (see metrics_store.py)
+METRICS_STORE = MetricsStore() if METRICS_BACKEND in ("sqlite", "both") else None
+# Per-request sample and token time series (TRACE_MODE=1)
+TRACE_STORE = TraceStore() if TRACE_MODE else None
+# Pushes every row to the fleet collector (FLEET_COLLECTOR_URL)
+FLEET_SINK = FleetPushSink(FLEET_COLLECTOR_URL) if FLEET_COLLECTOR_URL else None
+# Latency/energy predictions for POST /estimate and the scheduler (see cost_model.py)
+COST_MODEL = CostModel(NODE_ID)
+METRICS_WRITER = MetricsWriter(
+    ([CsvSink(CSV_FILENAME)] if METRICS_BACKEND in ("csv", "both") else [])
+    + ([METRICS_STORE] if METRICS_STORE else [])
+    + ([TRACE_STORE] if TRACE_STORE else [])
+    + ([FLEET_SINK] if FLEET_SINK else [])
+    + [COST_MODEL]
+)
+# Rolling per-model counters and quantile sketches for GET /metrics/summary
+METRICS_SUMMARY = MetricsSummary()
 
 ###############################################################################
-# FLASK APP
+# Metric Derivation
 ###############################################################################
-app = Flask(__name__)
-
-@app.route('/process_prompt', methods=['POST'])
-def process_prompt():
-    data = request.get_json() or {}
-    prompt = data.get("prompt")
-    if not prompt:
-        return jsonify({"error": "Prompt is required"}), 400
-
-    api_url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": MODEL_NAME,
-        "prompt": prompt,
-        "stream": False
-    }
-
-    # Start monitoring
-    monitor = ResourceMonitor(interval=1.0)
-    monitor.start()
-
-    start_time = time.time()
-    response = requests.post(api_url, json=payload)
-    end_time = time.time()
-
-    # Stop monitoring
-    monitor.stop()
-
-    if response.status_code != 200:
-        return jsonify({
-            "error": f"LLM API Error: {response.status_code}",
-            "details": response.text
-        }), response.status_code
-
+def derive_metrics(result_data, monitor, local_inference_time_s):
+    """
+    Turns the final Ollama JSON payload plus the resource monitor readings into
+    the three metric groups returned to the client and logged to CSV.
+    Returns (llm_response_text, ollama_metrics, resource_usage, all_novel_metrics).
+    """
     # -------------------------------------------------------------------------
     # 1) Parse Ollama-Based Metrics
     # -------------------------------------------------------------------------
-    result_data = response.json()
-
     # Attempt to capture text or "response" from the JSON (adjust if needed)
     llm_response_text = result_data.get("response", "")
 
@@ -247,8 +136,11 @@ def process_prompt():
         "load_duration_ns": load_duration_ns,
         "prompt_eval_duration_ns": prompt_eval_duration_ns,
         "eval_duration_ns": model_eval_duration_ns,
+        "prompt_eval_count": prompt_eval_count,
         "eval_count": eval_count,
-        "tokens_per_second": tokens_per_second
+        "tokens_per_second": tokens_per_second,
+        # Cold: the model had to be loaded for this request
+        "start_type": classify_start(load_duration_ns)
     }
 
     # -------------------------------------------------------------------------
@@ -262,199 +154,887 @@ def process_prompt():
         "avg_power_w": monitor.get_avg_power(),
         "peak_power_w": monitor.get_peak_power(),
         "min_power_w": monitor.get_min_power(),
+        "cpu_std_dev": monitor.get_std_dev_cpu(),
         "mem_std_dev": monitor.get_std_dev_memory(),
         "power_std_dev": monitor.get_std_dev_power(),
+        "sample_count": monitor.get_sample_count(),
+        "local_inference_time_s": local_inference_time_s,
     }
 
-    local_inference_time_s = end_time - start_time
-    total_energy_j = resource_usage["avg_power_w"] * local_inference_time_s
+    # Measured (energy counter) or integrated from timestamped power samples
+    total_energy_j = monitor.get_energy_j()
 
     # -------------------------------------------------------------------------
-    # 3) Derived "Novel" Metrics
+    # 3) Derived "Novel" Metrics (declared in metric_registry.py)
     # -------------------------------------------------------------------------
-    time_per_token_s = (total_duration_s / eval_count) if eval_count > 0 else 0
-    load_to_inference_ratio = (
-        load_duration_ns / model_eval_duration_ns if model_eval_duration_ns > 0 else 0
-    )
-    memory_usage_per_token_mb = (
-        resource_usage["avg_ram_usage_mb"] / eval_count if eval_count > 0 else 0
-    )
-    energy_per_token_j = (total_energy_j / eval_count) if eval_count > 0 else 0
-    power_spike_w = resource_usage["peak_power_w"] - resource_usage["min_power_w"]
-    prompt_eval_ratio = (
-        prompt_eval_duration_ns / total_duration_ns if total_duration_ns > 0 else 0
-    )
-    prompt_to_generation_overhead_ratio = (
-        prompt_eval_duration_ns / model_eval_duration_ns if model_eval_duration_ns > 0 else 0
-    )
-    power_efficiency_index = (
-        tokens_per_second / resource_usage["avg_power_w"] 
-        if resource_usage["avg_power_w"] > 0 else 0
+    all_novel_metrics = NOVEL_METRICS.evaluate(
+        {**ollama_metrics, **resource_usage, "total_energy_j": total_energy_j}
     )
 
-    # CPU stability
-    cpu_usage_array = monitor.get_cpu_usage_array()
-    cpu_stddev = 0
-    if len(cpu_usage_array) > 1:
-        mu_cpu = sum(cpu_usage_array)/len(cpu_usage_array)
-        var_cpu = sum((x - mu_cpu)**2 for x in cpu_usage_array) / (len(cpu_usage_array)-1)
-        cpu_stddev = sqrt(var_cpu)
-    denom_for_stability = max(100, resource_usage["avg_cpu_usage_percent"])
-    cpu_stability_index = 1 - (cpu_stddev / denom_for_stability)
-    if cpu_stability_index < 0:
-        cpu_stability_index = 0
-
-    model_efficiency_index = (
-        tokens_per_second / resource_usage["peak_ram_usage_mb"] 
-        if resource_usage["peak_ram_usage_mb"] > 0 else 0
-    )
-    peak_cpu_to_average_ratio = (
-        resource_usage["peak_cpu_usage_percent"] / resource_usage["avg_cpu_usage_percent"]
-        if resource_usage["avg_cpu_usage_percent"] > 0 else 0
-    )
-    memory_variation_index = (
-        resource_usage["mem_std_dev"] / resource_usage["avg_ram_usage_mb"]
-        if resource_usage["avg_ram_usage_mb"] > 0 and resource_usage["mem_std_dev"] > 0 else 0
-    )
-    peak_power_to_average_power_ratio = (
-        resource_usage["peak_power_w"] / resource_usage["avg_power_w"]
-        if resource_usage["avg_power_w"] > 0 else 0
-    )
-    prompt_eval_tokens_per_s = (
-        prompt_eval_count / (prompt_eval_duration_ns / 1e9)
-        if prompt_eval_duration_ns > 0 and prompt_eval_count > 0 else 0
-    )
-    eval_latency_per_token_ns = (
-        model_eval_duration_ns / eval_count if eval_count > 0 else 0
-    )
-    eval_memory_efficiency = (
-        tokens_per_second / resource_usage["avg_ram_usage_mb"]
-        if resource_usage["avg_ram_usage_mb"] > 0 else 0
-    )
-    token_production_energy_efficiency = (
-        eval_count / total_energy_j if total_energy_j > 1e-9 else 0
-    )
-    avg_cpu_to_power_ratio = (
-        resource_usage["avg_cpu_usage_percent"] / resource_usage["avg_power_w"]
-        if resource_usage["avg_power_w"] > 0 else 0
-    )
-    peak_ram_to_peak_cpu_ratio = (
-        resource_usage["peak_ram_usage_mb"] / resource_usage["peak_cpu_usage_percent"]
-        if resource_usage["peak_cpu_usage_percent"] > 0 else 0
-    )
-    time_weighted_power_factor = (
-        resource_usage["avg_power_w"] / local_inference_time_s
-        if local_inference_time_s > 0 else 0
-    )
-    load_to_prompt_ratio = (
-        load_duration_ns / prompt_eval_duration_ns if prompt_eval_duration_ns > 0 else 0
-    )
-    prompt_to_total_token_ratio = (
-        prompt_eval_count / eval_count if eval_count > 0 else 0
-    )
-    memory_to_cpu_ratio = (
-        resource_usage["peak_ram_usage_mb"] / resource_usage["peak_cpu_usage_percent"]
-        if resource_usage["peak_cpu_usage_percent"] > 0 else 0
+    return llm_response_text, ollama_metrics, resource_usage, all_novel_metrics
+
+def derive_process_usage(monitor, ollama_metrics):
+    """
+    Per-process view of the request: what the Ollama server and its runners
+    used, as opposed to the system-wide numbers in resource_usage.
+    """
+    process_usage = monitor.get_process_usage()
+    if not process_usage:
+        return process_usage
+
+    eval_count = ollama_metrics["eval_count"]
+    tokens_per_second = ollama_metrics["tokens_per_second"]
+    process_usage["ollama_memory_usage_per_token_mb"] = (
+        process_usage["ollama_avg_rss_mb"] / eval_count if eval_count > 0 else 0
     )
-    memory_to_power_ratio = (
-        resource_usage["avg_ram_usage_mb"] / resource_usage["avg_power_w"]
-        if resource_usage["avg_power_w"] > 0 else 0
+    process_usage["ollama_model_efficiency_index"] = (
+        tokens_per_second / process_usage["ollama_peak_rss_mb"]
+        if process_usage["ollama_peak_rss_mb"] > 0 else 0
     )
-    ram_usage_variation_index = (
-        resource_usage["mem_std_dev"] / resource_usage["avg_ram_usage_mb"]
-        if (resource_usage["avg_ram_usage_mb"] > 0 and resource_usage["mem_std_dev"] > 0)
-        else 0
+    return process_usage
+
+def derive_energy_metrics(monitor, local_inference_time_s):
+    """
+    How the request's energy was obtained: read from a hardware energy counter
+    or integrated over the power samples (see power_sources.py).
+    """
+    total_energy_j = monitor.get_energy_j()
+    return {
+        "total_energy_j": total_energy_j,
+        "energy_source": monitor.sampler.power_source_name(),
+        "energy_method": monitor.energy_method,
+        "integrated_avg_power_w": (
+            total_energy_j / local_inference_time_s if local_inference_time_s > 0 else 0
+        ),
+    }
+
+
+def derive_scheduling(req, ticket, local_inference_time_s):
+    """
+    Time spent queued in the scheduler vs. being served by Ollama. The
+    resource monitor only covers the service time.
+    """
+    return {
+        "priority": req.priority,
+        "queue_wait_s": ticket.queue_wait_s if ticket else 0,
+        "service_time_s": local_inference_time_s,
+        "queue_depth_at_arrival": ticket.queue_depth if ticket else 0,
+    }
+
+
+def derive_session_metrics(req, result_data):
+    """
+    Keeps the context Ollama returned for the session's next turn and reports
+    the prompt evaluation that reusing the previous one saved.
+    """
+    return SESSIONS.record_turn(
+        req.session_id, req.model, req.context_tokens, result_data,
+        COST_MODEL.prompt_eval_s_per_token(NODE_ID, req.model),
     )
-    power_usage_variation_index = (
-        resource_usage["power_std_dev"] / resource_usage["avg_power_w"]
-        if (resource_usage["avg_power_w"] > 0 and resource_usage["power_std_dev"] > 0)
-        else 0
+
+
+def collect_metrics(req, result_data, monitor, local_inference_time_s, ticket=None):
+    """
+    All metric groups for one finished request, shaped like the JSON response.
+    """
+    llm_response_text, ollama_metrics, resource_usage, all_novel_metrics = derive_metrics(
+        result_data, monitor, local_inference_time_s
     )
+    metrics = {
+        "request_id": req.request_id,
+        "model": req.model,
+        "options": req.options,
+        "ollama_metrics": ollama_metrics,
+        "resource_usage": resource_usage,
+        "process_usage": derive_process_usage(monitor, ollama_metrics),
+        "energy_metrics": derive_energy_metrics(monitor, local_inference_time_s),
+        "scheduling": derive_scheduling(req, ticket, local_inference_time_s),
+        "all_novel_metrics": all_novel_metrics,
+        "model_response": llm_response_text
+    }
+    if req.session_id is not None:
+        metrics["session_metrics"] = derive_session_metrics(req, result_data)
+    return metrics
+
+
+def log_request_metrics(req, metrics, monitor=None):
+    """
+    Queues a collect_metrics() result for the background metrics writer.
+    With trace mode on, the monitor's samples go along for the trace store.
+    """
+    timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    row = flatten_metrics(timestamp_str, req.model, req.prompt, metrics, tag=req.tag, node_id=NODE_ID)
+    if TRACE_STORE is not None and monitor is not None:
+        row["trace"] = trace_record(req.request_id, monitor, row.get("token_arrival_offsets_s"))
+    MODEL_MANAGER.record_request(req.model, row["start_type"])
+    METRICS_SUMMARY.observe(row)
+    METRICS_WRITER.submit(row)
+
+
+def load_cost_history():
+    """
+    Starts the cost models from the newest stored requests (SQLite backend).
+    """
+    if METRICS_STORE is None:
+        return
+    n = COST_MODEL.load_history(METRICS_STORE)
+    logger.info(f"Cost models fitted from {n} stored requests")
+
+
+def estimate_service_s(req):
+    """
+    Predicted service time of req for the scheduler's wait estimates, or
+    None until the cost model knows req.model.
+    """
+    return COST_MODEL.latency_s(NODE_ID, req.model, req.prompt, req.options.get("num_predict"))
+
+###############################################################################
+# Request Parsing
+###############################################################################
+class PromptRequest:
+    """
+    A validated /process_prompt body, shared by the Flask and async servers.
+    """
+    def __init__(self, prompt, stream=False, tag=None, model=None, options=None,
+                 priority="normal", deadline_s=None, session_id=None):
+        self.request_id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.stream = stream
+        self.tag = tag
+        self.model = model or MODEL_NAME
+        self.options = options or {}
+        self.priority = priority
+        self.deadline_s = deadline_s
+        self.session_id = session_id
+        self.context_tokens = 0           # session context sent with the prompt
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Raises ValueError with a client-facing message on invalid input.
+        """
+        prompt = data.get("prompt")
+        if not prompt:
+            raise ValueError("Prompt is required")
+        tag = data.get("tag")
+        if tag is not None and not isinstance(tag, str):
+            raise ValueError("tag must be a string")
+        model = data.get("model")
+        if model is not None and (not isinstance(model, str) or not model):
+            raise ValueError("model must be a non-empty string")
+        priority = data.get("priority", "normal")
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+        deadline_s = data.get("deadline_s")
+        if deadline_s is not None and (
+                isinstance(deadline_s, bool) or not isinstance(deadline_s, (int, float))
+                or deadline_s <= 0):
+            raise ValueError("deadline_s must be a positive number of seconds")
+        session_id = data.get("session_id")
+        if session_id is not None and (
+                not isinstance(session_id, str) or not 0 < len(session_id) <= SESSION_ID_MAX_LENGTH):
+            raise ValueError(f"session_id must be a string of 1 to {SESSION_ID_MAX_LENGTH} characters")
+        return cls(prompt, stream=bool(data.get("stream", False)), tag=tag,
+                   model=model, options=cls._parse_options(data.get("options")),
+                   priority=priority, deadline_s=deadline_s, session_id=session_id)
+
+    @staticmethod
+    def _parse_options(options):
+        if options is None:
+            return {}
+        if not isinstance(options, dict):
+            raise ValueError("options must be an object")
+        parsed = {}
+        for name, value in options.items():
+            expected = OLLAMA_OPTIONS.get(name)
+            if expected is None:
+                raise ValueError(f"Unsupported option '{name}' (allowed: {', '.join(OLLAMA_OPTIONS)})")
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"Option '{name}' must be a number")
+            if expected is int and value != int(value):
+                raise ValueError(f"Option '{name}' must be an integer")
+            parsed[name] = expected(value)
+        return parsed
+
+    def ollama_payload(self):
+        payload = {
+            "model": self.model,
+            "prompt": self.prompt,
+            "stream": self.stream
+        }
+        if self.options:
+            payload["options"] = self.options
+        keep_alive = MODEL_MANAGER.keep_alive_for(self.model)
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        if self.session_id is not None:
+            # Looked up at send time, after any earlier turn still queued
+            context = SESSIONS.context_for(self.session_id, self.model)
+            self.context_tokens = len(context) if context else 0
+            if context:
+                payload["context"] = context
+        return payload
+
+class BatchRequest:
+    """
+    A validated /process_batch body: the prompts plus batch-wide settings.
+    """
+    def __init__(self, requests_, parallelism=BATCH_PARALLELISM):
+        self.batch_id = uuid.uuid4().hex
+        self.requests = requests_
+        self.parallelism = parallelism
+
+    @classmethod
+    def from_json(cls, data, lines=None):
+        """
+        Prompts come from data["prompts"] (strings or {"prompt": ..., "tag": ...}
+        objects) or, for an uploaded JSONL file, from its lines. data["tag"],
+        data["model"] and data["options"] apply to every prompt that does not
+        set its own.
+        Raises ValueError with a client-facing message on invalid input.
+        """
+        if lines is not None:
+            items = []
+            for n, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except json.JSONDecodeError:
+                    raise ValueError(f"Line {n} is not valid JSON")
+        else:
+            items = data.get("prompts")
+        if not isinstance(items, list) or not items:
+            raise ValueError("prompts must be a non-empty list")
+        if len(items) > BATCH_MAX_PROMPTS:
+            raise ValueError(f"At most {BATCH_MAX_PROMPTS} prompts per batch")
+
+        try:
+            parallelism = int(data.get("parallelism", BATCH_PARALLELISM))
+        except (TypeError, ValueError):
+            raise ValueError("parallelism must be an integer")
+        if parallelism < 1:
+            raise ValueError("parallelism must be at least 1")
+        if parallelism > BATCH_MAX_PARALLELISM:
+            raise ValueError(f"parallelism must be at most {BATCH_MAX_PARALLELISM}")
+
+        defaults = {key: data.get(key) for key in ("tag", "model", "options")}
+        if isinstance(defaults["options"], str):
+            # Form fields and query parameters carry options as a JSON string
+            try:
+                defaults["options"] = json.loads(defaults["options"])
+            except json.JSONDecodeError:
+                raise ValueError("options must be a JSON object")
+
+        requests_ = []
+        for n, item in enumerate(items):
+            item = {"prompt": item} if isinstance(item, str) else item
+            if not isinstance(item, dict):
+                raise ValueError(f"Prompt {n} must be a string or an object")
+            item = dict(item, stream=False)
+            for key, value in defaults.items():
+                item.setdefault(key, value)
+            try:
+                requests_.append(PromptRequest.from_json(item))
+            except ValueError as e:
+                raise ValueError(f"Prompt {n}: {e}")
+        return cls(requests_, parallelism)
+
+###############################################################################
+# Streaming Metrics
+###############################################################################
+def _percentile(values, pct):
+    """
+    Linear-interpolated percentile of an unsorted list (pct in 0..100).
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (pct / 100.0) * (len(ordered) - 1)
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
 
-    denom_nt = prompt_eval_count + eval_count
-    if denom_nt <= 0:
-        denom_nt = 1
-    ratio_new_tokens = eval_count / denom_nt
-    power_eff = 0
-    if resource_usage["avg_power_w"] > 0:
-        power_eff = tokens_per_second / resource_usage["avg_power_w"]
-    sustained_inference_factor = ratio_new_tokens * power_eff
-
-    thermal_load_factor = 0
-    if resource_usage["avg_power_w"] > 0:
-        combined_cpu = (
-            resource_usage["avg_cpu_usage_percent"] +
-            resource_usage["peak_cpu_usage_percent"]
-        ) / 2.0
-        thermal_load_factor = combined_cpu / resource_usage["avg_power_w"]
-
-    all_novel_metrics = {
-        "time_per_token_s": time_per_token_s,
-        "load_to_inference_ratio": load_to_inference_ratio,
-        "memory_usage_per_token_mb": memory_usage_per_token_mb,
-        "energy_per_token_j": energy_per_token_j,
-        "power_spike_w": power_spike_w,
-        "prompt_eval_ratio": prompt_eval_ratio,
-        "time_per_prompt_eval_ns": prompt_eval_duration_ns,
-
-        "prompt_to_generation_overhead_ratio": prompt_to_generation_overhead_ratio,
-        "power_efficiency_index_tps_per_w": power_efficiency_index,
-        "cpu_stability_index": cpu_stability_index,
-
-        "model_efficiency_index": model_efficiency_index,
-        "peak_cpu_to_average_ratio": peak_cpu_to_average_ratio,
-        "memory_variation_index": memory_variation_index,
-        "peak_power_to_average_power_ratio": peak_power_to_average_power_ratio,
-        "prompt_eval_tokens_per_s": prompt_eval_tokens_per_s,
-        "eval_latency_per_token_ns": eval_latency_per_token_ns,
-        "eval_memory_efficiency": eval_memory_efficiency,
-        "token_production_energy_efficiency": token_production_energy_efficiency,
-        "avg_cpu_to_power_ratio": avg_cpu_to_power_ratio,
-        "peak_ram_to_peak_cpu_ratio": peak_ram_to_peak_cpu_ratio,
-
-        "time_weighted_power_factor": time_weighted_power_factor,
-        "load_to_prompt_ratio": load_to_prompt_ratio,
-        "prompt_to_total_token_ratio": prompt_to_total_token_ratio,
-        "memory_to_cpu_ratio": memory_to_cpu_ratio,
-        "memory_to_power_ratio": memory_to_power_ratio,
-        "ram_usage_variation_index": ram_usage_variation_index,
-        "power_usage_variation_index": power_usage_variation_index,
-        "sustained_inference_factor": sustained_inference_factor,
-        "thermal_load_factor": thermal_load_factor
+def compute_streaming_metrics(token_offsets_s):
+    """
+    token_offsets_s: arrival time of each streamed token, in seconds since the
+    request to Ollama was sent. Returns TTFT and the inter-token latency
+    distribution (the gaps between consecutive tokens).
+    """
+    if not token_offsets_s:
+        return {
+            "time_to_first_token_s": 0,
+            "stream_token_count": 0,
+            "inter_token_latency_mean_s": 0,
+            "inter_token_latency_p50_s": 0,
+            "inter_token_latency_p95_s": 0,
+            "inter_token_latency_p99_s": 0,
+            "max_stall_s": 0,
+            "token_arrival_offsets_s": [],
+        }
+
+    gaps = [b - a for a, b in zip(token_offsets_s, token_offsets_s[1:])]
+    return {
+        "time_to_first_token_s": token_offsets_s[0],
+        "stream_token_count": len(token_offsets_s),
+        "inter_token_latency_mean_s": (sum(gaps) / len(gaps)) if gaps else 0,
+        "inter_token_latency_p50_s": _percentile(gaps, 50),
+        "inter_token_latency_p95_s": _percentile(gaps, 95),
+        "inter_token_latency_p99_s": _percentile(gaps, 99),
+        "max_stall_s": max(gaps) if gaps else 0,
+        "token_arrival_offsets_s": token_offsets_s,
     }
 
+###############################################################################
+# FLASK APP
+###############################################################################
+app = Flask(__name__)
+
+def format_stream_event(event, use_sse):
+    """
+    Serializes one streamed event either as an NDJSON line or an SSE frame.
+    """
+    body = json.dumps(event)
+    if use_sse:
+        return f"data: {body}\n\n"
+    return body + "\n"
+
+
+def error_response(body, status):
+    """
+    JSON error response; scheduler rejections also get a Retry-After header.
+    """
+    response = jsonify(body)
+    response.status_code = status
+    if body.get("retry_after_s") is not None:
+        response.headers["Retry-After"] = str(max(1, round(body["retry_after_s"])))
+    return response
+
+
+def _stream_prompt(req, use_sse, ticket):
+    """
+    Generator behind the streaming mode of /process_prompt. Forwards each token
+    from Ollama's NDJSON stream as it arrives, records arrival times, and ends
+    with a final event carrying the same metric groups as the blocking mode
+    plus "streaming_metrics". Releases the scheduler ticket once Ollama is done.
+
+    The first item is not an event: it is None once Ollama has answered 200,
+    else (error body, status) to return instead of a stream.
+    """
+    monitor = ResourceMonitor()
+    monitor.start()
+
+    token_offsets_s = []
+    response_parts = []
+    result_data = {}
+
+    start_time = time.time()
+    start_perf = time.perf_counter()
+    started = False
+    try:
+        with requests.post(OLLAMA_API_URL, json=req.ollama_payload(), stream=True,
+                           timeout=OLLAMA_TIMEOUT) as response:
+            if response.status_code != 200:
+                yield {
+                    "error": f"LLM API Error: {response.status_code}",
+                    "details": response.text
+                }, response.status_code
+                return
+
+            started = True
+            yield None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except ValueError:
+                    yield format_stream_event({
+                        "error": "Malformed line in LLM API stream",
+                        "details": line[:200].decode("utf-8", "replace"),
+                        "done": True,
+                    }, use_sse)
+                    return
+                token = chunk.get("response", "")
+                if token:
+                    token_offsets_s.append(time.perf_counter() - start_perf)
+                    response_parts.append(token)
+                    yield format_stream_event({"response": token, "done": False}, use_sse)
+                if chunk.get("done"):
+                    result_data = chunk
+                    break
+    except requests.RequestException as e:
+        if started:
+            yield format_stream_event(
+                {"error": "LLM API stream failed", "details": str(e), "done": True}, use_sse)
+        else:
+            yield {"error": "LLM API unreachable", "details": str(e)}, 502
+        return
+    finally:
+        end_time = time.time()
+        monitor.stop()
+        ticket.release()
+
+    if not result_data:
+        # Runner crashed or the connection dropped: no counters to log
+        yield format_stream_event({"error": "stream ended before done", "done": True}, use_sse)
+        return
+
+    # Ollama's final chunk carries the timing counters but an empty "response"
+    result_data["response"] = "".join(response_parts)
+    metrics = collect_metrics(req, result_data, monitor, end_time - start_time, ticket)
+    metrics["streaming_metrics"] = compute_streaming_metrics(token_offsets_s)
+    log_request_metrics(req, metrics, monitor)
+
+    yield format_stream_event(dict(metrics, done=True), use_sse)
+
+
+@app.route('/process_prompt', methods=['POST'])
+def process_prompt():
+    data = request.get_json(silent=True) or {}
+    try:
+        req = PromptRequest.from_json(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if req.stream:
+        use_sse = "text/event-stream" in request.headers.get("Accept", "")
+        mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+        # Admission happens before the stream starts so a rejection is a real status code
+        try:
+            ticket = SCHEDULER.acquire(req.model, req.priority, req.deadline_s,
+                                       estimate_service_s(req))
+        except Rejected as e:
+            return error_response(e.to_json(), e.status)
+        events = _stream_prompt(req, use_sse, ticket)
+        # Runs until Ollama answers, so its errors are real status codes too
+        error = next(events)
+        if error is not None:
+            events.close()
+            return error_response(*error)
+        response = Response(events, mimetype=mimetype)
+        # Also frees the slot when the client leaves before the stream starts
+        response.call_on_close(ticket.release)
+        return response
+
+    metrics, error = run_blocking_prompt(req)
+    if error:
+        return error_response(*error)
+
     # -------------------------------------------------------------------------
-    # 4) Log everything to CSV
+    # Final JSON response
     # -------------------------------------------------------------------------
-    timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_metrics_to_csv(
-        timestamp_str=timestamp_str,
-        model_name=MODEL_NAME,
-        prompt=prompt,
-        response_text=llm_response_text,
-        ollama_metrics=ollama_metrics,
-        resource_usage=resource_usage,
-        all_novel_metrics=all_novel_metrics
-    )
+    return jsonify(metrics)
+
+
+def run_blocking_prompt(req, wait=False):
+    """
+    One non-streaming request to Ollama, queued by the scheduler, measured
+    and logged. Returns (metrics, None), or (None, (error body, status)) when
+    the scheduler rejects the request, or Ollama times out, is unreachable,
+    answers with an error or with a body that is not JSON.
+    wait queues the request even when the model's queue is full.
+    """
+    try:
+        ticket = SCHEDULER.acquire(req.model, req.priority, req.deadline_s,
+                                   estimate_service_s(req), wait=wait)
+    except Rejected as e:
+        return None, (e.to_json(), e.status)
+
+    # Start monitoring
+    monitor = ResourceMonitor()
+    monitor.start()
+
+    start_time = time.time()
+    try:
+        response = requests.post(OLLAMA_API_URL, json=req.ollama_payload(), timeout=OLLAMA_TIMEOUT)
+    except requests.Timeout as e:
+        return None, ({"error": "LLM API timeout", "details": str(e)}, 504)
+    except requests.RequestException as e:
+        return None, ({"error": "LLM API unreachable", "details": str(e)}, 502)
+    finally:
+        end_time = time.time()
+        # Stop monitoring
+        monitor.stop()
+        ticket.release()
+
+    if response.status_code != 200:
+        return None, ({
+            "error": f"LLM API Error: {response.status_code}",
+            "details": response.text
+        }, response.status_code)
+    try:
+        result_data = response.json()
+    except ValueError:
+        return None, ({"error": "Malformed LLM API response", "details": response.text[:200]}, 502)
+
+    metrics = collect_metrics(req, result_data, monitor, end_time - start_time, ticket)
 
     # -------------------------------------------------------------------------
-    # Final JSON response
+    # 4) Log everything to CSV
     # -------------------------------------------------------------------------
-    response_data = {
-        "ollama_metrics": ollama_metrics,
-        "resource_usage": resource_usage,
-        "all_novel_metrics": all_novel_metrics,
-        "model_response": llm_response_text
+    log_request_metrics(req, metrics, monitor)
+    return metrics, None
+
+###############################################################################
+# Batch Evaluation
+###############################################################################
+def summarize_batch(batch, results, monitor, wall_time_s):
+    """
+    Batch-level figures from the per-prompt metrics of the successful prompts.
+    Energy and power come from one monitor spanning the whole batch, since the
+    per-prompt windows overlap when prompts run in parallel.
+    """
+    latencies = [m["resource_usage"]["local_inference_time_s"] for m in results]
+    eval_tokens = sum(m["ollama_metrics"]["eval_count"] for m in results)
+    total_energy_j = monitor.get_energy_j()
+    return {
+        "batch_id": batch.batch_id,
+        "prompts": len(batch.requests),
+        "succeeded": len(results),
+        "failed": len(batch.requests) - len(results),
+        "parallelism": batch.parallelism,
+        "wall_time_s": wall_time_s,
+        "requests_per_second": len(results) / wall_time_s if wall_time_s > 0 else 0,
+        "total_eval_tokens": eval_tokens,
+        "aggregate_tokens_per_second": eval_tokens / wall_time_s if wall_time_s > 0 else 0,
+        "total_energy_j": total_energy_j,
+        "energy_per_token_j": total_energy_j / eval_tokens if eval_tokens > 0 else 0,
+        "avg_power_w": monitor.get_avg_power(),
+        "peak_ram_usage_mb": monitor.get_peak_mem_mb(),
+        "latency_mean_s": sum(latencies) / len(latencies) if latencies else 0,
+        "latency_p50_s": _percentile(latencies, 50),
+        "latency_p95_s": _percentile(latencies, 95),
+        "latency_p99_s": _percentile(latencies, 99),
     }
 
-    return jsonify(response_data)
+
+def _run_batch(batch):
+    """
+    Generator behind /process_batch: keeps batch.parallelism prompts in flight,
+    yields one NDJSON line per prompt as it completes (with its index in the
+    batch), then a final summary line.
+    """
+    monitor = ResourceMonitor()
+    monitor.start()
+    start_time = time.time()
+    results = []
+    pool = ThreadPoolExecutor(max_workers=batch.parallelism)
+    try:
+        # The batch bounds its own in-flight prompts, so they wait for a slot
+        # rather than being shed by a full queue
+        futures = {
+            pool.submit(run_blocking_prompt, req, wait=True): n
+            for n, req in enumerate(batch.requests)
+        }
+        for future in as_completed(futures):
+            n = futures[future]
+            try:
+                metrics, error = future.result()
+            except Exception as e:
+                # One bad prompt must not end the stream for the rest of the batch
+                logger.exception(f"Batch {batch.batch_id} prompt {n} failed")
+                metrics, error = None, ({"error": "Prompt failed", "details": f"{type(e).__name__}: {e}"}, 500)
+            if error:
+                line = dict(error[0], index=n, status=error[1],
+                            request_id=batch.requests[n].request_id)
+            else:
+                results.append(metrics)
+                line = dict(metrics, index=n)
+            yield json.dumps(line) + "\n"
+    finally:
+        # Client gone: drop the prompts not started yet
+        pool.shutdown(wait=False, cancel_futures=True)
+        monitor.stop()
+
+    summary = summarize_batch(batch, results, monitor, time.time() - start_time)
+    yield json.dumps({"batch_summary": summary, "done": True}) + "\n"
+
+
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    """
+    Evaluates many prompts in one call. Accepts a JSON body
+    {"prompts": [...], "parallelism": N, "tag": ...}, a JSONL body
+    (Content-Type: application/x-ndjson, settings as query parameters) or a
+    multipart upload with the JSONL file in "file" (settings as form fields).
+    """
+    try:
+        if "file" in request.files:
+            lines = request.files["file"].read().decode("utf-8").splitlines()
+            batch = BatchRequest.from_json(request.form, lines)
+        elif request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            lines = request.get_data(as_text=True).splitlines()
+            batch = BatchRequest.from_json(request.args, lines)
+        else:
+            batch = BatchRequest.from_json(request.get_json(silent=True) or {})
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    return Response(_run_batch(batch), mimetype="application/x-ndjson")
+
+@app.route('/sampler/stats', methods=['GET'])
+def sampler_stats():
+    """
+    Interval and self-measured CPU cost of the shared resource sampler.
+    """
+    return jsonify(SAMPLER.stats())
+
+@app.route('/metrics/writer', methods=['GET'])
+def metrics_writer_stats():
+    """
+    Queue depth and write/drop counters of the background metrics writer.
+    """
+    stats = METRICS_WRITER.stats()
+    if TRACE_STORE is not None:
+        stats["traces"] = TRACE_STORE.stats()
+    if FLEET_SINK is not None:
+        stats["fleet"] = FLEET_SINK.stats()
+    return jsonify(stats)
+
+@app.route('/metrics/query', methods=['GET'])
+def metrics_query():
+    """
+    Filters stored metrics by model, time range and tag, returning only the
+    requested columns, e.g.
+    /metrics/query?model=llama3.2:1b-instruct-q4_K_M&since=2025-01-01&columns=tokens_per_second,energy_per_token_j
+    """
+    if METRICS_STORE is None:
+        return jsonify({"error": "SQLite store disabled (set METRICS_BACKEND=sqlite or both)"}), 404
+    args = request.args
+    columns = [c for c in args.get("columns", "").split(",") if c]
+    try:
+        rows = METRICS_STORE.query(
+            model=args.get("model"),
+            since=args.get("since"),
+            until=args.get("until"),
+            tag=args.get("tag"),
+            node=args.get("node"),
+            columns=columns,
+            limit=args.get("limit", 1000),
+            include_text=args.get("include_text") == "1",
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"count": len(rows), "rows": rows})
+
+@app.route('/metrics/compare', methods=['GET'])
+def metrics_compare():
+    """
+    Bootstrap comparison of two tagged runs in the SQLite store, e.g.
+    /metrics/compare?baseline=fw-1.2&candidate=fw-1.3&metrics=tokens_per_second,energy_per_token_j
+    Optional: model, bootstrap, threshold. See compare_runs.py for the verdicts.
+    """
+    if METRICS_STORE is None:
+        return jsonify({"error": "SQLite store disabled (set METRICS_BACKEND=sqlite or both)"}), 404
+    args = request.args
+    if not args.get("baseline") or not args.get("candidate"):
+        return jsonify({"error": "baseline and candidate tags are required"}), 400
+    try:
+        metrics = parse_metrics([m for m in args.get("metrics", "").split(",") if m])
+        try:
+            n_boot = min(int(args.get("bootstrap", DEFAULT_BOOTSTRAP)), 100000)
+        except ValueError:
+            raise ValueError("bootstrap must be an integer")
+        if n_boot < MIN_BOOTSTRAP:
+            raise ValueError(f"bootstrap must be at least {MIN_BOOTSTRAP}")
+        threshold = float(args.get("threshold", DEFAULT_THRESHOLD))
+        runs = [
+            group_by_prompt(METRICS_STORE.query(
+                model=args.get("model"), tag=args[name], columns=list(metrics),
+                limit=QUERY_MAX_ROWS, include_text=True,
+            ), metrics)
+            for name in ("baseline", "candidate")
+        ]
+        comparison = compare(runs[0], runs[1], metrics, n_boot, threshold)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+    return jsonify({
+        "baseline": args["baseline"],
+        "candidate": args["candidate"],
+        "threshold": threshold,
+        "regression": any(r["verdict"] == "regression" for r in comparison.values()),
+        "metrics": comparison,
+    })
+
+@app.route('/metrics/summary', methods=['GET'])
+def metrics_summary():
+    """
+    In-memory per-model aggregates over the last window_s seconds, e.g.
+    /metrics/summary?model=llama3.2:1b-instruct-q4_K_M&window_s=3600&quantiles=0.5,0.95
+    """
+    args = request.args
+    try:
+        window_s = float(args["window_s"]) if "window_s" in args else None
+        quantiles = (
+            tuple(float(q) for q in args["quantiles"].split(",") if q)
+            if "quantiles" in args else DEFAULT_QUANTILES
+        )
+    except ValueError:
+        return jsonify({"error": "window_s and quantiles must be numbers"}), 400
+    if any(not 0 <= q <= 1 for q in quantiles):
+        return jsonify({"error": "quantiles must be between 0 and 1"}), 400
+    start_type = args.get("start_type")
+    if start_type not in (None, "cold", "warm"):
+        return jsonify({"error": "start_type must be cold or warm"}), 400
+    return jsonify({
+        "window_s": min(window_s or METRICS_SUMMARY.max_window_s, METRICS_SUMMARY.max_window_s),
+        "start_type": start_type,
+        "models": METRICS_SUMMARY.summary(args.get("model"), window_s, quantiles, start_type),
+    })
+
+@app.route('/traces/<request_id>', methods=['GET'])
+def get_trace(request_id):
+    """
+    One request's resource samples and token arrival times (TRACE_MODE=1),
+    e.g. /traces/<request_id>?points=200 to average the samples down to at
+    most 200 points. Optional day=YYYY-MM-DD skips the search over day files.
+    """
+    if TRACE_STORE is None:
+        return jsonify({"error": "Trace mode disabled (set TRACE_MODE=1)"}), 404
+    try:
+        points = int(request.args.get("points", 0))
+    except ValueError:
+        return jsonify({"error": "points must be an integer"}), 400
+    day = request.args.get("day")
+    if day is not None:
+        try:
+            day = parse_day(day)
+        except ValueError:
+            return jsonify({"error": "day must be a date in YYYY-MM-DD form"}), 400
+    trace = TRACE_STORE.get(request_id, day)
+    if trace is None:
+        return jsonify({"error": f"No trace for {request_id}"}), 404
+    return jsonify(dict(downsample(trace, points), day=trace["day"]))
+
+@app.route('/estimate', methods=['POST'])
+def estimate():
+    """
+    Predicted latency and energy of a request on this node, before running
+    it: {"prompt": ..., "model": ..., "max_tokens": ...}. prompt_tokens may
+    replace prompt; cold defaults to whether Ollama has the model loaded.
+    total_s adds the scheduler's current expected queue wait.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        kwargs = parse_estimate_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    model = data.get("model") or MODEL_NAME
+    priority = data.get("priority", "normal")
+    if not isinstance(model, str):
+        return jsonify({"error": "model must be a string"}), 400
+    if priority not in PRIORITIES:
+        return jsonify({"error": f"priority must be one of: {', '.join(PRIORITIES)}"}), 400
+    if kwargs["cold"] is None:
+        try:
+            loaded = MODEL_MANAGER.loaded()
+            kwargs["cold"] = not any(model in (m.get("name"), m.get("model")) for m in loaded)
+        except requests.RequestException:
+            kwargs["cold"] = False
+
+    estimate = COST_MODEL.estimate(NODE_ID, model, **kwargs)
+    if estimate is None:
+        return jsonify({
+            "error": f"Not enough history for {model} yet ({COST_MODEL.min_samples} requests needed)"
+        }), 404
+    queue_wait_s = SCHEDULER.expected_wait_s(model, priority)
+    estimate["queue_wait_s"] = queue_wait_s
+    estimate["total_s"] = queue_wait_s + estimate["latency_s"] if queue_wait_s is not None else None
+    return jsonify(estimate)
+
+@app.route('/estimate/models', methods=['GET'])
+def estimate_models():
+    """
+    Fitted cost model coefficients and running prediction errors, per model.
+    """
+    return jsonify(COST_MODEL.describe(request.args.get("model")))
+
+@app.route('/sessions', methods=['GET'])
+def sessions_stats():
+    """
+    Stored sessions, their memory, evictions and the prompt evaluation saved
+    by context reuse.
+    """
+    return jsonify(SESSIONS.stats())
+
+@app.route('/sessions/<session_id>', methods=['GET', 'DELETE'])
+def session_detail(session_id):
+    """
+    One session's model, turns, context size and savings; DELETE ends it.
+    """
+    if request.method == "DELETE":
+        if not SESSIONS.delete(session_id):
+            return jsonify({"error": f"No session {session_id}"}), 404
+        return jsonify({"session_id": session_id, "deleted": True})
+    session = SESSIONS.get(session_id)
+    if session is None:
+        return jsonify({"error": f"No session {session_id}"}), 404
+    return jsonify(session)
+
+@app.route('/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    """
+    Per-model slots in use, queue length, shed/rejected counts and the moving
+    average service time used for deadline shedding.
+    """
+    return jsonify(SCHEDULER.stats())
+
+@app.route('/models', methods=['GET'])
+def models_status():
+    """
+    keep_alive policy, per-model request and cold-start counts, and the
+    models Ollama currently has loaded.
+    """
+    status = MODEL_MANAGER.status()
+    try:
+        status["loaded"] = MODEL_MANAGER.loaded()
+    except requests.RequestException as e:
+        status["loaded"] = None
+        status["loaded_error"] = str(e)
+    return jsonify(status)
+
+@app.route('/models/preload', methods=['POST'])
+def models_preload():
+    """
+    Loads a model ahead of use: {"model": ..., "keep_alive": optional}.
+    """
+    data = request.get_json(silent=True) or {}
+    model = data.get("model") or MODEL_NAME
+    try:
+        load_s = MODEL_MANAGER.preload(model, data.get("keep_alive"))
+    except requests.RequestException as e:
+        return jsonify({"error": f"Preloading {model} failed", "details": str(e)}), 502
+    return jsonify({"model": model, "load_duration_s": load_s})
+
+@app.route('/models/unload', methods=['POST'])
+def models_unload():
+    """
+    Evicts a model from Ollama's memory: {"model": ...}.
+    """
+    data = request.get_json(silent=True) or {}
+    model = data.get("model")
+    if not model:
+        return jsonify({"error": "model is required"}), 400
+    try:
+        MODEL_MANAGER.unload(model)
+    except requests.RequestException as e:
+        return jsonify({"error": f"Unloading {model} failed", "details": str(e)}), 502
+    return jsonify({"model": model, "unloaded": True})
 
 ###############################################################################
 # MAIN (Run Flask app via uvicorn + WsgiToAsgi)
 ###############################################################################
 if __name__ == "__main__":
     logger.info(f"Starting Flask server with model: {MODEL_NAME}")
+    MODEL_MANAGER.start()
+    load_cost_history()
 
     # Wrap the Flask app in WsgiToAsgi so uvicorn can serve it
     asgi_app = WsgiToAsgi(app)
-    uvicorn.run(asgi_app, host="0.0.0.0", port=5000)
+    uvicorn.run(asgi_app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
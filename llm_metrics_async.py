@@ -0,0 +1,327 @@
+# Localized LLM Evaluation Metrics - native ASGI server
+#
+# Serves POST /process_prompt natively on asyncio and talks to Ollama through a
+# single shared keep-alive connection pool (httpx.AsyncClient), so a pending
+# generation costs a coroutine instead of a worker thread. Every other route is
+# forwarded to the Flask app in llm_metrics_11.py.
+
+# Run:
+#   python llm_metrics_async.py
+#
+# Tuning (environment variables):
+#   OLLAMA_POOL_SIZE          keep-alive connections to Ollama     (default 256)
+#   OLLAMA_CONNECT_TIMEOUT_S  connect timeout                      (default 5)
+#   OLLAMA_READ_TIMEOUT_S     read timeout, i.e. longest pause
+#                             between two bytes from Ollama        (default 600)
+#                             (both shared with llm_metrics_11.py)
+#   MAX_IN_FLIGHT             concurrent /process_prompt calls     (default 1024)
+#   IN_FLIGHT_WAIT_S          how long a call waits for a free
+#                             in-flight slot before a 503          (default 30)
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+import httpx
+import uvicorn
+from asgiref.wsgi import WsgiToAsgi
+
+import llm_metrics_11 as core
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# SETTINGS
+###############################################################################
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", 256))
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 1024))
+IN_FLIGHT_WAIT_S = float(os.environ.get("IN_FLIGHT_WAIT_S", 30))
+
+###############################################################################
+# ASGI helpers
+###############################################################################
+async def read_json_body(receive):
+    """
+    Collects the full request body and decodes it as JSON ({} when empty or invalid).
+    """
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    if not body:
+        return {}
+    try:
+        return json.loads(body)
+    except ValueError:
+        return {}
+
+
+def get_header(scope, name):
+    name = name.lower().encode("latin-1")
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+async def send_json(send, data, status=200, headers=None):
+    body = json.dumps(data).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ] + [(k.encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def start_stream(send, mimetype):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", mimetype.encode("latin-1"))],
+    })
+
+
+async def send_chunk(send, text):
+    await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+
+
+async def end_stream(send):
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+###############################################################################
+# ASYNC APP
+###############################################################################
+class AsyncMetricsApp:
+    """
+    ASGI application: /process_prompt is handled here on the event loop,
+    anything else falls through to the wrapped Flask app.
+    """
+    def __init__(self, fallback_app):
+        self.fallback_app = fallback_app
+        self.client = None
+        self.in_flight = None
+
+    async def startup(self):
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OLLAMA_POOL_SIZE,
+                max_keepalive_connections=OLLAMA_POOL_SIZE,
+            ),
+            timeout=httpx.Timeout(
+                connect=core.OLLAMA_CONNECT_TIMEOUT_S,
+                read=core.OLLAMA_READ_TIMEOUT_S,
+                write=core.OLLAMA_CONNECT_TIMEOUT_S,
+                # Waiting for a pooled connection is bounded by the in-flight
+                # semaphore below, so never time out on the pool itself
+                pool=None,
+            ),
+        )
+        self.in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        # Preloads configured models on its own thread
+        core.MODEL_MANAGER.start()
+        core.load_cost_history()
+        logger.info(
+            f"Async server ready: pool={OLLAMA_POOL_SIZE}, max_in_flight={MAX_IN_FLIGHT}"
+        )
+
+    async def shutdown(self):
+        if self.client is not None:
+            await self.client.aclose()
+        await asyncio.to_thread(core.METRICS_WRITER.close)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if (scope["type"] == "http" and scope["path"] == "/process_prompt"
+                and scope["method"] == "POST"):
+            await self.process_prompt(scope, receive, send)
+            return
+        await self.fallback_app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # -------------------------------------------------------------------------
+    # /process_prompt
+    # -------------------------------------------------------------------------
+    async def process_prompt(self, scope, receive, send):
+        data = await read_json_body(receive)
+        try:
+            req = core.PromptRequest.from_json(data)
+        except ValueError as e:
+            await send_json(send, {"error": str(e)}, 400)
+            return
+
+        try:
+            await asyncio.wait_for(self.in_flight.acquire(), IN_FLIGHT_WAIT_S)
+        except asyncio.TimeoutError:
+            await send_json(send, {"error": "Server busy: too many requests in flight"}, 503)
+            return
+
+        try:
+            try:
+                ticket = await core.SCHEDULER.acquire_async(
+                    req.model, req.priority, req.deadline_s, core.estimate_service_s(req)
+                )
+            except core.Rejected as e:
+                headers = {}
+                if e.retry_after_s is not None:
+                    headers["retry-after"] = str(max(1, round(e.retry_after_s)))
+                await send_json(send, e.to_json(), e.status, headers)
+                return
+            try:
+                if req.stream:
+                    use_sse = "text/event-stream" in get_header(scope, "accept")
+                    await self._stream_prompt(send, req, use_sse, ticket)
+                else:
+                    await self._blocking_prompt(send, req, ticket)
+            finally:
+                ticket.release()
+        finally:
+            self.in_flight.release()
+
+    async def _blocking_prompt(self, send, req, ticket):
+        monitor = core.ResourceMonitor()
+        await asyncio.to_thread(monitor.start)
+
+        start_time = time.time()
+        try:
+            response = await self.client.post(core.OLLAMA_API_URL, json=req.ollama_payload())
+        except httpx.TimeoutException as e:
+            await asyncio.to_thread(monitor.stop)
+            await send_json(send, {"error": "LLM API timeout", "details": str(e)}, 504)
+            return
+        except httpx.TransportError as e:
+            await asyncio.to_thread(monitor.stop)
+            await send_json(send, {"error": "LLM API unreachable", "details": str(e)}, 502)
+            return
+        end_time = time.time()
+
+        # stop() reads the energy counter and slices the sample buffer; keep it off the loop
+        await asyncio.to_thread(monitor.stop)
+        ticket.release()
+
+        if response.status_code != 200:
+            await send_json(send, {
+                "error": f"LLM API Error: {response.status_code}",
+                "details": response.text
+            }, response.status_code)
+            return
+
+        try:
+            result_data = response.json()
+        except json.JSONDecodeError:
+            await send_json(send, {
+                "error": "Malformed LLM API response",
+                "details": response.text[:200]
+            }, 502)
+            return
+
+        metrics = core.collect_metrics(req, result_data, monitor, end_time - start_time, ticket)
+        self._log(req, metrics, monitor)
+        await send_json(send, metrics)
+
+    async def _stream_prompt(self, send, req, use_sse, ticket):
+        monitor = core.ResourceMonitor()
+        await asyncio.to_thread(monitor.start)
+
+        token_offsets_s = []
+        response_parts = []
+        result_data = {}
+        started = False
+
+        start_time = time.time()
+        start_perf = time.perf_counter()
+        try:
+            async with self.client.stream("POST", core.OLLAMA_API_URL, json=req.ollama_payload()) as response:
+                if response.status_code != 200:
+                    details = (await response.aread()).decode("utf-8", "replace")
+                    await send_json(send, {
+                        "error": f"LLM API Error: {response.status_code}",
+                        "details": details
+                    }, response.status_code)
+                    return
+
+                await start_stream(send, "text/event-stream" if use_sse else "application/x-ndjson")
+                started = True
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        chunk = json.loads(line)
+                    except json.JSONDecodeError:
+                        await send_chunk(send, core.format_stream_event({
+                            "error": "Malformed line in LLM API stream",
+                            "details": line[:200],
+                            "done": True,
+                        }, use_sse))
+                        await end_stream(send)
+                        return
+                    token = chunk.get("response", "")
+                    if token:
+                        token_offsets_s.append(time.perf_counter() - start_perf)
+                        response_parts.append(token)
+                        await send_chunk(send, core.format_stream_event(
+                            {"response": token, "done": False}, use_sse))
+                    if chunk.get("done"):
+                        result_data = chunk
+                        break
+        except httpx.HTTPError as e:
+            if started:
+                await send_chunk(send, core.format_stream_event(
+                    {"error": "LLM API stream failed", "details": str(e), "done": True}, use_sse))
+                await end_stream(send)
+            else:
+                await send_json(send, {"error": "LLM API unreachable", "details": str(e)}, 502)
+            return
+        finally:
+            end_time = time.time()
+            await asyncio.to_thread(monitor.stop)
+            ticket.release()
+
+        if not result_data:
+            # Runner crashed or the connection dropped: no counters to log
+            await send_chunk(send, core.format_stream_event(
+                {"error": "stream ended before done", "done": True}, use_sse))
+            await end_stream(send)
+            return
+
+        result_data["response"] = "".join(response_parts)
+        metrics = core.collect_metrics(req, result_data, monitor, end_time - start_time, ticket)
+        metrics["streaming_metrics"] = core.compute_streaming_metrics(token_offsets_s)
+        self._log(req, metrics, monitor)
+
+        await send_chunk(send, core.format_stream_event(dict(metrics, done=True), use_sse))
+        await end_stream(send)
+
+    @staticmethod
+    def _log(req, metrics, monitor):
+        # Only a queue put; the rows are written by the background writer
+        core.log_request_metrics(req, metrics, monitor)
+
+
+asgi_app = AsyncMetricsApp(WsgiToAsgi(core.app))
+
+###############################################################################
+# MAIN
+###############################################################################
+if __name__ == "__main__":
+    logger.info(f"Starting async server with model: {core.MODEL_NAME}")
+    uvicorn.run(asgi_app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
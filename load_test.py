@@ -0,0 +1,305 @@
+# Open-loop load generator for /process_prompt
+#
+# Requests are sent on a precomputed arrival schedule, independent of how fast
+# the server answers (open loop), so a slow server shows up as growing latency
+# and errors instead of a lower request rate. Latency is measured from each
+# request's scheduled send time, which corrects for coordinated omission: time
+# a request spends waiting for a free slot under --max-concurrency counts
+# against it. Service time (from the actual send) is reported as well.
+#
+# Profiles:
+#   constant  --rps for --duration seconds, evenly spaced
+#   poisson   --rps for --duration seconds, exponential inter-arrival times
+#   step      each rate in --steps for --step-duration seconds
+#   ramp      --rps-start to --rps-end over --duration, in --ramp-segments steps
+# (--poisson makes step and ramp arrivals Poisson too)
+#
+# Prompt corpora: --corpus FILE[:WEIGHT] (repeatable). A .txt file holds one
+# prompt per line; a .jsonl file holds {"prompt": ..., "weight": ...} objects.
+# Without --corpus the prompts from prompts.py are used.
+#
+# Each phase (one rate) is reported separately; the saturation point is the
+# highest rate whose phase kept up (throughput >= --keep-up x target) with an
+# error rate at most --max-error-rate.
+#
+# Run:
+#   python load_test.py --profile step --steps 0.5 1 2 4 --step-duration 60 --stream --output load_report.json
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+from metrics_summary import QuantileSketch
+from prompts import generate_prompts
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+###############################################################################
+# Prompt corpora
+###############################################################################
+def load_corpus(spec):
+    """
+    FILE[:WEIGHT] -> [(prompt, weight)]. The file-level weight multiplies the
+    per-prompt weights of a .jsonl file.
+    """
+    path, _, weight = spec.partition(":")
+    file_weight = float(weight) if weight else 1.0
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    entries.append((item["prompt"], file_weight * float(item.get("weight", 1.0))))
+        else:
+            entries.extend((line.strip(), file_weight) for line in f if line.strip())
+    if not entries:
+        raise ValueError(f"No prompts in {path}")
+    return entries
+
+
+class PromptMix:
+    def __init__(self, entries, seed=None):
+        self.prompts = [p for p, _ in entries]
+        self.weights = [w for _, w in entries]
+        self.rng = random.Random(seed)
+
+    def pick(self):
+        return self.rng.choices(self.prompts, weights=self.weights)[0]
+
+###############################################################################
+# Arrival schedule
+###############################################################################
+def build_phases(args):
+    """
+    [(target_rps, duration_s)] for the selected profile.
+    """
+    if args.profile in ("constant", "poisson"):
+        return [(args.rps, args.duration)]
+    if args.profile == "step":
+        return [(rps, args.step_duration) for rps in args.steps]
+    if args.profile == "ramp":
+        n = args.ramp_segments
+        segment_s = args.duration / n
+        return [
+            (args.rps_start + (args.rps_end - args.rps_start) * (k + 0.5) / n, segment_s)
+            for k in range(n)
+        ]
+    raise ValueError(f"Unknown profile '{args.profile}'")
+
+
+def build_schedule(phases, poisson, seed=None):
+    """
+    [(offset_s, phase_index)] of intended send times from the start of the run.
+    """
+    rng = random.Random(seed)
+    schedule = []
+    phase_start = 0.0
+    for index, (rps, duration_s) in enumerate(phases):
+        phase_end = phase_start + duration_s
+        if rps > 0:
+            t = phase_start + (rng.expovariate(rps) if poisson else 0.0)
+            while t < phase_end:
+                schedule.append((t, index))
+                t += rng.expovariate(rps) if poisson else 1.0 / rps
+        phase_start = phase_end
+    return schedule
+
+###############################################################################
+# Requests
+###############################################################################
+class Result:
+    __slots__ = ("phase", "intended", "sent", "ended", "ok", "status", "ttft")
+
+    def __init__(self, phase, intended):
+        self.phase = phase
+        self.intended = intended
+        self.sent = None
+        self.ended = None
+        self.ok = False
+        self.status = None
+        self.ttft = None
+
+
+async def send_request(client, url, prompt, stream, result):
+    result.sent = time.monotonic()
+    try:
+        if stream:
+            async with client.stream("POST", url, json={"prompt": prompt, "stream": True}) as response:
+                result.status = response.status_code
+                ok = response.status_code == 200
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if result.ttft is None and event.get("response"):
+                        result.ttft = time.monotonic() - result.intended
+                    if event.get("error"):
+                        ok = False
+                result.ok = ok
+        else:
+            response = await client.post(url, json={"prompt": prompt})
+            result.status = response.status_code
+            result.ok = response.status_code == 200
+    except httpx.HTTPError as e:
+        result.status = type(e).__name__
+    except ValueError:
+        # Body is not NDJSON, e.g. a proxy's error page; keeps the HTTP status
+        result.ok = False
+    result.ended = time.monotonic()
+
+
+async def run_load(args, mix, schedule):
+    url = f"{args.url.rstrip('/')}/process_prompt"
+    limits = httpx.Limits(max_connections=args.max_concurrency,
+                          max_keepalive_connections=args.max_concurrency)
+    slots = asyncio.Semaphore(args.max_concurrency)
+    results = []
+    tasks = []
+
+    async def one(result, prompt):
+        async with slots:
+            await send_request(client, url, prompt, args.stream, result)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        start = time.monotonic()
+        for offset_s, phase in schedule:
+            delay = start + offset_s - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            result = Result(phase, start + offset_s)
+            results.append(result)
+            tasks.append(asyncio.create_task(one(result, mix.pick())))
+        await asyncio.gather(*tasks)
+    return results, start
+
+###############################################################################
+# Report
+###############################################################################
+def summarize(results, target_rps=None, duration_s=None):
+    latency = QuantileSketch()
+    service = QuantileSketch()
+    ttft = QuantileSketch()
+    errors = {}
+    for r in results:
+        if r.ok:
+            latency.add(r.ended - r.intended)
+            service.add(r.ended - r.sent)
+            if r.ttft is not None:
+                ttft.add(r.ttft)
+        else:
+            errors[str(r.status)] = errors.get(str(r.status), 0) + 1
+    completed = latency.count
+    if duration_s is None and results:
+        duration_s = max(r.ended for r in results) - min(r.intended for r in results)
+    report = {
+        "sent": len(results),
+        "completed": completed,
+        "errors": errors,
+        "error_rate": (len(results) - completed) / len(results) if results else 0,
+        "duration_s": duration_s,
+        "throughput_rps": completed / duration_s if duration_s else 0,
+        "latency_s": latency.summary(QUANTILES),
+        "service_time_s": service.summary(QUANTILES),
+        "ttft_s": ttft.summary(QUANTILES),
+    }
+    if target_rps is not None:
+        report["target_rps"] = target_rps
+    return report
+
+
+def build_report(args, phases, results, start):
+    phase_reports = []
+    phase_start = start
+    for index, (rps, duration_s) in enumerate(phases):
+        in_phase = [r for r in results if r.phase == index]
+        # Throughput over the phase plus the time its last requests took to drain
+        end = max([phase_start + duration_s] + [r.ended for r in in_phase])
+        phase_reports.append(summarize(in_phase, target_rps=rps, duration_s=end - phase_start))
+        phase_start += duration_s
+
+    saturation_rps = None
+    for p in phase_reports:
+        kept_up = p["throughput_rps"] >= args.keep_up * p["target_rps"]
+        if kept_up and p["error_rate"] <= args.max_error_rate:
+            saturation_rps = max(saturation_rps or 0, p["target_rps"])
+
+    return {
+        "config": {
+            "url": args.url,
+            "profile": args.profile,
+            "poisson": args.poisson or args.profile == "poisson",
+            "stream": args.stream,
+            "max_concurrency": args.max_concurrency,
+            "corpus": args.corpus or ["prompts.py"],
+            "seed": args.seed,
+        },
+        "overall": summarize(results),
+        "phases": phase_reports,
+        "saturation_rps": saturation_rps,
+    }
+
+
+def print_report(report):
+    def ms(summary, key):
+        value = summary.get(key)
+        return f"{value * 1000:9.1f}" if value is not None else f"{'-':>9}"
+
+    print(f"{'target rps':>10}{'sent':>7}{'ok':>7}{'err %':>7}{'rps':>8}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttft p95':>9}")
+    for p in report["phases"] + [dict(report["overall"], target_rps=None)]:
+        target = f"{p['target_rps']:10.2f}" if p["target_rps"] is not None else f"{'overall':>10}"
+        print(f"{target}{p['sent']:>7}{p['completed']:>7}{p['error_rate'] * 100:>7.1f}"
+              f"{p['throughput_rps']:>8.2f}"
+              f"{ms(p['latency_s'], 'p50')}{ms(p['latency_s'], 'p95')}{ms(p['latency_s'], 'p99')}"
+              f"{ms(p['ttft_s'], 'p95')}")
+    print(f"Saturation point: {report['saturation_rps']} rps")
+
+###############################################################################
+# MAIN
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load generator for /process_prompt")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--profile", choices=["constant", "poisson", "step", "ramp"], default="constant")
+    parser.add_argument("--rps", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds (constant, poisson, ramp)")
+    parser.add_argument("--steps", type=float, nargs="+", default=[0.5, 1, 2, 4])
+    parser.add_argument("--step-duration", type=float, default=60.0)
+    parser.add_argument("--rps-start", type=float, default=0.5)
+    parser.add_argument("--rps-end", type=float, default=5.0)
+    parser.add_argument("--ramp-segments", type=int, default=10)
+    parser.add_argument("--poisson", action="store_true", help="Poisson arrivals for step and ramp")
+    parser.add_argument("--max-concurrency", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--stream", action="store_true", help="use streaming mode and measure TTFT")
+    parser.add_argument("--corpus", action="append", help="FILE[:WEIGHT], repeatable")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--keep-up", type=float, default=0.9)
+    parser.add_argument("--output", default="load_report.json")
+    args = parser.parse_args()
+
+    entries = []
+    for spec in args.corpus or []:
+        entries.extend(load_corpus(spec))
+    mix = PromptMix(entries or [(p, 1.0) for p in generate_prompts()], seed=args.seed)
+
+    phases = build_phases(args)
+    schedule = build_schedule(phases, args.poisson or args.profile == "poisson", seed=args.seed)
+    print(f"Sending {len(schedule)} requests over {sum(d for _, d in phases):.0f}s "
+          f"({args.profile}, max concurrency {args.max_concurrency})")
+
+    results, start = asyncio.run(run_load(args, mix, schedule))
+    report = build_report(args, phases, results, start)
+    print_report(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report saved to '{args.output}'.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+# Derived ("novel") metric registry
+#
+# Every derived metric is declared once, with the columns it reads and its
+# formula. The same declaration is evaluated two ways:
+#
+#   per request   evaluate(values) on plain floats, on the request path
+#   per column    evaluate_columns(columns) on NumPy arrays, to recompute or
+#                 add metrics over a whole log at once
+#
+# Formulas get an `ops` argument with the few operations that differ between
+# the two (guarded division, max, ...), so one formula serves both.
+#
+# Metrics are evaluated in declaration order, so a formula may read metrics
+# declared before it. alias() keeps an older column that duplicated a metric
+# under another name filled from the one formula.
+#
+# Recompute a CSV log (into a new file) or the SQLite store in one pass:
+#   python metric_registry.py recompute --csv metrics_log.csv --out fixed.csv
+#   python metric_registry.py recompute --db metrics.db [--metrics energy_per_token_j]
+#   python metric_registry.py list
+
+import argparse
+import csv
+import itertools
+import math
+import os
+import sqlite3
+import tempfile
+import time
+
+try:
+    import numpy as np
+except ImportError:  # only needed for evaluate_columns() and the CLI
+    np = None
+
+###############################################################################
+# Scalar and vector operations
+###############################################################################
+class ScalarOps:
+    @staticmethod
+    def div(a, b, eps=0.0):
+        """a / b, or 0 when b <= eps; NaN (missing) when either input is."""
+        if a != a or b != b:
+            return math.nan
+        return a / b if b > eps else 0
+
+    @staticmethod
+    def maximum(a, b):
+        return a if a > b else b
+
+
+class VectorOps:
+    @staticmethod
+    def div(a, b, eps=0.0):
+        """Elementwise ScalarOps.div."""
+        a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+        out = np.zeros(a.shape)
+        np.divide(a, b, out=out, where=b > eps)
+        out[np.isnan(a) | np.isnan(b)] = np.nan
+        return out
+
+    @staticmethod
+    def maximum(a, b):
+        return np.maximum(a, b)
+
+###############################################################################
+# Registry
+###############################################################################
+class Metric:
+    def __init__(self, name, inputs, formula, alias_of=None):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.formula = formula
+        self.alias_of = alias_of
+
+
+class MetricRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def metric(self, name, *inputs):
+        """
+        Decorator declaring a metric: @registry.metric("x", "input_a", "input_b").
+        The formula receives ops followed by the inputs, in that order.
+        """
+        def register(formula):
+            self.metrics.append(Metric(name, inputs, formula))
+            return formula
+        return register
+
+    def alias(self, name, target):
+        """
+        Declares `name` as another column holding the value of `target`.
+        """
+        self.metrics.append(Metric(name, (target,), lambda ops, value: value, alias_of=target))
+
+    def names(self):
+        return [m.name for m in self.metrics]
+
+    def base_inputs(self, metrics=None):
+        """
+        Inputs that are not themselves registry metrics, for the given
+        metrics (default: all), in first-use order.
+        """
+        selected = self._with_dependencies(metrics)
+        produced = set()
+        inputs = []
+        for m in self.metrics:
+            if m.name not in selected:
+                continue
+            for name in m.inputs:
+                if name not in produced and name not in inputs:
+                    inputs.append(name)
+            produced.add(m.name)
+        return inputs
+
+    def _with_dependencies(self, metrics):
+        if metrics is None:
+            return {m.name for m in self.metrics}
+        by_name = {m.name: m for m in self.metrics}
+        unknown = [name for name in metrics if name not in by_name]
+        if unknown:
+            raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+        selected = set()
+        pending = list(metrics)
+        while pending:
+            name = pending.pop()
+            if name in selected:
+                continue
+            selected.add(name)
+            pending.extend(i for i in by_name[name].inputs if i in by_name)
+        return selected
+
+    def evaluate(self, values):
+        """
+        Per-request evaluation. values: input name -> number.
+        Returns {metric name: value} in declaration order.
+        """
+        values = dict(values)
+        get = values.__getitem__
+        out = {}
+        for m in self.metrics:
+            out[m.name] = values[m.name] = m.formula(ScalarOps, *map(get, m.inputs))
+        return out
+
+    def evaluate_columns(self, columns, metrics=None):
+        """
+        Whole-column evaluation. columns: input name -> 1-D array (NaN where
+        missing). Returns {metric name: array} for the requested metrics
+        (default: all).
+        """
+        if np is None:
+            raise RuntimeError("NumPy is required for column evaluation")
+        selected = self._with_dependencies(metrics)
+        values = {name: np.asarray(col, dtype=float) for name, col in columns.items()}
+        out = {}
+        for m in self.metrics:
+            if m.name not in selected:
+                continue
+            values[m.name] = m.formula(VectorOps, *[values[name] for name in m.inputs])
+            if metrics is None or m.name in metrics:
+                out[m.name] = values[m.name]
+        return out
+
+
+NOVEL_METRICS = MetricRegistry()
+metric = NOVEL_METRICS.metric
+
+###############################################################################
+# Metric declarations
+###############################################################################
+@metric("time_per_token_s", "total_duration_s", "eval_count")
+def _(ops, total_duration_s, eval_count):
+    return ops.div(total_duration_s, eval_count)
+
+@metric("load_to_inference_ratio", "load_duration_ns", "eval_duration_ns")
+def _(ops, load_duration_ns, eval_duration_ns):
+    return ops.div(load_duration_ns, eval_duration_ns)
+
+@metric("memory_usage_per_token_mb", "avg_ram_usage_mb", "eval_count")
+def _(ops, avg_ram_usage_mb, eval_count):
+    return ops.div(avg_ram_usage_mb, eval_count)
+
+@metric("energy_per_token_j", "total_energy_j", "eval_count")
+def _(ops, total_energy_j, eval_count):
+    return ops.div(total_energy_j, eval_count)
+
+@metric("power_spike_w", "peak_power_w", "min_power_w")
+def _(ops, peak_power_w, min_power_w):
+    return peak_power_w - min_power_w
+
+@metric("prompt_eval_ratio", "prompt_eval_duration_ns", "total_duration_ns")
+def _(ops, prompt_eval_duration_ns, total_duration_ns):
+    return ops.div(prompt_eval_duration_ns, total_duration_ns)
+
+@metric("time_per_prompt_eval_ns", "prompt_eval_duration_ns")
+def _(ops, prompt_eval_duration_ns):
+    return prompt_eval_duration_ns
+
+@metric("prompt_to_generation_overhead_ratio", "prompt_eval_duration_ns", "eval_duration_ns")
+def _(ops, prompt_eval_duration_ns, eval_duration_ns):
+    return ops.div(prompt_eval_duration_ns, eval_duration_ns)
+
+@metric("power_efficiency_index_tps_per_w", "tokens_per_second", "avg_power_w")
+def _(ops, tokens_per_second, avg_power_w):
+    return ops.div(tokens_per_second, avg_power_w)
+
+@metric("cpu_stability_index", "cpu_std_dev", "avg_cpu_usage_percent")
+def _(ops, cpu_std_dev, avg_cpu_usage_percent):
+    return ops.maximum(0, 1 - cpu_std_dev / ops.maximum(100, avg_cpu_usage_percent))
+
+@metric("model_efficiency_index", "tokens_per_second", "peak_ram_usage_mb")
+def _(ops, tokens_per_second, peak_ram_usage_mb):
+    return ops.div(tokens_per_second, peak_ram_usage_mb)
+
+@metric("peak_cpu_to_average_ratio", "peak_cpu_usage_percent", "avg_cpu_usage_percent")
+def _(ops, peak_cpu_usage_percent, avg_cpu_usage_percent):
+    return ops.div(peak_cpu_usage_percent, avg_cpu_usage_percent)
+
+@metric("memory_variation_index", "mem_std_dev", "avg_ram_usage_mb")
+def _(ops, mem_std_dev, avg_ram_usage_mb):
+    return ops.div(mem_std_dev, avg_ram_usage_mb)
+
+@metric("peak_power_to_average_power_ratio", "peak_power_w", "avg_power_w")
+def _(ops, peak_power_w, avg_power_w):
+    return ops.div(peak_power_w, avg_power_w)
+
+@metric("prompt_eval_tokens_per_s", "prompt_eval_count", "prompt_eval_duration_ns")
+def _(ops, prompt_eval_count, prompt_eval_duration_ns):
+    return ops.div(prompt_eval_count, prompt_eval_duration_ns / 1e9)
+
+@metric("eval_latency_per_token_ns", "eval_duration_ns", "eval_count")
+def _(ops, eval_duration_ns, eval_count):
+    return ops.div(eval_duration_ns, eval_count)
+
+@metric("eval_memory_efficiency", "tokens_per_second", "avg_ram_usage_mb")
+def _(ops, tokens_per_second, avg_ram_usage_mb):
+    return ops.div(tokens_per_second, avg_ram_usage_mb)
+
+@metric("token_production_energy_efficiency", "eval_count", "total_energy_j")
+def _(ops, eval_count, total_energy_j):
+    return ops.div(eval_count, total_energy_j, eps=1e-9)
+
+@metric("avg_cpu_to_power_ratio", "avg_cpu_usage_percent", "avg_power_w")
+def _(ops, avg_cpu_usage_percent, avg_power_w):
+    return ops.div(avg_cpu_usage_percent, avg_power_w)
+
+@metric("peak_ram_to_peak_cpu_ratio", "peak_ram_usage_mb", "peak_cpu_usage_percent")
+def _(ops, peak_ram_usage_mb, peak_cpu_usage_percent):
+    return ops.div(peak_ram_usage_mb, peak_cpu_usage_percent)
+
+@metric("time_weighted_power_factor", "avg_power_w", "local_inference_time_s")
+def _(ops, avg_power_w, local_inference_time_s):
+    return ops.div(avg_power_w, local_inference_time_s)
+
+@metric("load_to_prompt_ratio", "load_duration_ns", "prompt_eval_duration_ns")
+def _(ops, load_duration_ns, prompt_eval_duration_ns):
+    return ops.div(load_duration_ns, prompt_eval_duration_ns)
+
+@metric("prompt_to_total_token_ratio", "prompt_eval_count", "eval_count")
+def _(ops, prompt_eval_count, eval_count):
+    return ops.div(prompt_eval_count, eval_count)
+
+NOVEL_METRICS.alias("memory_to_cpu_ratio", "peak_ram_to_peak_cpu_ratio")
+
+@metric("memory_to_power_ratio", "avg_ram_usage_mb", "avg_power_w")
+def _(ops, avg_ram_usage_mb, avg_power_w):
+    return ops.div(avg_ram_usage_mb, avg_power_w)
+
+NOVEL_METRICS.alias("ram_usage_variation_index", "memory_variation_index")
+
+@metric("power_usage_variation_index", "power_std_dev", "avg_power_w")
+def _(ops, power_std_dev, avg_power_w):
+    return ops.div(power_std_dev, avg_power_w)
+
+@metric("sustained_inference_factor", "eval_count", "prompt_eval_count",
+        "power_efficiency_index_tps_per_w")
+def _(ops, eval_count, prompt_eval_count, power_efficiency_index_tps_per_w):
+    # Share of generated tokens among all tokens, times tokens/s per watt
+    return ops.div(eval_count, ops.maximum(prompt_eval_count + eval_count, 1)) \
+        * power_efficiency_index_tps_per_w
+
+@metric("thermal_load_factor", "avg_cpu_usage_percent", "peak_cpu_usage_percent", "avg_power_w")
+def _(ops, avg_cpu_usage_percent, peak_cpu_usage_percent, avg_power_w):
+    return ops.div((avg_cpu_usage_percent + peak_cpu_usage_percent) / 2.0, avg_power_w)
+
+###############################################################################
+# Recompute CLI
+###############################################################################
+# CSV rows held in memory at once while recomputing
+RECOMPUTE_CHUNK_ROWS = 50000
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _parse_column(rows, index):
+    values = [row[index] if index < len(row) else "" for row in rows]
+    try:
+        return np.array(values, dtype=float)
+    except ValueError:
+        # Empty cells or text: the slow path, cell by cell
+        return np.fromiter(map(_to_float, values), dtype=float, count=len(values))
+
+
+def _format_column(values):
+    return ["" if v != v else repr(v) for v in values.tolist()]
+
+
+def _available(registry, metrics, columns):
+    """
+    Requested metrics whose base inputs all exist in the log, plus the
+    metrics skipped for missing inputs.
+    """
+    names = metrics or registry.names()
+    usable, skipped = [], {}
+    for name in names:
+        missing = [i for i in registry.base_inputs([name]) if i not in columns]
+        if missing:
+            skipped[name] = missing
+        else:
+            usable.append(name)
+    return usable, skipped
+
+
+def recompute_csv(path, out_path, metrics=None, registry=NOVEL_METRICS,
+                  chunk_rows=RECOMPUTE_CHUNK_ROWS):
+    """
+    Writes a copy of a CSV log with its metric columns recomputed; metrics
+    without a column yet are appended as new columns. Rows are read and
+    written chunk_rows at a time. Never rewrites the log itself: the server
+    appends to it through an open descriptor, so rows logged after a swap
+    would be lost. Returns (rows, metrics, skipped).
+    """
+    if os.path.exists(out_path) and os.path.samefile(path, out_path):
+        raise ValueError("The output must be a new file, not the log being read")
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        usable, skipped = _available(registry, metrics, header)
+        names = [m.name for m in registry.metrics if m.name in usable]
+        inputs = registry.base_inputs(usable)
+        position = {name: k for k, name in enumerate(header)}
+        for name in names:
+            if name not in position:
+                position[name] = len(header)
+                header.append(name)
+        width = len(header)
+
+        rows_written = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out_path)), suffix=".csv")
+        try:
+            with os.fdopen(fd, "w", newline="", encoding="utf-8") as out:
+                writer = csv.writer(out)
+                writer.writerow(header)
+                while True:
+                    rows = list(itertools.islice(reader, chunk_rows))
+                    if not rows:
+                        break
+                    formatted = {}
+                    if names:
+                        columns = {name: _parse_column(rows, position[name]) for name in inputs}
+                        results = registry.evaluate_columns(columns, usable)
+                        formatted = {name: _format_column(values) for name, values in results.items()}
+                    for n, row in enumerate(rows):
+                        if len(row) < width:
+                            row.extend([""] * (width - len(row)))
+                        for name, values in formatted.items():
+                            row[position[name]] = values[n]
+                    writer.writerows(rows)
+                    rows_written += len(rows)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    os.replace(tmp_path, out_path)
+    return rows_written, names, skipped
+
+
+def recompute_store(path, metrics=None, registry=NOVEL_METRICS):
+    """
+    Recomputes metric columns of the SQLite store in one pass, adding columns
+    for metrics it does not have yet. Returns (rows, metrics, skipped).
+    """
+    conn = sqlite3.connect(path)
+    try:
+        existing = [row[1] for row in conn.execute("PRAGMA table_info(metrics)")]
+        usable, skipped = _available(registry, metrics, existing)
+        inputs = registry.base_inputs(usable)
+        if not usable:
+            return 0, [], skipped
+        quoted = ", ".join(f'"{c}"' for c in inputs)
+        fetched = conn.execute(f"SELECT id, {quoted} FROM metrics").fetchall()
+        ids = [row[0] for row in fetched]
+        columns = {
+            name: np.array([math.nan if row[k + 1] is None else row[k + 1] for row in fetched], dtype=float)
+            for k, name in enumerate(inputs)
+        }
+        results = registry.evaluate_columns(columns, usable)
+
+        names = list(results)
+        for name in names:
+            if name not in existing:
+                conn.execute(f'ALTER TABLE metrics ADD COLUMN "{name}" REAL')
+        assignments = ", ".join(f'"{name}" = ?' for name in names)
+        lists = [results[name].tolist() for name in names]
+        with conn:
+            conn.executemany(
+                f"UPDATE metrics SET {assignments} WHERE id = ?",
+                (
+                    [None if math.isnan(values[n]) else values[n] for values in lists] + [row_id]
+                    for n, row_id in enumerate(ids)
+                ),
+            )
+        return len(ids), names, skipped
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Derived metric registry utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show every metric with its inputs")
+    p_re = sub.add_parser("recompute", help="recompute metrics over a CSV log or the SQLite store")
+    target = p_re.add_mutually_exclusive_group(required=True)
+    target.add_argument("--csv")
+    target.add_argument("--db")
+    p_re.add_argument("--out", help="CSV to write (required with --csv; the log is never rewritten in place)")
+    p_re.add_argument("--metrics", help="comma-separated subset (default: all)")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for m in NOVEL_METRICS.metrics:
+            source = f"= {m.alias_of}" if m.alias_of else f"<- {', '.join(m.inputs)}"
+            print(f"{m.name:<38} {source}")
+        return
+
+    if np is None:
+        parser.error("recompute needs NumPy (pip install numpy)")
+    metrics = [m for m in args.metrics.split(",") if m] if args.metrics else None
+    unknown = [m for m in metrics or [] if m not in NOVEL_METRICS.names()]
+    if unknown:
+        parser.error(f"unknown metrics: {', '.join(unknown)} (see 'list')")
+    if args.csv and not args.out:
+        parser.error("--csv needs --out: the server may still be appending to the log")
+    start = time.time()
+    if args.csv:
+        try:
+            n, names, skipped = recompute_csv(args.csv, args.out, metrics)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        n, names, skipped = recompute_store(args.db, metrics)
+    for name, missing in skipped.items():
+        print(f"Skipped {name}: log has no {', '.join(missing)}")
+    print(f"Recomputed {len(names)} columns over {n} rows in {time.time() - start:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# Indexed SQLite metrics store
+#
+# A second sink for the background metrics writer (see metrics_writer.py).
+# Numeric metrics go to the `metrics` table, indexed by time, model, tag and node;
+# the prompt and response text go to a separate `texts` table so range scans
+# and aggregates over metrics never read the large text columns.
+#
+# The database runs in WAL mode, so the writer thread appends while request
+# threads run queries.
+#
+#   python metrics_store.py import metrics_log.csv [--db metrics.db]
+#
+# loads an existing CSV log (any schema version) into the store, streaming it
+# row by row.
+
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from metrics_writer import CSV_FIELDNAMES
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# SETTINGS
+###############################################################################
+METRICS_DB = os.environ.get("METRICS_DB", "metrics.db")
+QUERY_MAX_ROWS = int(os.environ.get("QUERY_MAX_ROWS", 100000))
+
+# Columns stored as text; every other metric column is REAL
+TEXT_COLUMNS = {
+    "request_id", "node_id", "timestamp", "model", "tag", "options", "start_type", "priority",
+    "energy_source", "energy_method", "session_id",
+}
+# Kept in the texts table, never in metrics
+LARGE_TEXT_COLUMNS = ("prompt", "response")
+# Always present, in this order, ahead of the metric columns
+KEY_COLUMNS = ("request_id", "ts", "timestamp", "model", "tag", "schema_version")
+
+
+def _column_type(name):
+    return "TEXT" if name in TEXT_COLUMNS else "REAL"
+
+
+def metric_columns(fieldnames=CSV_FIELDNAMES):
+    """
+    Columns of the metrics table: the key columns, then every CSV field that
+    is not a key or large text column.
+    """
+    columns = list(KEY_COLUMNS)
+    for name in fieldnames:
+        if name not in columns and name not in LARGE_TEXT_COLUMNS:
+            columns.append(name)
+    return columns
+
+
+def parse_time(value):
+    """
+    Epoch seconds or an ISO 8601 date/datetime (local time) -> epoch seconds.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(value).timestamp()
+
+###############################################################################
+# MetricsStore
+###############################################################################
+class MetricsStore:
+    """
+    SQLite-backed store. write_batch()/close() make it a MetricsWriter sink;
+    query() can be called from any thread (one read connection per thread).
+    """
+    def __init__(self, path=METRICS_DB, fieldnames=CSV_FIELDNAMES):
+        self.path = path
+        self.columns = metric_columns(fieldnames)
+        self._local = threading.local()
+        self._write_conn = None
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    # ----------- Connections & schema -----------
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _ensure_schema(self, conn):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            column_defs = ", ".join(
+                f'"{c}" {"REAL" if c == "ts" else _column_type(c)}' for c in self.columns
+            )
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS metrics (id INTEGER PRIMARY KEY, {column_defs})"
+            )
+            # Columns added by newer schema versions
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(metrics)")}
+            for c in self.columns:
+                if c not in existing:
+                    conn.execute(f'ALTER TABLE metrics ADD COLUMN "{c}" {_column_type(c)}')
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS texts ("
+                "metric_id INTEGER PRIMARY KEY REFERENCES metrics(id), prompt TEXT, response TEXT)"
+            )
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_metrics_request_id ON metrics(request_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_ts ON metrics(ts)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_model_ts ON metrics(model, ts)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_tag_ts ON metrics(tag, ts)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_node_ts ON metrics(node_id, ts)")
+            conn.commit()
+            self._schema_ready = True
+
+    def _read_conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._ensure_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    # ----------- Writer sink -----------
+    def write_batch(self, rows):
+        """
+        Inserts the rows; rows whose request_id is already stored are skipped.
+        Returns the rows that were inserted.
+        """
+        if self._write_conn is None:
+            self._write_conn = self._connect()
+            self._ensure_schema(self._write_conn)
+        conn = self._write_conn
+        placeholders = ", ".join("?" for _ in self.columns)
+        quoted = ", ".join(f'"{c}"' for c in self.columns)
+        insert_metrics = f"INSERT OR IGNORE INTO metrics ({quoted}) VALUES ({placeholders})"
+        inserted = []
+        with conn:
+            for row in rows:
+                values = [self._value(row, c) for c in self.columns]
+                cursor = conn.execute(insert_metrics, values)
+                if cursor.rowcount:
+                    inserted.append(row)
+                    conn.execute(
+                        "INSERT INTO texts (metric_id, prompt, response) VALUES (?, ?, ?)",
+                        (cursor.lastrowid, row.get("prompt"), row.get("response")),
+                    )
+        return inserted
+
+    @staticmethod
+    def _value(row, column):
+        if column == "ts":
+            ts = row.get("unix_time")
+            if ts is None and row.get("timestamp"):
+                ts = datetime.strptime(row["timestamp"], "%Y-%m-%d %H:%M:%S").timestamp()
+            return ts
+        value = row.get(column)
+        if value == "" or value is None:
+            return None
+        if column in TEXT_COLUMNS:
+            return str(value)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def close(self):
+        if self._write_conn is not None:
+            self._write_conn.close()
+            self._write_conn = None
+
+    # ----------- Queries -----------
+    def query(self, model=None, since=None, until=None, tag=None, columns=None,
+              limit=1000, include_text=False, node=None, latest=False):
+        """
+        Rows matching the filters, oldest first, with only the requested
+        columns (all metric columns when columns is empty). With latest, the
+        limit keeps the newest rows instead of the oldest.
+        Raises ValueError for unknown column names.
+        """
+        if columns:
+            unknown = [c for c in columns if c not in self.columns]
+            if unknown:
+                raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+            selected = list(columns)
+        else:
+            selected = list(self.columns)
+        select = ", ".join(f'm."{c}"' for c in selected)
+        if include_text:
+            select += ", t.prompt, t.response"
+
+        where, params = [], []
+        if model:
+            where.append("m.model = ?")
+            params.append(model)
+        if tag:
+            where.append("m.tag = ?")
+            params.append(tag)
+        if node:
+            where.append("m.node_id = ?")
+            params.append(node)
+        since_ts, until_ts = parse_time(since), parse_time(until)
+        if since_ts is not None:
+            where.append("m.ts >= ?")
+            params.append(since_ts)
+        if until_ts is not None:
+            where.append("m.ts < ?")
+            params.append(until_ts)
+
+        sql = f"SELECT {select} FROM metrics m"
+        if include_text:
+            sql += " LEFT JOIN texts t ON t.metric_id = m.id"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY m.ts DESC LIMIT ?" if latest else " ORDER BY m.ts LIMIT ?"
+        params.append(max(1, min(int(limit), QUERY_MAX_ROWS)))
+
+        names = selected + (["prompt", "response"] if include_text else [])
+        cursor = self._read_conn().execute(sql, params)
+        rows = [dict(zip(names, values)) for values in cursor]
+        if latest:
+            rows.reverse()
+        return rows
+
+###############################################################################
+# CSV import
+###############################################################################
+def import_csv(csv_path, store, batch_size=1000):
+    """
+    Streams an existing CSV log into the store. Rows of the original
+    unversioned layout get schema_version 1 and a request_id derived from
+    their position, so importing the same file twice does not duplicate rows.
+    """
+    imported = 0
+    batch = []
+    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+        for n, row in enumerate(csv.DictReader(f)):
+            if not row.get("request_id"):
+                row["request_id"] = f"{os.path.basename(csv_path)}:{n}"
+            if not row.get("schema_version"):
+                row["schema_version"] = 1
+            batch.append(row)
+            if len(batch) >= batch_size:
+                store.write_batch(batch)
+                imported += len(batch)
+                batch = []
+    if batch:
+        store.write_batch(batch)
+        imported += len(batch)
+    store.close()
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite metrics store utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="load a metrics CSV into the store")
+    p_import.add_argument("csv_path")
+    p_import.add_argument("--db", default=METRICS_DB)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        start = time.time()
+        n = import_csv(args.csv_path, MetricsStore(args.db))
+        print(f"Imported {n} rows into {args.db} in {time.time() - start:.2f}s")
+
+if __name__ == "__main__":
+    main()
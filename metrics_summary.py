@@ -0,0 +1,239 @@
+# In-memory rolling summaries of request metrics
+#
+# Every logged request is folded into per-model, per-time-bucket counters and
+# quantile sketches, so GET /metrics/summary can answer "p95 tokens_per_second
+# for this model over the last hour" without reading the CSV or the database.
+#
+# Quantiles come from a DDSketch-style log-bucketed histogram: every estimate
+# is within SUMMARY_RELATIVE_ACCURACY of the true value, sketches merge by
+# adding bucket counts, and each sketch holds at most SUMMARY_MAX_BINS
+# buckets. With a fixed number of time buckets per model, memory does not grow
+# with request volume.
+#
+# Settings (environment variables):
+#   SUMMARY_BUCKET_S           width of one time bucket, seconds      (default 60)
+#   SUMMARY_BUCKETS            time buckets kept per model            (default 60, i.e. 1 h)
+#   SUMMARY_RELATIVE_ACCURACY  relative error of quantile estimates   (default 0.01)
+#   SUMMARY_MAX_BINS           sketch buckets before the lowest merge (default 1024)
+
+import math
+import os
+import threading
+import time
+from collections import deque
+
+###############################################################################
+# SETTINGS
+###############################################################################
+SUMMARY_BUCKET_S = float(os.environ.get("SUMMARY_BUCKET_S", 60))
+SUMMARY_BUCKETS = int(os.environ.get("SUMMARY_BUCKETS", 60))
+SUMMARY_RELATIVE_ACCURACY = float(os.environ.get("SUMMARY_RELATIVE_ACCURACY", 0.01))
+SUMMARY_MAX_BINS = int(os.environ.get("SUMMARY_MAX_BINS", 1024))
+
+# Sketched row fields; rows without a field (e.g. TTFT on non-streaming
+# requests) are simply not counted for it
+SUMMARY_METRICS = (
+    "local_inference_time_s",
+    "tokens_per_second",
+    "energy_per_token_j",
+    "time_to_first_token_s",
+)
+# Summed row fields
+SUMMARY_COUNTERS = (
+    "eval_count", "prompt_eval_count", "total_energy_j",
+    "prompt_eval_tokens_saved", "prompt_eval_time_saved_s",
+)
+
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+###############################################################################
+# Quantile sketch
+###############################################################################
+class QuantileSketch:
+    """
+    DDSketch-style sketch for non-negative values. Values <= MIN_VALUE are
+    counted in a zero bucket. When more than max_bins buckets are in use the
+    lowest ones are collapsed, so accuracy is kept for the upper quantiles.
+    """
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=SUMMARY_RELATIVE_ACCURACY, max_bins=SUMMARY_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= self.MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + 1
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        ordered = sorted(self.bins)
+        excess = len(ordered) - self.max_bins
+        target = ordered[excess]
+        for index in ordered[:excess]:
+            self.bins[target] += self.bins.pop(index)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        for index, n in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                # The bucket midpoint can fall outside the observed range
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        if self.count == 0:
+            return {"count": 0}
+        result = {
+            "count": self.count,
+            "mean": self.sum / self.count,
+            "min": self.min,
+            "max": self.max,
+        }
+        for q in quantiles:
+            result[f"p{q * 100:g}"] = self.quantile(q)
+        return result
+
+###############################################################################
+# Rolling per-model summaries
+###############################################################################
+class _TimeBucket:
+    __slots__ = ("start", "requests", "counters", "sketches")
+
+    def __init__(self, start):
+        self.start = start
+        self.requests = 0
+        self.counters = dict.fromkeys(SUMMARY_COUNTERS, 0.0)
+        self.sketches = {name: QuantileSketch() for name in SUMMARY_METRICS}
+
+
+class MetricsSummary:
+    """
+    A ring of time buckets per model and start type (cold/warm). observe() is
+    called once per logged row from request threads; summary() merges the
+    buckets covering the window.
+    Results are cached until the next observe(), so polling is cheap.
+    """
+    def __init__(self, bucket_s=SUMMARY_BUCKET_S, buckets=SUMMARY_BUCKETS, clock=time.time):
+        self.bucket_s = bucket_s
+        self.buckets = buckets
+        self.clock = clock
+        self._models = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._cache = {}
+
+    @property
+    def max_window_s(self):
+        return self.bucket_s * self.buckets
+
+    def observe(self, row):
+        now = self.clock()
+        start = now - now % self.bucket_s
+        # Cold starts get their own rings so a model load does not skew the
+        # warm-path quantiles; summary() merges them unless asked not to
+        key = (row.get("model"), row.get("start_type") or "warm")
+        with self._lock:
+            ring = self._models.get(key)
+            if ring is None:
+                ring = self._models[key] = deque(maxlen=self.buckets)
+            if not ring or ring[-1].start < start:
+                ring.append(_TimeBucket(start))
+            bucket = ring[-1]
+            bucket.requests += 1
+            for name in SUMMARY_COUNTERS:
+                value = row.get(name)
+                if isinstance(value, (int, float)):
+                    bucket.counters[name] += value
+            for name in SUMMARY_METRICS:
+                value = row.get(name)
+                if isinstance(value, (int, float)):
+                    bucket.sketches[name].add(value)
+            self._generation += 1
+
+    def summary(self, model=None, window_s=None, quantiles=DEFAULT_QUANTILES, start_type=None):
+        """
+        {model: {requests, cold_requests, counters,
+                 metrics: {name: count/mean/min/max/pXX}}}
+        over the last window_s seconds (capped at the retained history),
+        for cold or warm requests only when start_type is given.
+        """
+        window_s = min(window_s or self.max_window_s, self.max_window_s)
+        now = self.clock()
+        # Buckets only change on observe() or when one ages out of the window
+        key = (model, window_s, tuple(quantiles), start_type, int(now // self.bucket_s))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == self._generation:
+                return cached[1]
+            generation = self._generation
+            oldest = now - now % self.bucket_s - window_s + self.bucket_s
+            selected = {}
+            cold_requests = {}
+            for (m, st), ring in self._models.items():
+                if (model is not None and m != model) or (start_type is not None and st != start_type):
+                    continue
+                buckets = [b for b in ring if b.start >= oldest]
+                selected.setdefault(m, []).extend(buckets)
+                if st == "cold":
+                    cold_requests[m] = cold_requests.get(m, 0) + sum(b.requests for b in buckets)
+
+            result = {}
+            for m, buckets in selected.items():
+                if not buckets:
+                    continue
+                counters = dict.fromkeys(SUMMARY_COUNTERS, 0.0)
+                sketches = {name: QuantileSketch() for name in SUMMARY_METRICS}
+                for b in buckets:
+                    for name, value in b.counters.items():
+                        counters[name] += value
+                    for name, sketch in b.sketches.items():
+                        sketches[name].merge(sketch)
+                result[m] = {
+                    "requests": sum(b.requests for b in buckets),
+                    "cold_requests": cold_requests.get(m, 0),
+                    "counters": counters,
+                    "metrics": {name: s.summary(quantiles) for name, s in sketches.items()},
+                }
+            if len(self._cache) > 64:
+                self._cache.clear()
+            self._cache[key] = (generation, result)
+        return result
@@ -0,0 +1,423 @@
+# Background batched metrics writer
+#
+# Requests hand their finished row to MetricsWriter.submit(), which only puts
+# it on a bounded in-memory queue. A single writer thread drains the queue in
+# batches and appends them to the CSV with one fixed, versioned column list,
+# so logging costs the request path a queue put and concurrent requests can
+# never interleave partial rows or shift columns.
+#
+# Tuning (environment variables):
+#   METRICS_QUEUE_SIZE        rows buffered before new rows are dropped (default 10000)
+#   METRICS_BATCH_SIZE        max rows written per batch                (default 500)
+#   METRICS_FLUSH_INTERVAL_S  max time a row waits before being written (default 1.0)
+#   METRICS_FSYNC             never | batch | interval                  (default interval)
+#   METRICS_FSYNC_INTERVAL_S  fsync period for "interval"               (default 5.0)
+#   METRICS_ROTATE_MAX_BYTES  rotate when the file grows past this      (default 50 MB, 0 = off)
+#   METRICS_ROTATE_DAILY      1 = rotate when the date changes          (default 1)
+#
+# Rotated files are renamed <name>.<YYYY-MM-DD>.<n>.csv next to the live file.
+# A live file whose header does not match the current schema (e.g. written by
+# an older version) is rotated away on startup instead of being appended to.
+
+import atexit
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# SCHEMA
+###############################################################################
+# Bump CSV_SCHEMA_VERSION whenever CSV_FIELDNAMES changes. Version 1 is the
+# original, unversioned layout whose columns followed the row's dict keys.
+# v2: fixed column list with schema_version; prompt_eval_count, cpu_std_dev,
+#     sample_count, local_inference_time_s, energy, process and streaming columns
+# v3: request_id, tag
+# v4: options (Ollama options as JSON)
+# v5: start_type (cold/warm)
+# v6: scheduling (priority, queue_wait_s, service_time_s, queue_depth_at_arrival)
+# v7: node_id
+# v8: session_metrics (session_id, session_turn, context and prompt-eval savings)
+CSV_SCHEMA_VERSION = 8
+
+CSV_FIELDNAMES = [
+    "schema_version",
+    "request_id",
+    "node_id",
+    "timestamp",
+    "model",
+    "tag",
+    "options",
+    "prompt",
+    "response",
+
+    # ollama_metrics
+    "total_duration_ns",
+    "total_duration_s",
+    "load_duration_ns",
+    "prompt_eval_duration_ns",
+    "eval_duration_ns",
+    "prompt_eval_count",
+    "eval_count",
+    "tokens_per_second",
+    "start_type",
+
+    # resource_usage
+    "avg_cpu_usage_percent",
+    "peak_cpu_usage_percent",
+    "avg_ram_usage_mb",
+    "peak_ram_usage_mb",
+    "avg_power_w",
+    "peak_power_w",
+    "min_power_w",
+    "cpu_std_dev",
+    "mem_std_dev",
+    "power_std_dev",
+    "sample_count",
+    "local_inference_time_s",
+
+    # energy_metrics
+    "total_energy_j",
+    "energy_source",
+    "energy_method",
+    "integrated_avg_power_w",
+
+    # process_usage
+    "ollama_cpu_time_s",
+    "ollama_avg_cpu_percent",
+    "ollama_peak_cpu_percent",
+    "ollama_avg_rss_mb",
+    "ollama_peak_rss_mb",
+    "ollama_pss_mb",
+    "ollama_io_read_bytes",
+    "ollama_io_write_bytes",
+    "server_avg_cpu_percent",
+    "ollama_memory_usage_per_token_mb",
+    "ollama_model_efficiency_index",
+
+    # scheduling
+    "priority",
+    "queue_wait_s",
+    "service_time_s",
+    "queue_depth_at_arrival",
+
+    # streaming_metrics (empty for blocking requests)
+    "time_to_first_token_s",
+    "stream_token_count",
+    "inter_token_latency_mean_s",
+    "inter_token_latency_p50_s",
+    "inter_token_latency_p95_s",
+    "inter_token_latency_p99_s",
+    "max_stall_s",
+
+    # session_metrics (empty without a session_id)
+    "session_id",
+    "session_turn",
+    "context_tokens_sent",
+    "prompt_eval_tokens_saved",
+    "prompt_eval_time_saved_s",
+
+    # all_novel_metrics
+    "time_per_token_s",
+    "load_to_inference_ratio",
+    "memory_usage_per_token_mb",
+    "energy_per_token_j",
+    "power_spike_w",
+    "prompt_eval_ratio",
+    "time_per_prompt_eval_ns",
+    "prompt_to_generation_overhead_ratio",
+    "power_efficiency_index_tps_per_w",
+    "cpu_stability_index",
+    "model_efficiency_index",
+    "peak_cpu_to_average_ratio",
+    "memory_variation_index",
+    "peak_power_to_average_power_ratio",
+    "prompt_eval_tokens_per_s",
+    "eval_latency_per_token_ns",
+    "eval_memory_efficiency",
+    "token_production_energy_efficiency",
+    "avg_cpu_to_power_ratio",
+    "peak_ram_to_peak_cpu_ratio",
+    "time_weighted_power_factor",
+    "load_to_prompt_ratio",
+    "prompt_to_total_token_ratio",
+    "memory_to_cpu_ratio",
+    "memory_to_power_ratio",
+    "ram_usage_variation_index",
+    "power_usage_variation_index",
+    "sustained_inference_factor",
+    "thermal_load_factor",
+]
+
+# Response groups flattened into a row, in this order
+METRIC_GROUPS = (
+    "ollama_metrics",
+    "resource_usage",
+    "energy_metrics",
+    "process_usage",
+    "scheduling",
+    "streaming_metrics",
+    "session_metrics",
+    "all_novel_metrics",
+)
+
+
+def flatten_metrics(timestamp_str, model_name, prompt, metrics, tag=None, node_id=None):
+    """
+    One row from a collect_metrics() result. Keys outside CSV_FIELDNAMES
+    (e.g. per-token arrival lists, unix_time) are left out of the CSV but
+    available to other sinks.
+    """
+    row = {
+        "schema_version": CSV_SCHEMA_VERSION,
+        "request_id": metrics.get("request_id"),
+        "node_id": node_id,
+        "timestamp": timestamp_str,
+        "unix_time": time.time(),
+        "model": model_name,
+        "tag": tag,
+        "options": json.dumps(metrics["options"], sort_keys=True) if metrics.get("options") else "",
+        "prompt": prompt,
+        "response": metrics.get("model_response", ""),
+    }
+    for group in METRIC_GROUPS:
+        row.update(metrics.get(group) or {})
+    return row
+
+###############################################################################
+# SETTINGS
+###############################################################################
+METRICS_QUEUE_SIZE = int(os.environ.get("METRICS_QUEUE_SIZE", 10000))
+METRICS_BATCH_SIZE = int(os.environ.get("METRICS_BATCH_SIZE", 500))
+METRICS_FLUSH_INTERVAL_S = float(os.environ.get("METRICS_FLUSH_INTERVAL_S", 1.0))
+METRICS_FSYNC = os.environ.get("METRICS_FSYNC", "interval")
+METRICS_FSYNC_INTERVAL_S = float(os.environ.get("METRICS_FSYNC_INTERVAL_S", 5.0))
+METRICS_ROTATE_MAX_BYTES = int(os.environ.get("METRICS_ROTATE_MAX_BYTES", 50 * 1024 * 1024))
+METRICS_ROTATE_DAILY = os.environ.get("METRICS_ROTATE_DAILY", "1") == "1"
+
+_STOP = object()
+
+###############################################################################
+# CSV sink
+###############################################################################
+class CsvSink:
+    """
+    Owns the live CSV file: header handling, rotation and fsync.
+    Only ever used from the writer thread.
+    """
+    def __init__(self, path, fieldnames=CSV_FIELDNAMES, fsync=METRICS_FSYNC,
+                 fsync_interval_s=METRICS_FSYNC_INTERVAL_S,
+                 rotate_max_bytes=METRICS_ROTATE_MAX_BYTES, rotate_daily=METRICS_ROTATE_DAILY):
+        if fsync not in ("never", "batch", "interval"):
+            raise ValueError(f"Unknown METRICS_FSYNC policy '{fsync}'")
+        self.path = path
+        self.fieldnames = fieldnames
+        self.fsync = fsync
+        self.fsync_interval_s = fsync_interval_s
+        self.rotate_max_bytes = rotate_max_bytes
+        self.rotate_daily = rotate_daily
+
+        self._file = None
+        self._writer = None
+        self._opened_on = None
+        self._last_fsync = time.monotonic()
+
+    def _header_matches(self):
+        with open(self.path, "r", newline="", encoding="utf-8") as f:
+            header = next(csv.reader(f), None)
+        return header == self.fieldnames
+
+    def _rotated_name(self, day):
+        base, ext = os.path.splitext(self.path)
+        n = 1
+        while True:
+            candidate = f"{base}.{day.isoformat()}.{n}{ext or '.csv'}"
+            if not os.path.exists(candidate):
+                return candidate
+            n += 1
+
+    def _rotate_existing(self, day):
+        target = self._rotated_name(day)
+        os.replace(self.path, target)
+        logger.info(f"Rotated {self.path} -> {target}")
+
+    def _open(self):
+        if os.path.isfile(self.path) and os.path.getsize(self.path) > 0:
+            if not self._header_matches():
+                mtime_day = date.fromtimestamp(os.path.getmtime(self.path))
+                self._rotate_existing(mtime_day)
+        is_new = not os.path.isfile(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, mode="a", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        if is_new:
+            self._writer.writerow(self.fieldnames)
+        self._opened_on = date.today()
+
+    def _close(self):
+        if self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def _maybe_rotate(self):
+        today = date.today()
+        too_big = (self.rotate_max_bytes > 0
+                   and os.fstat(self._file.fileno()).st_size >= self.rotate_max_bytes)
+        new_day = self.rotate_daily and today != self._opened_on
+        if too_big or new_day:
+            day = self._opened_on
+            self._close()
+            self._rotate_existing(day)
+            self._open()
+
+    def write_batch(self, rows):
+        if self._file is None:
+            self._open()
+        else:
+            self._maybe_rotate()
+        fields = self.fieldnames
+        self._writer.writerows([[row.get(f, "") for f in fields] for row in rows])
+        self._file.flush()
+        now = time.monotonic()
+        if self.fsync == "batch" or (
+                self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval_s):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def close(self):
+        self._close()
+
+###############################################################################
+# MetricsWriter
+###############################################################################
+class MetricsWriter:
+    """
+    Bounded queue + single writer thread in front of one or more sinks (each
+    with write_batch(rows) and close()). The thread starts on the first
+    submit(), so importing the module never creates files.
+    """
+    def __init__(self, sinks, max_queue=METRICS_QUEUE_SIZE, batch_size=METRICS_BATCH_SIZE,
+                 flush_interval_s=METRICS_FLUSH_INTERVAL_S):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+        self.rows_written = 0             # written by every sink
+        self.rows_failed = 0              # lost by at least one sink
+        self.rows_dropped = 0
+        self.batches_written = 0
+        self.write_errors = 0
+        self.sink_errors = {}             # sink class name -> failed batches
+        self._last_drop_warning = 0.0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def submit(self, row):
+        """
+        Queues one row without blocking. Returns False if the row was dropped
+        because the queue is full (the writer cannot keep up) or closed.
+        """
+        if self._closed:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self.rows_dropped += 1
+            now = time.monotonic()
+            if now - self._last_drop_warning > 10:
+                self._last_drop_warning = now
+                logger.warning(f"Metrics queue full; {self.rows_dropped} rows dropped so far")
+            return False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval_s)
+            except queue.Empty:
+                continue
+            batch = []
+            if first is _STOP:
+                stopping = True
+            else:
+                batch.append(first)
+            # Drain whatever else is already queued, up to one batch
+            while len(batch) < self.batch_size and not stopping:
+                try:
+                    row = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stopping = True
+                else:
+                    batch.append(row)
+            if batch:
+                self._write(batch)
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                logger.error(f"Metrics sink close error: {e}")
+
+    def _write(self, batch):
+        failed = False
+        for sink in self.sinks:
+            try:
+                sink.write_batch(batch)
+            except Exception as e:
+                failed = True
+                name = type(sink).__name__
+                self.write_errors += 1
+                self.sink_errors[name] = self.sink_errors.get(name, 0) + 1
+                logger.error(f"Metrics write error ({name}): {e}")
+        if failed:
+            self.rows_failed += len(batch)
+        else:
+            self.rows_written += len(batch)
+            self.batches_written += 1
+
+    def close(self, timeout_s=30.0):
+        """
+        Writes everything still queued, closes the sinks and stops the thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None:
+            return
+        # put() (blocking) so the stop marker is never lost on a full queue
+        self._queue.put(_STOP)
+        self._thread.join(timeout_s)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "rows_dropped": self.rows_dropped,
+            "batches_written": self.batches_written,
+            "write_errors": self.write_errors,
+            "sink_errors": dict(self.sink_errors),
+        }
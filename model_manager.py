@@ -0,0 +1,196 @@
+# Model residency management for Ollama
+#
+# Decides the keep_alive sent with every request, preloads models at startup,
+# and exposes preload/unload so a model's multi-second load happens when we
+# choose instead of on a user's request.
+#
+# Policy (environment variables):
+#   KEEP_ALIVE              keep_alive for models that are neither pinned nor hot,
+#                           e.g. "5m" or "30s"; unset leaves Ollama's default
+#   PINNED_MODELS           comma-separated models kept loaded indefinitely
+#   PRELOAD_MODELS          comma-separated models loaded at startup
+#                           (pinned models are always preloaded)
+#   HOT_MODEL_MIN_REQUESTS  requests within HOT_MODEL_WINDOW_S that make a model
+#                           hot, i.e. pinned until it cools down (0 disables; default 0)
+#   HOT_MODEL_WINDOW_S      window for the hot-model rule                  (default 600)
+#   COLD_LOAD_THRESHOLD_S   load_duration above which a request counts as a
+#                           cold start                                     (default 0.1)
+#
+# Ollama has no separate load/unload endpoint: a /api/generate call without a
+# prompt loads the model, and keep_alive 0 unloads it.
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# SETTINGS
+###############################################################################
+KEEP_ALIVE = os.environ.get("KEEP_ALIVE") or None
+PINNED_MODELS = [m for m in os.environ.get("PINNED_MODELS", "").split(",") if m]
+PRELOAD_MODELS = [m for m in os.environ.get("PRELOAD_MODELS", "").split(",") if m]
+HOT_MODEL_MIN_REQUESTS = int(os.environ.get("HOT_MODEL_MIN_REQUESTS", 0))
+HOT_MODEL_WINDOW_S = float(os.environ.get("HOT_MODEL_WINDOW_S", 600))
+COLD_LOAD_THRESHOLD_S = float(os.environ.get("COLD_LOAD_THRESHOLD_S", 0.1))
+
+# keep_alive meaning "never unload"
+KEEP_ALIVE_FOREVER = -1
+
+
+def classify_start(load_duration_ns, threshold_s=COLD_LOAD_THRESHOLD_S):
+    """
+    "cold" when Ollama had to load the model for this request, else "warm".
+    Warm requests still report a few milliseconds of load_duration.
+    """
+    return "cold" if load_duration_ns / 1e9 > threshold_s else "warm"
+
+###############################################################################
+# ModelManager
+###############################################################################
+class ModelManager:
+    """
+    keep_alive policy plus preload/unload against one Ollama server.
+    keep_alive_for() and record_request() are called from request threads.
+    """
+    def __init__(self, base_url, keep_alive=KEEP_ALIVE, pinned=PINNED_MODELS,
+                 preload=PRELOAD_MODELS, hot_min_requests=HOT_MODEL_MIN_REQUESTS,
+                 hot_window_s=HOT_MODEL_WINDOW_S):
+        self.base_url = base_url.rstrip("/")
+        self.keep_alive = keep_alive
+        self.pinned = set(pinned)
+        self.preload_models = list(dict.fromkeys(list(pinned) + list(preload)))
+        self.hot_min_requests = hot_min_requests
+        self.hot_window_s = hot_window_s
+        self._lock = threading.Lock()
+        self._recent = {}       # model -> deque of request times
+        self._hot = set()
+        self._counts = {}       # model -> {"requests": n, "cold_starts": n}
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ----------- Policy -----------
+    def _is_hot(self, model, now):
+        if self.hot_min_requests <= 0:
+            return False
+        recent = self._recent.get(model)
+        if not recent:
+            return False
+        while recent and recent[0] < now - self.hot_window_s:
+            recent.popleft()
+        return len(recent) >= self.hot_min_requests
+
+    def keep_alive_for(self, model):
+        """
+        keep_alive to send with a request for `model` (None: Ollama's default).
+        """
+        if model in self.pinned:
+            return KEEP_ALIVE_FOREVER
+        with self._lock:
+            if model in self._hot:
+                return KEEP_ALIVE_FOREVER
+        return self.keep_alive
+
+    def record_request(self, model, start_type):
+        now = time.monotonic()
+        with self._lock:
+            counts = self._counts.setdefault(model, {"requests": 0, "cold_starts": 0})
+            counts["requests"] += 1
+            if start_type == "cold":
+                counts["cold_starts"] += 1
+            if self.hot_min_requests > 0:
+                self._recent.setdefault(model, deque()).append(now)
+                if self._is_hot(model, now):
+                    self._hot.add(model)
+
+    # ----------- Ollama calls -----------
+    def preload(self, model, keep_alive=None):
+        """
+        Loads `model` (a no-op when already resident) and sets its keep_alive.
+        Returns the load time in seconds as reported by Ollama.
+        """
+        if keep_alive is None:
+            keep_alive = self.keep_alive_for(model)
+        payload = {"model": model}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        response = requests.post(f"{self.base_url}/api/generate", json=payload)
+        response.raise_for_status()
+        return response.json().get("load_duration", 0) / 1e9
+
+    def unload(self, model):
+        with self._lock:
+            self._hot.discard(model)
+            self._recent.pop(model, None)
+        response = requests.post(f"{self.base_url}/api/generate",
+                                 json={"model": model, "keep_alive": 0})
+        response.raise_for_status()
+
+    def loaded(self):
+        """
+        Models Ollama currently holds in memory (its /api/ps listing).
+        """
+        response = requests.get(f"{self.base_url}/api/ps")
+        response.raise_for_status()
+        return response.json().get("models", [])
+
+    def status(self):
+        with self._lock:
+            return {
+                "keep_alive": self.keep_alive,
+                "pinned": sorted(self.pinned),
+                "hot": sorted(self._hot),
+                "preload": self.preload_models,
+                "counts": {m: dict(c) for m, c in self._counts.items()},
+            }
+
+    # ----------- Background work -----------
+    def start(self):
+        """
+        Preloads the configured models and, with the hot-model rule enabled,
+        watches for models cooling down. Runs on a daemon thread so server
+        startup is not held up by model loads.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="model-manager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        for model in self.preload_models:
+            try:
+                load_s = self.preload(model)
+                logger.info(f"Preloaded {model} in {load_s:.2f}s")
+            except requests.RequestException as e:
+                logger.warning(f"Preloading {model} failed: {e}")
+
+        if self.hot_min_requests <= 0:
+            return
+        while not self._stop.wait(max(1.0, self.hot_window_s / 10)):
+            self._cool_down()
+
+    def _cool_down(self):
+        """
+        Hands models that are no longer hot back to the default keep_alive, so
+        Ollama can evict them again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cooled = [m for m in self._hot if not self._is_hot(m, now)]
+            self._hot.difference_update(cooled)
+        for model in cooled:
+            if model in self.pinned:
+                continue
+            try:
+                self.preload(model, keep_alive=self.keep_alive if self.keep_alive is not None else "5m")
+                logger.info(f"{model} cooled down; keep_alive back to default")
+            except requests.RequestException as e:
+                logger.warning(f"Resetting keep_alive of {model} failed: {e}")
@@ -0,0 +1,412 @@
+# Local Ollama stand-in for benchmarking the metrics server without a model
+#
+# Implements POST /api/generate (streaming and non-streaming) and answers with
+# the same timing fields Ollama does (total_duration, load_duration,
+# prompt_eval_count/duration, eval_count/duration), generating tokens at a
+# fixed rate. Everything is deterministic for a given --seed, so queueing and
+# contention behaviour can be reproduced on any machine without a GPU.
+#
+# Behaviour that mimics a real Ollama server:
+#   --num-parallel       requests served at once (OLLAMA_NUM_PARALLEL); the
+#                        rest wait, and the wait shows up in total_duration
+#   --load-ms            cold-load delay when a model is not resident, reported
+#                        as load_duration
+#   --keep-alive         seconds a model stays resident after its last request
+#                        (a request's own "keep_alive" overrides it; 0 unloads)
+#   --max-loaded-models  resident models before the least recently used one is
+#                        evicted (OLLAMA_MAX_LOADED_MODELS)
+#   --model-memory-mb    memory allocated (and touched) while a model is resident
+#   --cpu-ms-per-token   CPU burned per generated token, on a worker thread
+#   --error-rate         fraction of requests answered with HTTP 500
+#   --abort-rate         fraction of streaming requests cut off mid-stream
+#
+# A request's options.num_predict caps the tokens generated. Final chunks carry
+# a "context" (prompt and response token ids) that a later request may send
+# back; as with Ollama's per-slot KV cache, the context is only re-evaluated
+# when none of the last --num-parallel contexts matches it. A request without
+# a prompt only loads the model (or unloads it with keep_alive 0), and
+# GET /api/ps lists the resident models, as in Ollama.
+
+# Run:
+#   python ollama_stub.py --port 11434 --tokens-per-second 40 --tokens 32
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import uvicorn
+
+###############################################################################
+# STUB SETTINGS
+###############################################################################
+class StubConfig:
+    def __init__(self, tokens_per_second=40.0, tokens=32, prompt_tokens_per_second=400.0,
+                 num_parallel=1, load_ms=0.0, keep_alive_s=300.0, max_loaded_models=1,
+                 model_memory_mb=0, cpu_ms_per_token=0.0, error_rate=0.0, abort_rate=0.0,
+                 seed=0):
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.num_parallel = num_parallel
+        self.load_ms = load_ms
+        self.keep_alive_s = keep_alive_s
+        self.max_loaded_models = max_loaded_models
+        self.model_memory_mb = model_memory_mb
+        self.cpu_ms_per_token = cpu_ms_per_token
+        self.error_rate = error_rate
+        self.abort_rate = abort_rate
+        self.seed = seed
+
+
+def parse_keep_alive(value, default_s):
+    """
+    Ollama keep_alive: seconds as a number, or a duration string such as
+    "30s", "5m", "1h". Negative values keep the model loaded indefinitely.
+    """
+    if value is None:
+        return default_s
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = re.fullmatch(r"\s*(-?[\d.]+)\s*(ms|s|m|h)?\s*", str(value))
+        if not match:
+            return default_s
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[match.group(2) or "s"]
+        seconds = float(match.group(1)) * scale
+    return float("inf") if seconds < 0 else seconds
+
+###############################################################################
+# Model residency
+###############################################################################
+class LoadedModel:
+    def __init__(self, name, memory_mb):
+        self.name = name
+        self.expires_at = float("inf")
+        self.active = 0
+        # Touch every page so the footprint shows up in RSS, like real weights
+        self.memory = bytearray(memory_mb * 1024 * 1024)
+        for i in range(0, len(self.memory), 4096):
+            self.memory[i] = 1
+
+
+class ModelCache:
+    """
+    Which models are resident, when they expire and which one to evict when a
+    new one has to be loaded. Loads are serialized, like Ollama's scheduler.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.models = {}
+        self._load_lock = asyncio.Lock()
+
+    def _expire(self, now):
+        for name, model in list(self.models.items()):
+            if model.active == 0 and model.expires_at <= now:
+                del self.models[name]
+
+    async def acquire(self, name):
+        """
+        Marks the model in use, loading it first if needed.
+        Returns the load time in ns (0 when it was already resident).
+        """
+        async with self._load_lock:
+            self._expire(time.monotonic())
+            model = self.models.get(name)
+            load_ns = 0
+            if model is None:
+                while len(self.models) >= self.config.max_loaded_models:
+                    idle = [m for m in self.models.values() if m.active == 0]
+                    if not idle:
+                        break
+                    del self.models[min(idle, key=lambda m: m.expires_at).name]
+                start_ns = time.perf_counter_ns()
+                await asyncio.sleep(self.config.load_ms / 1000)
+                model = LoadedModel(name, self.config.model_memory_mb)
+                load_ns = time.perf_counter_ns() - start_ns
+                self.models[name] = model
+            model.active += 1
+            return load_ns
+
+    def unload(self, name):
+        model = self.models.get(name)
+        if model is not None and model.active == 0:
+            del self.models[name]
+
+    def listing(self):
+        """
+        Resident models in the shape of Ollama's /api/ps.
+        """
+        now_mono, now_wall = time.monotonic(), time.time()
+        self._expire(now_mono)
+        listing = []
+        for model in self.models.values():
+            if model.expires_at == float("inf"):
+                expires_at = None
+            else:
+                expires_at = datetime.fromtimestamp(
+                    now_wall + model.expires_at - now_mono, timezone.utc).isoformat()
+            listing.append({
+                "name": model.name,
+                "model": model.name,
+                "size": len(model.memory),
+                "size_vram": 0,
+                "expires_at": expires_at,
+            })
+        return listing
+
+    def release(self, name, keep_alive_s):
+        model = self.models.get(name)
+        if model is None:
+            return
+        model.active -= 1
+        model.expires_at = time.monotonic() + keep_alive_s
+        if keep_alive_s <= 0 and model.active == 0:
+            del self.models[name]
+
+###############################################################################
+# STUB APP
+###############################################################################
+class OllamaStub:
+    """
+    ASGI implementation of Ollama's /api/generate.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.models = ModelCache(config)
+        self.slots = None
+        self.kv_cache = OrderedDict()     # (model, context hash) of recent requests
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["path"] == "/api/ps" and scope["method"] == "GET":
+            await self._send_json(send, {"models": self.models.listing()})
+            return
+        if scope["path"] != "/api/generate" or scope["method"] != "POST":
+            await self._send_json(send, {"error": "not found"}, 404)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        payload = json.loads(body or b"{}")
+
+        if self.rng.random() < self.config.error_rate:
+            await self._send_json(send, {"error": "stub: injected server error"}, 500)
+            return
+
+        if not payload.get("prompt"):
+            await self._load_or_unload(send, payload)
+            return
+
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.config.num_parallel)
+        # Ollama's durations start when the request arrives, so time spent
+        # waiting for a slot or a model load is part of total_duration
+        start_ns = time.perf_counter_ns()
+        model = payload.get("model", "")
+        keep_alive_s = parse_keep_alive(payload.get("keep_alive"), self.config.keep_alive_s)
+        async with self.slots:
+            load_ns = await self.models.acquire(model)
+            try:
+                if payload.get("stream", True):
+                    await self._generate_stream(send, payload, start_ns, load_ns)
+                else:
+                    await self._generate(send, payload, start_ns, load_ns)
+            finally:
+                self.models.release(model, keep_alive_s)
+
+    async def _load_or_unload(self, send, payload):
+        """
+        A request without a prompt only loads the model, or unloads it when
+        keep_alive is 0, as in Ollama.
+        """
+        start_ns = time.perf_counter_ns()
+        model = payload.get("model", "")
+        keep_alive_s = parse_keep_alive(payload.get("keep_alive"), self.config.keep_alive_s)
+        if keep_alive_s <= 0:
+            self.models.unload(model)
+            done_reason, load_ns = "unload", 0
+        else:
+            load_ns = await self.models.acquire(model)
+            self.models.release(model, keep_alive_s)
+            done_reason = "load"
+        await self._send_json(send, {
+            "model": model,
+            "response": "",
+            "done": True,
+            "done_reason": done_reason,
+            "total_duration": time.perf_counter_ns() - start_ns,
+            "load_duration": load_ns,
+        })
+
+    def _num_predict(self, payload):
+        num_predict = (payload.get("options") or {}).get("num_predict")
+        if isinstance(num_predict, int) and num_predict >= 0:
+            return min(num_predict, self.config.tokens)
+        return self.config.tokens
+
+    async def _next_token(self, i):
+        if self.config.cpu_ms_per_token > 0:
+            await asyncio.to_thread(burn_cpu, self.config.cpu_ms_per_token / 1000)
+        await asyncio.sleep(1.0 / self.config.tokens_per_second)
+        return self._token(i)
+
+    async def _generate(self, send, payload, start_ns, load_ns):
+        prompt_tokens, prompt_eval_ns = await self._prompt_eval(payload)
+        eval_start_ns = time.perf_counter_ns()
+        tokens = []
+        for i in range(self._num_predict(payload)):
+            tokens.append(await self._next_token(i))
+        eval_ns = time.perf_counter_ns() - eval_start_ns
+        result = self._final_chunk(payload, start_ns, load_ns, prompt_tokens, prompt_eval_ns,
+                                   len(tokens), eval_ns)
+        result["response"] = "".join(tokens)
+        await self._send_json(send, result)
+
+    async def _generate_stream(self, send, payload, start_ns, load_ns):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/x-ndjson")],
+        })
+        num_predict = self._num_predict(payload)
+        abort_at = (self.rng.randrange(num_predict)
+                    if num_predict and self.rng.random() < self.config.abort_rate else None)
+        prompt_tokens, prompt_eval_ns = await self._prompt_eval(payload)
+        eval_start_ns = time.perf_counter_ns()
+        for i in range(num_predict):
+            if i == abort_at:
+                # Ends the response without a done chunk, like a crashed runner
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            chunk = {"model": payload.get("model", ""), "response": await self._next_token(i), "done": False}
+            await send({
+                "type": "http.response.body",
+                "body": (json.dumps(chunk) + "\n").encode("utf-8"),
+                "more_body": True,
+            })
+        eval_ns = time.perf_counter_ns() - eval_start_ns
+        final = self._final_chunk(payload, start_ns, load_ns, prompt_tokens, prompt_eval_ns,
+                                  num_predict, eval_ns)
+        final["response"] = ""
+        await send({
+            "type": "http.response.body",
+            "body": (json.dumps(final) + "\n").encode("utf-8"),
+            "more_body": False,
+        })
+
+    def _kv_key(self, payload, context):
+        return payload.get("model", ""), hashlib.md5(json.dumps(context).encode("ascii")).digest()
+
+    async def _prompt_eval(self, payload):
+        prompt_tokens = max(1, len(payload.get("prompt", "").split()))
+        context = payload.get("context") or []
+        if context and self._kv_key(payload, context) not in self.kv_cache:
+            prompt_tokens += len(context)
+        start_ns = time.perf_counter_ns()
+        await asyncio.sleep(prompt_tokens / self.config.prompt_tokens_per_second)
+        return prompt_tokens, time.perf_counter_ns() - start_ns
+
+    def _final_chunk(self, payload, start_ns, load_ns, prompt_tokens, prompt_eval_ns,
+                     eval_count, eval_ns):
+        context = list(payload.get("context") or [])
+        context += [int.from_bytes(hashlib.md5(w.encode("utf-8")).digest()[:2], "little")
+                    for w in payload.get("prompt", "").split()]
+        context += [65536 + i for i in range(eval_count)]
+        self.kv_cache[self._kv_key(payload, context)] = True
+        while len(self.kv_cache) > self.config.num_parallel:
+            self.kv_cache.popitem(last=False)
+        return {
+            "model": payload.get("model", ""),
+            "done": True,
+            "total_duration": time.perf_counter_ns() - start_ns,
+            "load_duration": load_ns,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": prompt_eval_ns,
+            "eval_count": eval_count,
+            "eval_duration": eval_ns,
+            "context": context,
+        }
+
+    @staticmethod
+    def _token(i):
+        return f" tok{i}"
+
+    @staticmethod
+    async def _send_json(send, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def burn_cpu(seconds):
+    """
+    Busy work for about `seconds`. hashlib releases the GIL on large buffers,
+    so parallel slots burn separate cores as model runners would.
+    """
+    block = b"\0" * 65536
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        hashlib.sha256(block).digest()
+
+###############################################################################
+# MAIN
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for Ollama's /api/generate")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--num-parallel", type=int, default=1)
+    parser.add_argument("--load-ms", type=float, default=0.0)
+    parser.add_argument("--keep-alive", type=float, default=300.0, help="seconds")
+    parser.add_argument("--max-loaded-models", type=int, default=1)
+    parser.add_argument("--model-memory-mb", type=int, default=0)
+    parser.add_argument("--cpu-ms-per-token", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--abort-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        tokens_per_second=args.tokens_per_second,
+        tokens=args.tokens,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        num_parallel=args.num_parallel,
+        load_ms=args.load_ms,
+        keep_alive_s=args.keep_alive,
+        max_loaded_models=args.max_loaded_models,
+        model_memory_mb=args.model_memory_mb,
+        cpu_ms_per_token=args.cpu_ms_per_token,
+        error_rate=args.error_rate,
+        abort_rate=args.abort_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(OllamaStub(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
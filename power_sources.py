@@ -0,0 +1,286 @@
+# Power sources for the resource sampler
+#
+# Every source answers read_power_w(cpu_percent) once per sampler tick; sources
+# backed by a hardware energy counter also answer read_energy_j(), which lets
+# a request's energy be read directly as (counter at end - counter at start)
+# instead of being integrated from power samples.
+#
+#   rapl     Intel RAPL package counters under /sys/class/powercap
+#   hwmon    power sensors (INA2xx etc.) under /sys/class/hwmon
+#   linear   base + (max - base) * cpu%, coefficients from device_profiles.json
+#   replay   timestamped power trace from a CSV file (timestamp_s,power_w)
+#
+# Selection (environment variables):
+#   POWER_SOURCE    auto | rapl | hwmon | linear | replay:<path>   (default auto)
+#                   auto = rapl, then hwmon, then linear
+#   DEVICE_PROFILE  profile in device_profiles.json for "linear"   (default "default")
+#   HWMON_SENSORS   comma-separated hwmon chip names to use, e.g. "ina219,ina226"
+#                   (default: every chip exposing a power reading)
+#
+# The sysfs roots are constructor arguments so the backends can be exercised
+# against a fake directory tree without the hardware.
+
+import bisect
+import csv
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# SETTINGS
+###############################################################################
+POWER_SOURCE = os.environ.get("POWER_SOURCE", "auto")
+DEVICE_PROFILE = os.environ.get("DEVICE_PROFILE", "default")
+HWMON_SENSORS = [s for s in os.environ.get("HWMON_SENSORS", "").split(",") if s]
+DEVICE_PROFILES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "device_profiles.json")
+
+
+def _read_text(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def _read_number(path):
+    return float(_read_text(path))
+
+###############################################################################
+# Linear model
+###############################################################################
+class LinearPowerModel:
+    """
+    Power estimated from CPU usage: base_power_w when idle, max_power_w at
+    100% CPU. Coefficients should come from a calibration of the device.
+    """
+    name = "linear"
+
+    def __init__(self, base_power_w=2.7, max_power_w=6.7):
+        self.base_power_w = base_power_w
+        self.max_power_w = max_power_w
+
+    @classmethod
+    def from_profile(cls, profile=DEVICE_PROFILE, path=DEVICE_PROFILES_FILE):
+        with open(path, "r", encoding="utf-8") as f:
+            profiles = json.load(f)
+        if profile not in profiles:
+            raise ValueError(f"Unknown device profile '{profile}' in {path}")
+        p = profiles[profile]
+        return cls(base_power_w=p["base_power_w"], max_power_w=p["max_power_w"])
+
+    def read_power_w(self, cpu_percent):
+        return self.base_power_w + (self.max_power_w - self.base_power_w)*(cpu_percent/100)
+
+    def read_energy_j(self):
+        return None
+
+    def close(self):
+        pass
+
+###############################################################################
+# Counter-based sources
+###############################################################################
+class _EnergyCounterSource:
+    """
+    Shared logic for sources exposing cumulative energy counters: handles
+    counter wraparound and turns counter deltas into power between ticks.
+    Subclasses fill self._counters with (path, wrap_j) pairs.
+    """
+    def __init__(self):
+        self._counters = []
+        self._lock = threading.Lock()
+        self._last_raw = []
+        self._accumulated_j = 0.0
+        self._last_power_j = None
+        self._last_power_ts = None
+
+    def _init_counters(self):
+        self._last_raw = [self._read_raw_j(path) for path, _ in self._counters]
+
+    def _read_raw_j(self, path):
+        raise NotImplementedError
+
+    def read_energy_j(self):
+        """
+        Monotonic energy in joules since the source was created.
+        """
+        with self._lock:
+            for k, (path, wrap_j) in enumerate(self._counters):
+                raw = self._read_raw_j(path)
+                delta = raw - self._last_raw[k]
+                if delta < 0:
+                    # Counter wrapped around; without a known range it was
+                    # reset (e.g. driver reload) and counts up from zero
+                    delta = delta + wrap_j if wrap_j else raw
+                self._accumulated_j += delta
+                self._last_raw[k] = raw
+            return self._accumulated_j
+
+    def read_power_w(self, cpu_percent=None):
+        energy_j = self.read_energy_j()
+        now = time.monotonic()
+        power_w = 0.0
+        if self._last_power_ts is not None and now > self._last_power_ts:
+            power_w = (energy_j - self._last_power_j) / (now - self._last_power_ts)
+        self._last_power_j = energy_j
+        self._last_power_ts = now
+        return power_w
+
+    def close(self):
+        pass
+
+
+class RaplPowerSource(_EnergyCounterSource):
+    """
+    Intel RAPL: one energy_uj counter per package zone (intel-rapl:N). Subzones
+    (intel-rapl:N:M, core/uncore/dram) are already included in the package.
+    """
+    name = "rapl"
+
+    def __init__(self, root="/sys/class/powercap"):
+        super().__init__()
+        for zone in sorted(glob.glob(os.path.join(root, "intel-rapl:*"))):
+            if os.path.basename(zone).count(":") != 1:
+                continue
+            energy_path = os.path.join(zone, "energy_uj")
+            range_path = os.path.join(zone, "max_energy_range_uj")
+            if not os.path.exists(energy_path):
+                continue
+            wrap_j = _read_number(range_path) / 1e6 if os.path.exists(range_path) else 0
+            self._counters.append((energy_path, wrap_j))
+        if not self._counters:
+            raise OSError(f"No RAPL package zones under {root}")
+        # Fails here (not mid-run) when energy_uj is root-only
+        self._init_counters()
+
+    def _read_raw_j(self, path):
+        return _read_number(path) / 1e6
+
+
+class HwmonPowerSource(_EnergyCounterSource):
+    """
+    hwmon sensors: power*_input (microwatts), or in*_input (millivolts) times
+    curr*_input (milliamps) for chips like INA219/INA226 that only report bus
+    voltage and current. Channels of all selected chips are summed.
+    Chips exposing energy*_input (microjoules) are read as counters instead.
+    """
+    name = "hwmon"
+
+    def __init__(self, root="/sys/class/hwmon", sensors=None):
+        super().__init__()
+        sensors = sensors if sensors is not None else HWMON_SENSORS
+        self._power_paths = []   # microwatts
+        self._vi_pairs = []      # (millivolt path, milliamp path)
+        for chip in sorted(glob.glob(os.path.join(root, "hwmon*"))):
+            name_path = os.path.join(chip, "name")
+            chip_name = _read_text(name_path) if os.path.exists(name_path) else ""
+            if sensors and chip_name not in sensors:
+                continue
+            energy = sorted(glob.glob(os.path.join(chip, "energy*_input")))
+            power = sorted(glob.glob(os.path.join(chip, "power*_input")))
+            if energy:
+                # hwmon energy counters are 64-bit and effectively never wrap
+                self._counters.extend((path, 0) for path in energy)
+            elif power:
+                self._power_paths.extend(power)
+            elif sensors or chip_name.startswith("ina"):
+                # Only pair voltage/current inputs on chips known to measure
+                # the supply rail; CPU/board monitors also expose in*/curr*
+                for curr in sorted(glob.glob(os.path.join(chip, "curr*_input"))):
+                    index = os.path.basename(curr)[len("curr"):-len("_input")]
+                    volt = os.path.join(chip, f"in{index}_input")
+                    if os.path.exists(volt):
+                        self._vi_pairs.append((volt, curr))
+        if not (self._counters or self._power_paths or self._vi_pairs):
+            raise OSError(f"No hwmon power sensors under {root}")
+        self._init_counters()
+        self.read_power_w()  # fail early on unreadable sensors
+
+    def _read_raw_j(self, path):
+        return _read_number(path) / 1e6
+
+    def read_energy_j(self):
+        if not self._counters:
+            return None
+        return super().read_energy_j()
+
+    def read_power_w(self, cpu_percent=None):
+        if self._counters:
+            return super().read_power_w(cpu_percent)
+        power_w = sum(_read_number(p) / 1e6 for p in self._power_paths)
+        power_w += sum(_read_number(v) * _read_number(c) / 1e6 for v, c in self._vi_pairs)
+        return power_w
+
+###############################################################################
+# Replay
+###############################################################################
+class ReplayPowerSource:
+    """
+    Replays a recorded power trace (CSV with timestamp_s,power_w columns),
+    linearly interpolated on the time elapsed since the source was created and
+    looped when it runs out. Meant for tests and for reproducing a device's
+    power profile on another machine.
+    """
+    name = "replay"
+
+    def __init__(self, path):
+        self.path = path
+        self._ts = []
+        self._power = []
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                self._ts.append(float(row["timestamp_s"]))
+                self._power.append(float(row["power_w"]))
+        if not self._ts:
+            raise ValueError(f"Empty power trace: {path}")
+        self._t0 = self._ts[0]
+        self._span = self._ts[-1] - self._t0
+        self._started = time.monotonic()
+
+    def read_power_w(self, cpu_percent=None):
+        elapsed = time.monotonic() - self._started
+        if self._span > 0:
+            elapsed %= self._span
+        t = self._t0 + elapsed
+        i = bisect.bisect_right(self._ts, t)
+        if i == 0:
+            return self._power[0]
+        if i >= len(self._ts):
+            return self._power[-1]
+        t_a, t_b = self._ts[i - 1], self._ts[i]
+        p_a, p_b = self._power[i - 1], self._power[i]
+        return p_a + (p_b - p_a) * (t - t_a) / (t_b - t_a)
+
+    def read_energy_j(self):
+        return None
+
+    def close(self):
+        pass
+
+###############################################################################
+# Factory
+###############################################################################
+def make_power_source(spec=POWER_SOURCE):
+    if spec.startswith("replay:"):
+        return ReplayPowerSource(spec[len("replay:"):])
+    if spec == "rapl":
+        return RaplPowerSource()
+    if spec == "hwmon":
+        return HwmonPowerSource()
+    if spec == "linear":
+        return LinearPowerModel.from_profile()
+    if spec != "auto":
+        raise ValueError(f"Unknown POWER_SOURCE '{spec}'")
+
+    for factory in (RaplPowerSource, HwmonPowerSource):
+        try:
+            source = factory()
+            logger.info(f"Power source: {source.name}")
+            return source
+        except (OSError, ValueError) as e:
+            logger.debug(f"Power source {factory.name} unavailable: {e}")
+    logger.info(f"Power source: linear model (profile '{DEVICE_PROFILE}')")
+    return LinearPowerModel.from_profile()
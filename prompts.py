@@ -0,0 +1,41 @@
+# Default prompt set shared by test.py, load_test.py and sweep.py
+#
+# Kept out of test.py so the other scripts do not import "test", which is also
+# the name of the standard library's regression test package.
+
+def generate_prompts():
+    """
+    Generate a list of diverse NLP tasks for testing.
+    """
+    prompts = [
+        # General Knowledge
+        "What is the capital of France?",
+
+        # Summarization
+        "Summarize the following text: The industrial revolution was a period of major industrialization...",
+
+        # Creative Writing
+        "Write a short poem about the beauty of nature.",
+
+        # Sentiment Analysis
+        "Classify the sentiment: 'I absolutely loved the new restaurant!'",
+
+        # Text Completion
+        "Complete this sentence: The quick brown fox jumps over...",
+
+        # Translation
+        "Translate to French: 'Good morning, how are you?'",
+
+        # Coding Assistance
+        "Write a Python function to calculate the factorial of a number.",
+
+        # Edge Device Suitability
+        "Explain the benefits of Raspberry Pi in IoT applications.",
+
+        # Mathematical Queries
+        "What is the square root of 256?",
+
+        # Conversational
+        "Pretend to be a travel assistant. Suggest some attractions in Paris for a family vacation.",
+    ]
+    return prompts
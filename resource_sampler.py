@@ -0,0 +1,864 @@
+# Process-wide resource sampler
+#
+# One background thread samples CPU, memory and estimated power into a
+# fixed-size ring buffer of timestamped samples. Requests no longer start their
+# own sampling thread: a ResourceMonitor only remembers when the request started
+# and stopped and slices that window out of the shared buffer afterwards.
+#
+# Besides saving a thread per request, this makes concurrent measurements
+# correct: CPU usage is a delta since the previous reading, so several
+# per-request samplers corrupted each other's CPU readings.
+#
+# On Linux the sampler reads /proc/stat, /proc/meminfo and /proc/self/stat
+# with os.pread() on file descriptors opened once, which keeps a tick cheap
+# enough to run every 10-100 ms on a CPU-starved edge device. Other platforms
+# fall back to psutil.
+#
+# Tuning (environment variables):
+#   SAMPLER_INTERVAL_S       fixed sampling interval                (default 0.05)
+#   SAMPLER_ADAPTIVE         1 = derive the interval from recent request
+#                            lengths, aiming for SAMPLER_TARGET_SAMPLES
+#                            samples per request                    (default 0)
+#   SAMPLER_TARGET_SAMPLES   samples per request in adaptive mode   (default 50)
+#   SAMPLER_MIN_INTERVAL_S   adaptive lower bound                   (default 0.01)
+#   SAMPLER_MAX_INTERVAL_S   adaptive upper bound                   (default 0.1)
+#   SAMPLER_IDLE_INTERVAL_S  interval while no request is running   (default 1.0)
+#   SAMPLER_CAPACITY         samples kept in the ring buffer        (default 65536)
+
+import logging
+import os
+import threading
+import time
+from array import array
+from math import isnan, nan, sqrt
+
+import psutil
+
+from power_sources import make_power_source
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# SAMPLER SETTINGS
+###############################################################################
+SAMPLER_INTERVAL_S = float(os.environ.get("SAMPLER_INTERVAL_S", 0.05))
+SAMPLER_ADAPTIVE = os.environ.get("SAMPLER_ADAPTIVE", "0") == "1"
+SAMPLER_TARGET_SAMPLES = int(os.environ.get("SAMPLER_TARGET_SAMPLES", 50))
+SAMPLER_MIN_INTERVAL_S = float(os.environ.get("SAMPLER_MIN_INTERVAL_S", 0.01))
+SAMPLER_MAX_INTERVAL_S = float(os.environ.get("SAMPLER_MAX_INTERVAL_S", 0.1))
+SAMPLER_IDLE_INTERVAL_S = float(os.environ.get("SAMPLER_IDLE_INTERVAL_S", 1.0))
+SAMPLER_CAPACITY = int(os.environ.get("SAMPLER_CAPACITY", 65536))
+
+# Per-sample values kept in the ring buffer (besides the timestamp)
+SAMPLE_COLUMNS = (
+    "cpu", "mem", "power", "process_cpu", "ollama_cpu", "ollama_rss",
+    "ollama_cpu_time_s", "ollama_io_read_bytes", "ollama_io_write_bytes",
+)
+# Cumulative columns: a request's share is their difference across its window
+COUNTER_COLUMNS = ("ollama_cpu_time_s", "ollama_io_read_bytes", "ollama_io_write_bytes")
+
+###############################################################################
+# Readers
+###############################################################################
+class ProcReader:
+    """
+    Reads system CPU, memory and this process's CPU time straight from /proc.
+    The files are opened once and re-read with os.pread(), so a sample costs
+    three syscalls and some bytes.split() work, with no per-tick object
+    creation inside psutil.
+    """
+    def __init__(self, proc_root="/proc", pid="self"):
+        self._stat_fd = os.open(os.path.join(proc_root, "stat"), os.O_RDONLY)
+        self._meminfo_fd = os.open(os.path.join(proc_root, "meminfo"), os.O_RDONLY)
+        self._pid_stat_fd = os.open(os.path.join(proc_root, str(pid), "stat"), os.O_RDONLY)
+        self._clk_tck = os.sysconf("SC_CLK_TCK")
+        self.reset()
+
+    def close(self):
+        for fd in (self._stat_fd, self._meminfo_fd, self._pid_stat_fd):
+            os.close(fd)
+
+    def _read_cpu_ticks(self):
+        data = os.pread(self._stat_fd, 512, 0)
+        # "cpu  user nice system idle iowait irq softirq steal guest guest_nice"
+        fields = data[:data.index(b"\n")].split()[1:9]
+        ticks = [int(x) for x in fields]
+        idle = ticks[3] + ticks[4]
+        total = sum(ticks)
+        return total - idle, total
+
+    def _read_used_mb(self):
+        data = os.pread(self._meminfo_fd, 4096, 0)
+        total_kb = available_kb = 0
+        for line in data.split(b"\n"):
+            if line.startswith(b"MemTotal:"):
+                total_kb = int(line.split()[1])
+            elif line.startswith(b"MemAvailable:"):
+                available_kb = int(line.split()[1])
+                break
+        return (total_kb - available_kb) / 1024
+
+    def _read_process_ticks(self):
+        data = os.pread(self._pid_stat_fd, 1024, 0)
+        # The command name may contain spaces, so split after its closing ")";
+        # utime and stime are fields 14 and 15 of the whole line.
+        fields = data[data.rindex(b")") + 2:].split()
+        return int(fields[11]) + int(fields[12])
+
+    def reset(self):
+        """
+        Re-baselines the CPU deltas, e.g. after the sampler has been idle so
+        the next sample does not average over the idle period.
+        """
+        self._prev_busy, self._prev_total = self._read_cpu_ticks()
+        self._prev_process = self._read_process_ticks()
+        self._prev_wall = time.monotonic()
+
+    def sample(self):
+        """
+        Returns (cpu_percent, used_mb, process_cpu_percent) since the last call.
+        process_cpu_percent is per-core, like psutil.Process.cpu_percent.
+        """
+        busy, total = self._read_cpu_ticks()
+        process = self._read_process_ticks()
+        wall = time.monotonic()
+
+        d_total = total - self._prev_total
+        cpu_percent = 100.0 * (busy - self._prev_busy) / d_total if d_total > 0 else 0.0
+        d_wall = wall - self._prev_wall
+        process_cpu_percent = (
+            100.0 * (process - self._prev_process) / self._clk_tck / d_wall
+            if d_wall > 0 else 0.0
+        )
+
+        self._prev_busy, self._prev_total = busy, total
+        self._prev_process = process
+        self._prev_wall = wall
+        return cpu_percent, self._read_used_mb(), process_cpu_percent
+
+
+class PsutilReader:
+    """
+    Portable fallback with the same interface as ProcReader.
+    """
+    def __init__(self):
+        self._process = psutil.Process()
+        self.reset()
+
+    def close(self):
+        pass
+
+    def reset(self):
+        psutil.cpu_percent(interval=None)
+        self._process.cpu_percent(interval=None)
+
+    def sample(self):
+        cpu_percent = psutil.cpu_percent(interval=None)
+        mem_info = psutil.virtual_memory()
+        used_mb = (mem_info.total - mem_info.available) / (1024**2)
+        return cpu_percent, used_mb, self._process.cpu_percent(interval=None)
+
+
+def make_reader():
+    try:
+        return ProcReader()
+    except (OSError, ValueError) as e:
+        logger.info(f"/proc not usable ({e}); sampling through psutil")
+        return PsutilReader()
+
+###############################################################################
+# Ollama process tracking
+###############################################################################
+OLLAMA_PROCESS_TRACKING = os.environ.get("OLLAMA_PROCESS_TRACKING", "1") == "1"
+OLLAMA_PROCESS_PREFIX = os.environ.get("OLLAMA_PROCESS_PREFIX", "ollama")
+OLLAMA_TRACK_REFRESH_S = float(os.environ.get("OLLAMA_TRACK_REFRESH_S", 2.0))
+# PSS walks every mapping of every Ollama process; off unless asked for
+OLLAMA_TRACK_PSS = os.environ.get("OLLAMA_TRACK_PSS", "0") == "1"
+
+
+class OllamaProcessTracker:
+    """
+    Follows the Ollama server and its model-runner children so resource use can
+    be attributed to inference instead of the whole machine.
+
+    The process tree is re-discovered every `refresh_interval` seconds (and as
+    soon as a tracked pid disappears), which picks up runners Ollama spawns on
+    model load and drops the ones it unloads. Per tick only /proc/<pid>/stat,
+    /proc/<pid>/statm and /proc/<pid>/io are read, through descriptors kept
+    open per pid, and summed into cumulative CPU time and I/O totals for the
+    whole tree. Requests diff those totals between ring-buffer samples, so the
+    request path never touches psutil. PSS (with `track_pss`) is read at
+    discovery time only.
+    """
+    def __init__(self, proc_root="/proc", name_prefix=OLLAMA_PROCESS_PREFIX,
+                 refresh_interval=OLLAMA_TRACK_REFRESH_S, track_pss=OLLAMA_TRACK_PSS):
+        self.proc_root = proc_root
+        self.name_prefix = name_prefix
+        self.refresh_interval = refresh_interval
+        self.track_pss = track_pss
+
+        self._lock = threading.Lock()
+        self._procs = {}      # pid -> psutil.Process
+        self._names = {}      # pid -> process name
+        self._fds = {}        # pid -> [stat_fd, statm_fd, io_fd or None], None when /proc is unusable
+        self._prev_ticks = {}
+        self._prev_wall = time.monotonic()
+        self._last_refresh = 0.0
+        self._stale = True
+        self._clk_tck = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._page_mb = (os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096) / (1024**2)
+
+        # Cumulative totals: per pid (ticks, io read, io write) at first sight
+        # and at the last tick, plus what exited processes had added
+        self._tracking_since = time.time()
+        self._created = {}
+        self._base = {}
+        self._last = {}
+        self._retired = [0, 0, 0]
+        self._io_readable = False
+        self._pss_mb = None
+
+    def close(self):
+        with self._lock:
+            for pid in list(self._procs):
+                self._forget(pid)
+
+    # ----------- Discovery -----------
+    def _matches(self, proc):
+        name = proc.info.get("name") or ""
+        return name.startswith(self.name_prefix)
+
+    def _discover(self):
+        candidates = [p for p in psutil.process_iter(["name", "cmdline"]) if self._matches(p)]
+        servers = [p for p in candidates if "serve" in (p.info.get("cmdline") or [])]
+        found = {}
+        for root in servers or candidates:
+            found[root.pid] = root
+            try:
+                for child in root.children(recursive=True):
+                    found[child.pid] = child
+            except psutil.Error:
+                continue
+        return found
+
+    def _open_fds(self, pid):
+        base = os.path.join(self.proc_root, str(pid))
+        try:
+            fds = [os.open(os.path.join(base, "stat"), os.O_RDONLY),
+                   os.open(os.path.join(base, "statm"), os.O_RDONLY)]
+        except OSError:
+            return None
+        try:
+            fds.append(os.open(os.path.join(base, "io"), os.O_RDONLY))
+        except OSError:
+            # Not ours to read (Ollama running as another user)
+            fds.append(None)
+        return fds
+
+    def _forget(self, pid):
+        fds = self._fds.pop(pid, None)
+        if fds:
+            for fd in fds:
+                if fd is not None:
+                    os.close(fd)
+        last, base = self._last.pop(pid, None), self._base.pop(pid, None)
+        if last is not None:
+            for k in range(3):
+                if last[k] is not None and base[k] is not None:
+                    self._retired[k] += last[k] - base[k]
+        self._procs.pop(pid, None)
+        self._names.pop(pid, None)
+        self._created.pop(pid, None)
+        self._prev_ticks.pop(pid, None)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and not self._stale and now - self._last_refresh < self.refresh_interval:
+                return
+            found = self._discover()
+            for pid in list(self._procs):
+                if pid not in found:
+                    self._forget(pid)
+            for pid, proc in found.items():
+                if pid not in self._procs:
+                    try:
+                        # Children come from children(), without process_iter's .info
+                        self._names[pid] = proc.name()
+                        self._created[pid] = proc.create_time()
+                    except psutil.Error:
+                        self._names.pop(pid, None)
+                        continue
+                    self._procs[pid] = proc
+                    self._fds[pid] = self._open_fds(pid)
+            if self.track_pss:
+                self._pss_mb = self._read_pss_mb()
+            self._last_refresh = now
+            self._stale = False
+
+    def _read_pss_mb(self):
+        """
+        PSS summed over the tree, or None when no process allows reading it.
+        Must hold self._lock.
+        """
+        total = None
+        for proc in self._procs.values():
+            try:
+                pss = proc.memory_full_info().pss / (1024**2)
+            except (psutil.Error, AttributeError):
+                continue
+            total = pss if total is None else total + pss
+        return total
+
+    def pids(self):
+        with self._lock:
+            return sorted(self._procs)
+
+    def processes(self):
+        """
+        {pid: name} of the tracked processes.
+        """
+        with self._lock:
+            return dict(self._names)
+
+    def pss_mb(self):
+        return self._pss_mb
+
+    # ----------- Per-tick sampling -----------
+    def _read_io(self, fds):
+        try:
+            data = os.pread(fds[2], 512, 0)
+        except OSError:
+            os.close(fds[2])
+            fds[2] = None
+            return None, None
+        read = write = None
+        for line in data.split(b"\n"):
+            if line.startswith(b"read_bytes:"):
+                read = int(line.split()[1])
+            elif line.startswith(b"write_bytes:"):
+                write = int(line.split()[1])
+        return read, write
+
+    def _read_pid(self, pid):
+        """
+        (cpu ticks, rss_mb, io read bytes, io write bytes) of one process;
+        the I/O counters are None when they cannot be read.
+        """
+        fds = self._fds.get(pid)
+        if fds is None:
+            proc = self._procs[pid]
+            times = proc.cpu_times()
+            try:
+                io = proc.io_counters()
+                read, write = io.read_bytes, io.write_bytes
+            except (psutil.Error, AttributeError):
+                read = write = None
+            return (times.user + times.system) * self._clk_tck, proc.memory_info().rss / (1024**2), read, write
+        stat = os.pread(fds[0], 1024, 0)
+        fields = stat[stat.rindex(b")") + 2:].split()
+        statm = os.pread(fds[1], 256, 0).split()
+        read, write = self._read_io(fds) if fds[2] is not None else (None, None)
+        return int(fields[11]) + int(fields[12]), int(statm[1]) * self._page_mb, read, write
+
+    def _count(self, pid, ticks, read, write):
+        """
+        Folds one reading into the cumulative totals. A process seen for the
+        first time counts from zero if it started while we were tracking (a
+        runner spawned on model load), else from this reading. Must hold
+        self._lock.
+        """
+        current = (ticks, read, write)
+        base = self._base.get(pid)
+        if base is None:
+            spawned = self._created.get(pid, 0) >= self._tracking_since
+            base = self._base[pid] = tuple(
+                None if value is None else (0 if spawned else value) for value in current
+            )
+        last = self._last.get(pid)
+        if last is not None:
+            # An I/O counter that stopped being readable keeps what it added
+            for k in (1, 2):
+                if last[k] is not None and current[k] is None and base[k] is not None:
+                    self._retired[k] += last[k] - base[k]
+                    base = self._base[pid] = base[:k] + (None,) + base[k + 1:]
+        self._last[pid] = current
+        if read is not None or write is not None:
+            self._io_readable = True
+
+    def _totals(self):
+        """
+        (cpu_time_s, io_read_bytes, io_write_bytes) since tracking began; the
+        I/O totals are NaN while no process's I/O is readable. Must hold
+        self._lock.
+        """
+        totals = list(self._retired)
+        for pid, last in self._last.items():
+            base = self._base[pid]
+            for k in range(3):
+                if last[k] is not None and base[k] is not None:
+                    totals[k] += last[k] - base[k]
+        io_read, io_write = (totals[1], totals[2]) if self._io_readable else (nan, nan)
+        return totals[0] / self._clk_tck, io_read, io_write
+
+    def reset(self):
+        with self._lock:
+            self._prev_ticks = {}
+            self._prev_wall = time.monotonic()
+
+    def sample(self):
+        """
+        Returns (cpu_percent, rss_mb, cpu_time_s, io_read_bytes, io_write_bytes)
+        for the tracked process tree. cpu_percent is per-core (400 = four cores
+        busy); the last three are cumulative totals (see _totals).
+        """
+        self.refresh()
+        wall = time.monotonic()
+        cpu_ticks = 0
+        rss_mb = 0.0
+        with self._lock:
+            d_wall = wall - self._prev_wall
+            for pid in list(self._procs):
+                try:
+                    ticks, rss, read, write = self._read_pid(pid)
+                except (OSError, ValueError, IndexError, psutil.Error):
+                    self._forget(pid)
+                    self._stale = True
+                    continue
+                prev = self._prev_ticks.get(pid)
+                if prev is not None:
+                    cpu_ticks += ticks - prev
+                self._prev_ticks[pid] = ticks
+                self._count(pid, ticks, read, write)
+                rss_mb += rss
+            self._prev_wall = wall
+            totals = self._totals()
+        cpu_percent = 100.0 * cpu_ticks / self._clk_tck / d_wall if d_wall > 0 else 0.0
+        return (cpu_percent, rss_mb) + totals
+
+
+def make_process_tracker():
+    if not OLLAMA_PROCESS_TRACKING:
+        return None
+    return OllamaProcessTracker()
+
+###############################################################################
+# ResourceSampler
+###############################################################################
+class ResourceSampler:
+    """
+    Samples system-wide CPU usage, memory usage, approximate power and this
+    process's CPU usage into a ring buffer holding the last `capacity` samples.
+
+    The interval is fixed unless `adaptive` is set, in which case it follows
+    the recent request length (EWMA) so a request gets about `target_samples`
+    samples, within [min_interval, max_interval]. With no request in flight
+    the sampler slows down to `idle_interval`.
+    """
+    def __init__(self, interval=SAMPLER_INTERVAL_S, capacity=SAMPLER_CAPACITY,
+                 adaptive=SAMPLER_ADAPTIVE, target_samples=SAMPLER_TARGET_SAMPLES,
+                 min_interval=SAMPLER_MIN_INTERVAL_S, max_interval=SAMPLER_MAX_INTERVAL_S,
+                 idle_interval=SAMPLER_IDLE_INTERVAL_S, reader_factory=make_reader,
+                 tracker_factory=make_process_tracker,
+                 power_source_factory=make_power_source):
+        self.interval = interval
+        self.capacity = capacity
+        self.adaptive = adaptive
+        self.target_samples = target_samples
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_interval = idle_interval
+        self.reader_factory = reader_factory
+        self.tracker_factory = tracker_factory
+        self.power_source_factory = power_source_factory
+
+        self._ts = array('d', [0.0]) * capacity
+        self._columns = {name: array('d', [0.0]) * capacity for name in SAMPLE_COLUMNS}
+        self._count = 0  # samples written since start (head = _count % capacity)
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+        self._reader = None
+        self._tracker = None
+        self._power_source = None
+
+        self._active_windows = 0
+        self._ewma_window_s = None
+
+        # Self-measurement: CPU time the sampler thread spent taking samples
+        self._started_at = None
+        self._sample_cpu_s = 0.0
+        self._samples_taken = 0
+
+    def ensure_started(self):
+        """
+        Starts the sampling thread on first use; later calls are a cheap check.
+        """
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop_event.clear()
+            self._reader = self.reader_factory()
+            self._tracker = self.tracker_factory()
+            self._power_source = self.power_source_factory()
+            self._started_at = time.monotonic()
+            self._thread = threading.Thread(
+                target=self._run, name="resource-sampler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+        if self._tracker:
+            self._tracker.close()
+            self._tracker = None
+        if self._power_source:
+            self._power_source.close()
+            self._power_source = None
+
+    # ----------- Request window bookkeeping -----------
+    def window_opened(self):
+        with self._lock:
+            self._active_windows += 1
+            was_idle = self._active_windows == 1
+        if was_idle:
+            # Leave the idle interval right away instead of after up to
+            # idle_interval seconds
+            self._wake_event.set()
+
+    def window_closed(self, duration_s):
+        with self._lock:
+            self._active_windows -= 1
+            if self._ewma_window_s is None:
+                self._ewma_window_s = duration_s
+            else:
+                self._ewma_window_s = 0.8 * self._ewma_window_s + 0.2 * duration_s
+
+    def current_interval(self):
+        if self._active_windows == 0:
+            return self.idle_interval
+        if self.adaptive and self._ewma_window_s:
+            return min(self.max_interval,
+                       max(self.min_interval, self._ewma_window_s / self.target_samples))
+        return self.interval
+
+    # ----------- Sampling loop -----------
+    def _run(self):
+        idle = self._active_windows == 0
+        while not self._stop_event.is_set():
+            woken = self._wake_event.wait(self.current_interval())
+            if self._stop_event.is_set():
+                break
+            if woken:
+                # A request just started: drop the CPU delta accumulated over
+                # the idle period instead of recording it
+                self._wake_event.clear()
+                if idle:
+                    self._reader.reset()
+                    if self._tracker:
+                        self._tracker.reset()
+                    idle = False
+                continue
+            try:
+                cpu_before = time.thread_time()
+                cpu_percent, used_mb, process_cpu_percent = self._reader.sample()
+                power_w = self._power_source.read_power_w(cpu_percent)
+                ollama = self._tracker.sample() if self._tracker else (0.0, 0.0, 0.0, nan, nan)
+                self._record(time.monotonic(), (cpu_percent, used_mb, power_w, process_cpu_percent) + ollama)
+                self._sample_cpu_s += time.thread_time() - cpu_before
+                self._samples_taken += 1
+            except Exception as e:
+                logger.error(f"Resource monitoring error: {e}")
+            idle = self._active_windows == 0
+
+    def _record(self, ts, values):
+        """
+        values: one reading per SAMPLE_COLUMNS entry, in that order.
+        """
+        with self._lock:
+            i = self._count % self.capacity
+            self._ts[i] = ts
+            for name, value in zip(SAMPLE_COLUMNS, values):
+                self._columns[name][i] = value
+            self._count += 1
+
+    def window(self, start_ts, end_ts):
+        """
+        Returns {column: list} for the samples taken in [start_ts, end_ts],
+        oldest first, plus their timestamps under "ts". When no sample fell
+        inside the window (requests shorter than the interval) the most recent
+        sample taken before end_ts is used, so callers always get a reading
+        once the sampler has produced one.
+        """
+        indices = []
+        with self._lock:
+            n = min(self._count, self.capacity)
+            # Walk backwards from the newest sample until we leave the window
+            for k in range(n):
+                i = (self._count - 1 - k) % self.capacity
+                ts = self._ts[i]
+                if ts > end_ts:
+                    continue
+                if ts < start_ts:
+                    if not indices:
+                        indices.append(i)
+                    break
+                indices.append(i)
+            indices.reverse()
+            result = {name: [column[i] for i in indices] for name, column in self._columns.items()}
+            result["ts"] = [self._ts[i] for i in indices]
+        return result
+
+    def read_energy_j(self):
+        """
+        Cumulative hardware energy counter in joules, or None when the power
+        source has no counter (energy is then integrated from power samples).
+        """
+        if not self._power_source:
+            return None
+        try:
+            return self._power_source.read_energy_j()
+        except (OSError, ValueError) as e:
+            logger.error(f"Energy counter read error: {e}")
+            return None
+
+    def power_source_name(self):
+        return self._power_source.name if self._power_source else None
+
+    def _counters_at(self, ts):
+        """
+        COUNTER_COLUMNS values at ts, interpolated between the samples around
+        it; the nearest sample when ts is outside the buffered range, None
+        before the first sample. Must hold self._lock.
+        """
+        n = min(self._count, self.capacity)
+        newer = None
+        for k in range(n):
+            i = (self._count - 1 - k) % self.capacity
+            if self._ts[i] <= ts:
+                if newer is None or self._ts[newer] == self._ts[i]:
+                    return [self._columns[name][i] for name in COUNTER_COLUMNS]
+                f = (ts - self._ts[i]) / (self._ts[newer] - self._ts[i])
+                return [
+                    self._columns[name][i] + f * (self._columns[name][newer] - self._columns[name][i])
+                    for name in COUNTER_COLUMNS
+                ]
+            newer = i
+        if newer is None:
+            return None
+        return [self._columns[name][newer] for name in COUNTER_COLUMNS]
+
+    def process_usage(self, start_ts, end_ts):
+        """
+        What the tracked Ollama processes used in [start_ts, end_ts], from the
+        cumulative ring-buffer columns, so it is exact to within a sampling
+        interval at each end: {"processes": {pid: name}, "pss_mb": ...,
+        column: delta or None}. None when process tracking is disabled.
+        """
+        if not self._tracker:
+            return None
+        with self._lock:
+            start, end = self._counters_at(start_ts), self._counters_at(end_ts)
+        usage = {"processes": self._tracker.processes(), "pss_mb": self._tracker.pss_mb()}
+        for k, name in enumerate(COUNTER_COLUMNS):
+            delta = end[k] - start[k] if start is not None and end is not None else None
+            usage[name] = None if delta is None or isnan(delta) else max(0.0, delta)
+        return usage
+
+    def stats(self):
+        """
+        Sampler self-measurement: how often it samples and what it costs.
+        """
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        return {
+            "reader": type(self._reader).__name__ if self._reader else None,
+            "power_source": self.power_source_name(),
+            "current_interval_s": self.current_interval(),
+            "adaptive": self.adaptive,
+            "active_windows": self._active_windows,
+            "samples_taken": self._samples_taken,
+            "avg_sample_cost_us": (
+                self._sample_cpu_s / self._samples_taken * 1e6 if self._samples_taken else 0
+            ),
+            "sampler_cpu_percent": 100.0 * self._sample_cpu_s / elapsed if elapsed > 0 else 0,
+            "ollama_pids": self._tracker.pids() if self._tracker else [],
+        }
+
+
+# Process-wide sampler shared by every request
+SAMPLER = ResourceSampler()
+
+###############################################################################
+# ResourceMonitor
+###############################################################################
+class ResourceMonitor:
+    """
+    Per-request view over the shared sampler: start()/stop() record the request
+    window, and the accessors summarize the samples taken inside it.
+    Gathers arrays so we can compute standard deviations, peaks, etc.
+    """
+    def __init__(self, sampler=None):
+        self.sampler = sampler or SAMPLER
+        self.start_ts = None
+        self.end_ts = None
+
+        self.sample_timestamps = []
+        self.cpu_usage_readings = []
+        self.mem_usage_readings = []
+        self.power_readings = []
+        self.process_cpu_readings = []
+        self.ollama_cpu_readings = []
+        self.ollama_rss_readings = []
+
+        self.start_wall = None
+        self.process_usage = None
+
+        self.energy_counter_start = None
+        self.energy_j = 0
+        self.energy_method = None
+
+    def start(self):
+        self.sampler.ensure_started()
+        self.sampler.window_opened()
+        self.start_wall = time.time()
+        self.energy_counter_start = self.sampler.read_energy_j()
+        self.start_ts = time.monotonic()
+
+    def stop(self):
+        self.end_ts = time.monotonic()
+        energy_counter_end = self.sampler.read_energy_j()
+        self.sampler.window_closed(self.end_ts - self.start_ts)
+        window = self.sampler.window(self.start_ts, self.end_ts)
+        self.process_usage = self.sampler.process_usage(self.start_ts, self.end_ts)
+        self.sample_timestamps = window["ts"]
+        self.cpu_usage_readings = window["cpu"]
+        self.mem_usage_readings = window["mem"]
+        self.power_readings = window["power"]
+        self.process_cpu_readings = window["process_cpu"]
+        self.ollama_cpu_readings = window["ollama_cpu"]
+        self.ollama_rss_readings = window["ollama_rss"]
+
+        if self.energy_counter_start is not None and energy_counter_end is not None:
+            self.energy_j = energy_counter_end - self.energy_counter_start
+            self.energy_method = "counter"
+        else:
+            self.energy_j = self._integrate_energy()
+            self.energy_method = "trapezoid"
+
+    def _integrate_energy(self):
+        """
+        Trapezoidal integral of the power samples over [start_ts, end_ts].
+        The stretches before the first and after the last sample are held at
+        that sample's power, so a window with a single sample gives
+        power * duration.
+        """
+        ts = self.sample_timestamps
+        power = self.power_readings
+        if not ts:
+            return 0
+        energy_j = 0.0
+        for k in range(1, len(ts)):
+            energy_j += (ts[k] - ts[k - 1]) * (power[k] + power[k - 1]) / 2
+        energy_j += max(0.0, ts[0] - self.start_ts) * power[0]
+        energy_j += max(0.0, self.end_ts - ts[-1]) * power[-1]
+        return energy_j
+
+    # ----------- Accessors -----------
+    def get_cpu_usage_array(self):
+        return self.cpu_usage_readings
+
+    def get_avg_cpu(self):
+        if not self.cpu_usage_readings:
+            return 0
+        return sum(self.cpu_usage_readings) / len(self.cpu_usage_readings)
+
+    def get_peak_cpu(self):
+        return max(self.cpu_usage_readings) if self.cpu_usage_readings else 0
+
+    def get_avg_mem_mb(self):
+        if not self.mem_usage_readings:
+            return 0
+        return sum(self.mem_usage_readings) / len(self.mem_usage_readings)
+
+    def get_peak_mem_mb(self):
+        return max(self.mem_usage_readings) if self.mem_usage_readings else 0
+
+    def get_avg_power(self):
+        if not self.power_readings:
+            return 0
+        return sum(self.power_readings) / len(self.power_readings)
+
+    def get_peak_power(self):
+        return max(self.power_readings) if self.power_readings else 0
+
+    def get_min_power(self):
+        return min(self.power_readings) if self.power_readings else 0
+
+    def get_std_dev_cpu(self):
+        if len(self.cpu_usage_readings) < 2:
+            return 0
+        avg_c = self.get_avg_cpu()
+        var_c = sum((c - avg_c)**2 for c in self.cpu_usage_readings)/(len(self.cpu_usage_readings)-1)
+        return sqrt(var_c)
+
+    def get_std_dev_memory(self):
+        if len(self.mem_usage_readings) < 2:
+            return 0
+        avg_m = self.get_avg_mem_mb()
+        var_m = sum((m - avg_m)**2 for m in self.mem_usage_readings)/(len(self.mem_usage_readings)-1)
+        return sqrt(var_m)
+
+    def get_std_dev_power(self):
+        if len(self.power_readings) < 2:
+            return 0
+        avg_p = self.get_avg_power()
+        var_p = sum((p - avg_p)**2 for p in self.power_readings)/(len(self.power_readings)-1)
+        return sqrt(var_p)
+
+    def get_energy_j(self):
+        return self.energy_j
+
+    def get_sample_count(self):
+        return len(self.cpu_usage_readings)
+
+    def get_avg_process_cpu(self):
+        if not self.process_cpu_readings:
+            return 0
+        return sum(self.process_cpu_readings) / len(self.process_cpu_readings)
+
+    def get_process_usage(self):
+        """
+        Resource use attributed to the Ollama server and runner processes
+        during the window. Empty when process tracking is disabled.
+        """
+        usage = self.process_usage
+        if usage is None:
+            return {}
+        processes = usage["processes"]
+        cpu = self.ollama_cpu_readings
+        rss = self.ollama_rss_readings
+        io_read, io_write = usage["ollama_io_read_bytes"], usage["ollama_io_write_bytes"]
+        return {
+            "ollama_pids": sorted(processes),
+            "ollama_process_names": sorted(set(processes.values())),
+            "ollama_cpu_time_s": usage["ollama_cpu_time_s"] or 0,
+            "ollama_avg_cpu_percent": (sum(cpu) / len(cpu)) if cpu else 0,
+            "ollama_peak_cpu_percent": max(cpu) if cpu else 0,
+            "ollama_avg_rss_mb": (sum(rss) / len(rss)) if rss else 0,
+            "ollama_peak_rss_mb": max(rss) if rss else 0,
+            "ollama_pss_mb": usage["pss_mb"],
+            "ollama_io_read_bytes": round(io_read) if io_read is not None else None,
+            "ollama_io_write_bytes": round(io_write) if io_write is not None else None,
+            "server_avg_cpu_percent": self.get_avg_process_cpu(),
+        }
@@ -0,0 +1,355 @@
+# Admission control and per-model queueing in front of Ollama
+#
+# Ollama runs a fixed number of requests per model at once and silently queues
+# the rest, which makes queueing time look like inference time. The scheduler
+# holds requests here instead: at most the configured concurrency per model is
+# forwarded, the rest wait in a bounded priority queue, and requests that
+# cannot finish waiting before their deadline are shed. A request's metrics
+# window only starts once it leaves the queue, so queue_wait_s and
+# service_time_s are reported separately.
+#
+# Expected waits (for shedding and Retry-After) add up the remaining service
+# time of the running requests and the service time of the requests queued
+# ahead. A request's service time is its cost model estimate when the caller
+# passes one (see cost_model.py), else the model's moving average.
+#
+# Settings (environment variables):
+#   SCHEDULER_CONCURRENCY        requests forwarded per model at once; match
+#                                OLLAMA_NUM_PARALLEL (default: OLLAMA_NUM_PARALLEL
+#                                or 1; 0 forwards everything, no queueing)
+#   SCHEDULER_MODEL_CONCURRENCY  per-model overrides, e.g. "qwen2.5:0.5b=2,llama3.2:1b=1"
+#   SCHEDULER_MAX_QUEUE          waiting requests per model before 429    (default 64)
+#   SCHEDULER_DEFAULT_DEADLINE_S deadline for requests that set none, in
+#                                seconds from arrival (default 0: none)
+#
+# Responses when a request is not admitted:
+#   429  the model's queue is full (not for acquire(..., wait=True), used by
+#        callers that bound their own concurrency, such as batches)
+#   503  the deadline passed while queued, or the expected wait already exceeds it
+# Both carry a Retry-After estimate.
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+
+###############################################################################
+# SETTINGS
+###############################################################################
+SCHEDULER_CONCURRENCY = int(os.environ.get(
+    "SCHEDULER_CONCURRENCY", os.environ.get("OLLAMA_NUM_PARALLEL", 1)
+))
+SCHEDULER_MODEL_CONCURRENCY = {
+    name: int(value)
+    for name, _, value in (
+        item.rpartition("=")
+        for item in os.environ.get("SCHEDULER_MODEL_CONCURRENCY", "").split(",") if item
+    )
+}
+SCHEDULER_MAX_QUEUE = int(os.environ.get("SCHEDULER_MAX_QUEUE", 64))
+SCHEDULER_DEFAULT_DEADLINE_S = float(os.environ.get("SCHEDULER_DEFAULT_DEADLINE_S", 0))
+
+# Lower value is served first
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# Weight of the newest service time in the per-model moving average
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Rejected(Exception):
+    """
+    The request was not admitted; status is the HTTP status to answer with.
+    """
+    def __init__(self, status, message, retry_after_s=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after_s = retry_after_s
+
+    def to_json(self):
+        body = {"error": self.message}
+        if self.retry_after_s is not None:
+            body["retry_after_s"] = self.retry_after_s
+        return body
+
+###############################################################################
+# Tickets and queues
+###############################################################################
+class Ticket:
+    """
+    One admitted request. Holds a model slot from grant until release().
+    """
+    def __init__(self, scheduler, model, priority, deadline, queue_depth, seq, estimate_s=None):
+        self.scheduler = scheduler
+        self.model = model
+        self.priority = priority
+        self.deadline = deadline          # time.monotonic() value, or None
+        self.queue_depth = queue_depth    # requests waiting ahead at arrival
+        self.estimate_s = estimate_s      # predicted service time, or None
+        self.seq = seq
+        self.arrived = time.monotonic()
+        self.granted_at = None
+        self.expired = False
+        self.cancelled = False
+        self.released = False
+        self._event = None
+        self._loop = None
+        self._future = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def queue_wait_s(self):
+        return (self.granted_at - self.arrived) if self.granted_at is not None else 0
+
+    def _notify(self):
+        if self._event is not None:
+            self._event.set()
+        elif self._future is not None:
+            self._loop.call_soon_threadsafe(self._resolve_future)
+
+    def _resolve_future(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def release(self):
+        """
+        Frees the slot; safe to call more than once.
+        """
+        self.scheduler._release(self)
+
+
+class _ModelQueue:
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.running = 0
+        self.active = set()               # granted, not yet released Tickets
+        self.waiting = []                 # heap of Tickets
+        self.queued = 0                   # live (not cancelled) tickets in waiting
+        self.service_ewma_s = None
+        self.counts = {"admitted": 0, "queue_full": 0, "deadline_missed": 0, "shed": 0}
+
+    def has_slot(self):
+        return self.concurrency <= 0 or self.running < self.concurrency
+
+    def live_waiting(self):
+        return [t for t in self.waiting if not t.cancelled]
+
+    def service_s(self, ticket):
+        return ticket.estimate_s if ticket.estimate_s is not None else self.service_ewma_s
+
+    def expected_wait_s(self, ahead, now):
+        """
+        Rough wait for a request queued behind the `ahead` tickets: the work
+        left on the running requests plus the work queued ahead, shared by
+        the model's slots. None while a service time is unknown.
+        """
+        if self.has_slot() and not ahead:
+            return 0.0
+        work_s = 0.0
+        for ticket in self.active:
+            service_s = self.service_s(ticket)
+            if service_s is None:
+                return None
+            work_s += max(0.0, service_s - (now - ticket.granted_at))
+        for ticket in ahead:
+            service_s = self.service_s(ticket)
+            if service_s is None:
+                return None
+            work_s += service_s
+        return work_s / max(1, self.concurrency)
+
+###############################################################################
+# Scheduler
+###############################################################################
+class Scheduler:
+    """
+    Per-model slots and priority queues. acquire() is for threads (Flask),
+    acquire_async() for coroutines (async server); both return a Ticket or
+    raise Rejected. With wait=True a full queue admits the request anyway, for
+    callers whose own concurrency is already bounded.
+    """
+    def __init__(self, concurrency=SCHEDULER_CONCURRENCY, model_concurrency=None,
+                 max_queue=SCHEDULER_MAX_QUEUE, default_deadline_s=SCHEDULER_DEFAULT_DEADLINE_S):
+        self.concurrency = concurrency
+        self.model_concurrency = (
+            model_concurrency if model_concurrency is not None else SCHEDULER_MODEL_CONCURRENCY
+        )
+        self.max_queue = max_queue
+        self.default_deadline_s = default_deadline_s
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._seq = itertools.count()
+
+    def _queue(self, model):
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = self._queues[model] = _ModelQueue(
+                self.model_concurrency.get(model, self.concurrency)
+            )
+        return queue
+
+    # ----------- Admission -----------
+    def _admit(self, model, priority, deadline_s, estimate_s=None, wait=False):
+        """
+        Grants a slot right away or enqueues. With wait, a full queue does not
+        reject the request. Must hold self._lock.
+        """
+        queue = self._queue(model)
+        rank = PRIORITIES.get(priority, PRIORITIES["normal"])
+        deadline_s = deadline_s if deadline_s else self.default_deadline_s
+        now = time.monotonic()
+        deadline = now + deadline_s if deadline_s > 0 else None
+        ahead = [t for t in queue.waiting if not t.cancelled and t.priority <= rank]
+
+        if queue.has_slot() and queue.queued == 0:
+            ticket = Ticket(self, model, rank, deadline, 0, next(self._seq), estimate_s)
+            self._grant(queue, ticket, ticket.arrived)
+            return ticket
+
+        expected_s = queue.expected_wait_s(ahead, now)
+        if queue.queued >= self.max_queue and not wait:
+            queue.counts["queue_full"] += 1
+            raise Rejected(429, f"Queue for {model} is full", expected_s)
+        if deadline_s > 0 and expected_s is not None and expected_s > deadline_s:
+            queue.counts["shed"] += 1
+            raise Rejected(503, f"Expected wait {expected_s:.1f}s exceeds the deadline", expected_s)
+
+        ticket = Ticket(self, model, rank, deadline, len(ahead), next(self._seq), estimate_s)
+        heapq.heappush(queue.waiting, ticket)
+        queue.queued += 1
+        return ticket
+
+    def _grant(self, queue, ticket, now):
+        queue.running += 1
+        queue.active.add(ticket)
+        queue.counts["admitted"] += 1
+        ticket.granted_at = now
+
+    def _grant_next(self, queue):
+        """
+        Hands free slots to the best waiting tickets. Must hold self._lock.
+        """
+        now = time.monotonic()
+        while queue.waiting and queue.has_slot():
+            ticket = heapq.heappop(queue.waiting)
+            if ticket.cancelled:
+                continue
+            queue.queued -= 1
+            if ticket.deadline is not None and ticket.deadline < now:
+                ticket.expired = True
+            else:
+                self._grant(queue, ticket, now)
+            ticket._notify()
+
+    def _give_up(self, ticket):
+        """
+        Waiter timed out or went away. Returns True when the ticket was
+        granted in the meantime and now owns a slot. Must hold self._lock.
+        """
+        if ticket.granted_at is not None:
+            return True
+        if not ticket.cancelled and not ticket.expired:
+            ticket.cancelled = True
+            self._queues[ticket.model].queued -= 1
+        return False
+
+    def _deadline_error(self, ticket):
+        queue = self._queues[ticket.model]
+        queue.counts["deadline_missed"] += 1
+        return Rejected(503, "Deadline passed while queued",
+                        queue.expected_wait_s(queue.live_waiting(), time.monotonic()))
+
+    def _remaining_s(self, ticket):
+        if ticket.deadline is None:
+            return None
+        return max(0.0, ticket.deadline - time.monotonic())
+
+    def acquire(self, model, priority="normal", deadline_s=None, estimate_s=None, wait=False):
+        with self._lock:
+            ticket = self._admit(model, priority, deadline_s, estimate_s, wait)
+            if ticket.granted_at is not None:
+                return ticket
+            ticket._event = threading.Event()
+
+        ticket._event.wait(self._remaining_s(ticket))
+        with self._lock:
+            if ticket.granted_at is not None:
+                return ticket
+            self._give_up(ticket)
+            raise self._deadline_error(ticket)
+
+    async def acquire_async(self, model, priority="normal", deadline_s=None, estimate_s=None,
+                            wait=False):
+        with self._lock:
+            ticket = self._admit(model, priority, deadline_s, estimate_s, wait)
+            if ticket.granted_at is not None:
+                return ticket
+            ticket._loop = asyncio.get_running_loop()
+            ticket._future = ticket._loop.create_future()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket._future), self._remaining_s(ticket))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client went away while queued
+            with self._lock:
+                granted = self._give_up(ticket)
+            if granted:
+                self._release(ticket)
+            raise
+        with self._lock:
+            if ticket.granted_at is not None:
+                return ticket
+            self._give_up(ticket)
+            raise self._deadline_error(ticket)
+
+    # ----------- Release -----------
+    def _release(self, ticket):
+        with self._lock:
+            if ticket.released or ticket.granted_at is None:
+                return
+            ticket.released = True
+            queue = self._queues[ticket.model]
+            queue.running -= 1
+            queue.active.discard(ticket)
+            service_s = time.monotonic() - ticket.granted_at
+            queue.service_ewma_s = (
+                service_s if queue.service_ewma_s is None
+                else SERVICE_TIME_ALPHA * service_s + (1 - SERVICE_TIME_ALPHA) * queue.service_ewma_s
+            )
+            self._grant_next(queue)
+
+    def expected_wait_s(self, model, priority="normal"):
+        """
+        Expected queue wait of a request arriving now, or None when unknown.
+        """
+        rank = PRIORITIES.get(priority, PRIORITIES["normal"])
+        with self._lock:
+            queue = self._queue(model)
+            ahead = [t for t in queue.live_waiting() if t.priority <= rank]
+            return queue.expected_wait_s(ahead, time.monotonic())
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "default_concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "default_deadline_s": self.default_deadline_s,
+                "models": {
+                    model: dict(
+                        q.counts,
+                        concurrency=q.concurrency,
+                        running=q.running,
+                        queued=q.queued,
+                        service_ewma_s=q.service_ewma_s,
+                        expected_wait_s=q.expected_wait_s(q.live_waiting(), now),
+                    )
+                    for model, q in self._queues.items()
+                },
+            }
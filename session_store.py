@@ -0,0 +1,208 @@
+# Conversation sessions reusing Ollama's context between turns
+#
+# /process_prompt is stateless, so a multi-turn client re-sends the whole
+# conversation and Ollama evaluates it again on every turn; on a small device
+# that prompt evaluation dominates the latency of long chats. With a
+# session_id, the server keeps the "context" Ollama returned for the session's
+# last turn (the token ids of every prompt and response so far) and sends it
+# with the next prompt. When Ollama's runner still holds that prefix in its KV
+# cache, only the new prompt is evaluated.
+#
+# Savings are measured per turn against a stateless client re-sending the
+# history. That client's prompt would be this turn's returned context minus
+# its output tokens, so
+#   prompt_eval_tokens_saved = len(returned context) - eval_count - prompt_eval_count
+# which is 0 when Ollama had to evaluate the context again anyway. The time
+# saved is those tokens at the model's fitted prompt-eval cost per token (see
+# cost_model.py), or at the turn's own prompt-eval rate before there is a fit.
+#
+# Contexts are kept as 32-bit arrays in an LRU with an idle timeout, a session
+# count cap and a memory cap; the least recently used sessions go first.
+# Turns of one session are expected one at a time: of two concurrent turns,
+# the one finishing last sets the context.
+#
+# Settings (environment variables):
+#   SESSION_TTL_S         idle seconds before a session expires   (default 1800)
+#   SESSION_MAX_SESSIONS  sessions kept                           (default 1000)
+#   SESSION_MAX_MB        memory for all stored contexts          (default 64)
+
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+###############################################################################
+# SETTINGS
+###############################################################################
+SESSION_TTL_S = float(os.environ.get("SESSION_TTL_S", 1800))
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", 1000))
+SESSION_MAX_MB = float(os.environ.get("SESSION_MAX_MB", 64))
+
+SESSION_ID_MAX_LENGTH = 128
+
+
+class _Session:
+    def __init__(self, model):
+        self.model = model
+        self.context = array("i")
+        self.turns = 0
+        self.created = time.time()
+        self.last_used = time.monotonic()
+        self.tokens_saved = 0
+        self.time_saved_s = 0.0
+
+    @property
+    def nbytes(self):
+        return len(self.context) * self.context.itemsize
+
+    def to_json(self, session_id):
+        return {
+            "session_id": session_id,
+            "model": self.model,
+            "turns": self.turns,
+            "context_tokens": len(self.context),
+            "created": self.created,
+            "idle_s": time.monotonic() - self.last_used,
+            "prompt_eval_tokens_saved": self.tokens_saved,
+            "prompt_eval_time_saved_s": self.time_saved_s,
+        }
+
+###############################################################################
+# SessionStore
+###############################################################################
+class SessionStore:
+    """
+    session_id -> the model and last context of a conversation, in LRU order.
+    All methods are thread-safe.
+    """
+    def __init__(self, ttl_s=SESSION_TTL_S, max_sessions=SESSION_MAX_SESSIONS,
+                 max_bytes=int(SESSION_MAX_MB * 1024 * 1024)):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self.counts = {
+            "turns": 0, "context_reused": 0, "new": 0, "model_changed": 0,
+            "expired": 0, "evicted": 0,
+        }
+        self.tokens_saved = 0
+        self.time_saved_s = 0.0
+
+    def _expire(self, now):
+        """
+        Drops idle sessions; they sit at the LRU end. Must hold self._lock.
+        """
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.ttl_s:
+                break
+            self._remove(session_id)
+            self.counts["expired"] += 1
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.nbytes
+        return session
+
+    def context_for(self, session_id, model):
+        """
+        The context to send with the session's next turn, or None for a new
+        session (or one that switched model: contexts are model-specific).
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None or not session.context:
+                self.counts["new"] += 1
+                return None
+            if session.model != model:
+                self.counts["model_changed"] += 1
+                return None
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            self.counts["context_reused"] += 1
+            return session.context.tolist()
+
+    def record_turn(self, session_id, model, context_tokens_sent, result_data, prompt_eval_s_per_token=None):
+        """
+        Stores the context Ollama returned for a finished turn and returns the
+        turn's session metrics.
+        """
+        context = result_data.get("context") or []
+        prompt_eval_count = result_data.get("prompt_eval_count", 0)
+        tokens_saved = 0
+        if context_tokens_sent:
+            tokens_saved = max(0, len(context) - result_data.get("eval_count", 0) - prompt_eval_count)
+        if prompt_eval_s_per_token is None and prompt_eval_count > 0:
+            prompt_eval_s_per_token = result_data.get("prompt_eval_duration", 0) / 1e9 / prompt_eval_count
+        time_saved_s = tokens_saved * prompt_eval_s_per_token if prompt_eval_s_per_token is not None else None
+
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None or session.model != model:
+                if session is not None:
+                    self._remove(session_id)
+                session = self._sessions[session_id] = _Session(model)
+            if context:
+                self._bytes -= session.nbytes
+                session.context = array("i", context)
+                self._bytes += session.nbytes
+            session.turns += 1
+            session.last_used = now
+            session.tokens_saved += tokens_saved
+            session.time_saved_s += time_saved_s or 0.0
+            self._sessions.move_to_end(session_id)
+            self.counts["turns"] += 1
+            self.tokens_saved += tokens_saved
+            self.time_saved_s += time_saved_s or 0.0
+            turn = session.turns
+            if session.nbytes > self.max_bytes:
+                # Too large on its own; keep the other sessions instead
+                self._remove(session_id)
+                self.counts["evicted"] += 1
+            while self._sessions and (len(self._sessions) > self.max_sessions
+                                      or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._sessions)))
+                self.counts["evicted"] += 1
+
+        return {
+            "session_id": session_id,
+            "session_turn": turn,
+            "context_tokens_sent": context_tokens_sent,
+            "prompt_eval_tokens_saved": tokens_saved,
+            "prompt_eval_time_saved_s": time_saved_s,
+        }
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire(time.monotonic())
+            session = self._sessions.get(session_id)
+            return session.to_json(session_id) if session is not None else None
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._remove(session_id)
+            return True
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "sessions": len(self._sessions),
+                "context_tokens": sum(len(s.context) for s in self._sessions.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_sessions": self.max_sessions,
+                "ttl_s": self.ttl_s,
+                "counts": dict(self.counts),
+                "prompt_eval_tokens_saved": self.tokens_saved,
+                "prompt_eval_time_saved_s": self.time_saved_s,
+            }
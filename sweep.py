@@ -0,0 +1,230 @@
+# Model / quantization / thread-count sweep
+#
+# Runs every combination of models x quantizations x thread counts (x context
+# sizes) x prompt sets against the metrics server, one request at a time so
+# runs do not disturb each other, and prints a comparison table of
+# tokens/s, time to first token, energy per token and peak RAM, each as a mean
+# with a 95% confidence interval over the repetitions.
+#
+# Model names are combined with quantizations as "<model>-<quant>", matching
+# Ollama's tags, e.g. --models llama3.2:1b-instruct --quants q4_K_M q8_0.
+# Without --quants the model names are used as given.
+#
+# Each combination starts with --warmup unrecorded requests (which also take
+# the model load), then sends every prompt of the set --repetitions times.
+# Requests are streamed so TTFT is measured, and tagged "sweep:<id>" so the
+# raw rows can be found again with GET /metrics/query?tag=sweep:<id>.
+#
+# Prompt sets: --prompt-set NAME=FILE (repeatable), one prompt per line or
+# JSONL with a "prompt" field; without it the prompts from prompts.py are used.
+
+# Run:
+#   python sweep.py --models llama3.2:1b-instruct qwen2.5:0.5b-instruct --quants q4_K_M q8_0 \
+#       --threads 2 4 --repetitions 5 --output sweep_results.json
+
+import argparse
+import itertools
+import json
+import math
+import time
+import uuid
+
+import requests
+
+from prompts import generate_prompts
+
+# Two-sided 95% Student t critical values by degrees of freedom
+T_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+    8: 2.306, 9: 2.262, 10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 30: 2.042,
+}
+
+# Reported metric -> how to read it from a /process_prompt result
+SWEEP_METRICS = {
+    "tokens_per_second": lambda m: m["ollama_metrics"]["tokens_per_second"],
+    "ttft_s": lambda m: m["streaming_metrics"]["time_to_first_token_s"],
+    "energy_per_token_j": lambda m: m["all_novel_metrics"]["energy_per_token_j"],
+    # The Ollama process tree when tracked, otherwise the whole system
+    "peak_ram_mb": lambda m: (m.get("process_usage") or {}).get("ollama_peak_rss_mb")
+                             or m["resource_usage"]["peak_ram_usage_mb"],
+}
+
+###############################################################################
+# Statistics
+###############################################################################
+def t_critical(df):
+    if df <= 0:
+        return float("nan")
+    for bound in sorted(T_95):
+        if df <= bound:
+            return T_95[bound]
+    return 1.96
+
+
+def mean_ci(values):
+    """
+    (mean, half-width of the 95% confidence interval) of a sample.
+    """
+    n = len(values)
+    if n == 0:
+        return None, None
+    mean = sum(values) / n
+    if n == 1:
+        return mean, None
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+    return mean, t_critical(n - 1) * math.sqrt(variance / n)
+
+###############################################################################
+# Matrix
+###############################################################################
+def load_prompt_set(spec):
+    name, _, path = spec.partition("=")
+    if not path:
+        raise ValueError(f"Expected NAME=FILE, got '{spec}'")
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                prompts.append(json.loads(line)["prompt"] if path.endswith(".jsonl") else line)
+    return name, prompts
+
+
+def build_matrix(args, prompt_sets):
+    models = ([f"{m}-{q}" for m in args.models for q in args.quants]
+              if args.quants else list(args.models))
+    return [
+        {"model": model, "num_thread": threads, "num_ctx": num_ctx, "prompt_set": set_name}
+        for model, threads, num_ctx, set_name in itertools.product(
+            models, args.threads or [None], args.num_ctx or [None], list(prompt_sets)
+        )
+    ]
+
+
+def request_options(config, args):
+    options = {}
+    for key in ("num_thread", "num_ctx"):
+        if config[key] is not None:
+            options[key] = config[key]
+    if args.num_predict is not None:
+        options["num_predict"] = args.num_predict
+    if args.temperature is not None:
+        options["temperature"] = args.temperature
+    return options
+
+###############################################################################
+# Runs
+###############################################################################
+def run_prompt(url, prompt, model, options, tag, timeout):
+    """
+    One streamed request; returns the final metrics event, or raises.
+    """
+    payload = {"prompt": prompt, "model": model, "options": options, "tag": tag, "stream": True}
+    final = None
+    with requests.post(url, json=payload, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event.get("error"):
+                raise RuntimeError(event["error"])
+            if event.get("done"):
+                final = event
+    if final is None:
+        raise RuntimeError("Stream ended without a final event")
+    return final
+
+
+def run_config(args, config, prompts, tag):
+    url = f"{args.url.rstrip('/')}/process_prompt"
+    options = request_options(config, args)
+    errors = []
+    for _ in range(args.warmup):
+        try:
+            run_prompt(url, prompts[0], config["model"], options, f"{tag}:warmup", args.timeout)
+        except (requests.RequestException, RuntimeError) as e:
+            errors.append(f"warmup: {e}")
+
+    samples = {name: [] for name in SWEEP_METRICS}
+    request_ids = []
+    for _ in range(args.repetitions):
+        for prompt in prompts:
+            try:
+                metrics = run_prompt(url, prompt, config["model"], options, tag, args.timeout)
+            except (requests.RequestException, RuntimeError) as e:
+                errors.append(str(e))
+                continue
+            request_ids.append(metrics["request_id"])
+            for name, read in SWEEP_METRICS.items():
+                samples[name].append(read(metrics))
+            if args.pause > 0:
+                time.sleep(args.pause)
+
+    result = dict(config, options=options, runs=len(request_ids), errors=errors,
+                  request_ids=request_ids)
+    for name, values in samples.items():
+        mean, ci = mean_ci(values)
+        result[name] = {"mean": mean, "ci95": ci, "n": len(values)}
+    return result
+
+###############################################################################
+# Report
+###############################################################################
+def print_table(results):
+    def cell(stat, scale=1.0, digits=2):
+        if stat["mean"] is None:
+            return f"{'-':>18}"
+        ci = f"±{stat['ci95'] * scale:.{digits}f}" if stat["ci95"] is not None else ""
+        return f"{stat['mean'] * scale:>10.{digits}f}{ci:>8}"
+
+    print(f"{'model':<36}{'thr':>4}{'ctx':>6}{'set':>10}{'runs':>5}"
+          f"{'tokens/s':>18}{'TTFT ms':>18}{'mJ/token':>18}{'peak RAM MB':>18}")
+    for r in results:
+        print(f"{r['model']:<36}{str(r['num_thread'] or '-'):>4}{str(r['num_ctx'] or '-'):>6}"
+              f"{r['prompt_set']:>10}{r['runs']:>5}"
+              f"{cell(r['tokens_per_second'])}{cell(r['ttft_s'], 1000, 1)}"
+              f"{cell(r['energy_per_token_j'], 1000, 1)}{cell(r['peak_ram_mb'], 1, 0)}")
+
+###############################################################################
+# MAIN
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Sweep models, quantizations and thread counts")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--models", nargs="+", required=True)
+    parser.add_argument("--quants", nargs="*", default=[])
+    parser.add_argument("--threads", type=int, nargs="*", default=[], help="num_thread values")
+    parser.add_argument("--num-ctx", type=int, nargs="*", default=[])
+    parser.add_argument("--num-predict", type=int)
+    parser.add_argument("--temperature", type=float)
+    parser.add_argument("--prompt-set", action="append", help="NAME=FILE, repeatable")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds between requests")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--output", default="sweep_results.json")
+    args = parser.parse_args()
+
+    prompt_sets = dict(load_prompt_set(spec) for spec in args.prompt_set or [])
+    if not prompt_sets:
+        prompt_sets = {"default": generate_prompts()}
+
+    sweep_id = uuid.uuid4().hex[:8]
+    tag = f"sweep:{sweep_id}"
+    matrix = build_matrix(args, prompt_sets)
+    print(f"Sweep {sweep_id}: {len(matrix)} configurations")
+
+    results = []
+    for n, config in enumerate(matrix, 1):
+        print(f"[{n}/{len(matrix)}] {config}")
+        results.append(run_config(args, config, prompt_sets[config["prompt_set"]], tag))
+
+    print_table(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"sweep_id": sweep_id, "tag": tag, "results": results}, f, indent=4)
+    print(f"Results saved to '{args.output}'.")
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,8 @@
 
 import requests
 import time
-import random
+
+from prompts import generate_prompts
 
 def hit_endpoint(base_url, prompts):
     """
@@ -31,6 +32,7 @@ def hit_endpoint(base_url, prompts):
 
             if response.status_code == 200:
                 result = response.json()
+                result["prompt"] = prompt
                 result["elapsed_time"] = end_time - start_time
                 results.append(result)
                 print(f"Response received in {result['elapsed_time']:.2f}s: {result['model_response'][:100]}...")
@@ -44,43 +46,6 @@ def hit_endpoint(base_url, prompts):
 
     return results
 
-def generate_prompts():
-    """
-    Generate a list of diverse NLP tasks for testing.
-    """
-    prompts = [
-        # General Knowledge
-        "What is the capital of France?",
-
-        # Summarization
-        "Summarize the following text: The industrial revolution was a period of major industrialization...",
-
-        # Creative Writing
-        "Write a short poem about the beauty of nature.",
-
-        # Sentiment Analysis
-        "Classify the sentiment: 'I absolutely loved the new restaurant!'",
-
-        # Text Completion
-        "Complete this sentence: The quick brown fox jumps over...",
-
-        # Translation
-        "Translate to French: 'Good morning, how are you?'",
-
-        # Coding Assistance
-        "Write a Python function to calculate the factorial of a number.",
-
-        # Edge Device Suitability
-        "Explain the benefits of Raspberry Pi in IoT applications.",
-
-        # Mathematical Queries
-        "What is the square root of 256?",
-
-        # Conversational
-        "Pretend to be a travel assistant. Suggest some attractions in Paris for a family vacation.",
-    ]
-    return prompts
-
 def main():
     base_url = "http://localhost:5000"
     prompts = generate_prompts()
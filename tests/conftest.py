@@ -0,0 +1,135 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, proc, timeout_s=10):
+    deadline = time.monotonic() + timeout_s
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                proc.kill()
+                raise
+            time.sleep(0.1)
+
+
+@pytest.fixture(scope="session")
+def stub_url():
+    """
+    ollama_stub.py on a free port; fast enough that a batch takes a second.
+    """
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "ollama_stub.py"), "--port", str(port),
+         "--tokens", "4", "--tokens-per-second", "200"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    _wait_for_port(port, proc)
+    yield f"http://127.0.0.1:{port}/api/generate"
+    proc.kill()
+    proc.wait()
+
+
+@pytest.fixture
+def collector(tmp_path):
+    """
+    A fleet collector process on a fixed port and store; stop() and start()
+    again to restart it.
+    """
+    class Collector:
+        port = _free_port()
+        url = f"http://127.0.0.1:{port}"
+        db = str(tmp_path / "fleet.db")
+        proc = None
+
+        def start(self):
+            self.proc = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, "fleet.py"), "collector",
+                 "--host", "127.0.0.1", "--port", str(self.port), "--db", self.db],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            _wait_for_port(self.port, self.proc)
+
+        def stop(self):
+            if self.proc is not None:
+                self.proc.kill()
+                self.proc.wait()
+                self.proc = None
+
+    c = Collector()
+    c.start()
+    yield c
+    c.stop()
+
+
+@pytest.fixture
+def raw_upstream():
+    """
+    Factory for a one-shot fake Ollama: answers every connection with the
+    given raw bytes (after an optional delay), then drops it. Returns the
+    /api/generate URL.
+    """
+    sockets = []
+
+    def start(payload, delay_s=0.0):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        sockets.append(listener)
+
+        def serve():
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                with conn:
+                    conn.recv(65536)
+                    time.sleep(delay_s)
+                    conn.sendall(payload)
+
+        threading.Thread(target=serve, daemon=True).start()
+        return f"http://127.0.0.1:{listener.getsockname()[1]}/api/generate"
+
+    yield start
+    for listener in sockets:
+        listener.close()
+
+
+@pytest.fixture(scope="session")
+def server(stub_url, tmp_path_factory):
+    """
+    The llm_metrics_11 module, logging to a temporary directory and talking
+    to the stub.
+    """
+    tmp = tmp_path_factory.mktemp("metrics")
+    os.environ.update({
+        "OLLAMA_API_URL": stub_url,
+        "METRICS_CSV": str(tmp / "metrics_log.csv"),
+        "METRICS_DB": str(tmp / "metrics.db"),
+        "TRACE_DIR": str(tmp / "traces"),
+    })
+    import llm_metrics_11
+    return llm_metrics_11
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from scheduler import Rejected, Scheduler
+
+
+def _lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_batch_parallelism_above_max_queue_is_not_shed(server, client, monkeypatch):
+    # One slot and room for two waiting requests, but eight prompts in flight
+    monkeypatch.setattr(server, "SCHEDULER", Scheduler(concurrency=1, max_queue=2))
+    prompts = [f"prompt {n}" for n in range(8)]
+
+    response = client.post("/process_batch", json={"prompts": prompts, "parallelism": 8})
+
+    assert response.status_code == 200
+    lines = _lines(response)
+    summary = lines[-1]["batch_summary"]
+    assert [line for line in lines[:-1] if "error" in line] == []
+    assert summary["succeeded"] == len(prompts)
+    assert server.SCHEDULER.stats()["models"][server.MODEL_NAME]["queue_full"] == 0
+
+
+def test_single_prompts_are_still_shed_when_the_queue_is_full():
+    scheduler = Scheduler(concurrency=1, max_queue=0)
+    ticket = scheduler.acquire("m")
+    with pytest.raises(Rejected) as e:
+        scheduler.acquire("m")
+    assert e.value.status == 429
+    ticket.release()
+
+
+def test_parallelism_above_the_limit_is_rejected(server, client):
+    response = client.post("/process_batch", json={
+        "prompts": ["a"], "parallelism": server.BATCH_MAX_PARALLELISM + 1,
+    })
+    assert response.status_code == 400
+    assert "parallelism" in response.get_json()["error"]
+
+
+def test_one_failing_prompt_does_not_end_the_batch(server, client, monkeypatch):
+    real = server.collect_metrics
+
+    def collect_metrics(req, *args, **kwargs):
+        if req.prompt == "bad":
+            raise KeyError("eval_count")
+        return real(req, *args, **kwargs)
+
+    monkeypatch.setattr(server, "collect_metrics", collect_metrics)
+    response = client.post("/process_batch", json={"prompts": ["a", "bad", "b"], "parallelism": 1})
+
+    lines = _lines(response)
+    errors = [line for line in lines[:-1] if "error" in line]
+    assert [line["index"] for line in errors] == [1]
+    assert errors[0]["status"] == 500
+    assert lines[-1]["batch_summary"]["succeeded"] == 2
@@ -0,0 +1,16 @@
+import pytest
+
+from compare_runs import bootstrap, MIN_BOOTSTRAP
+
+
+@pytest.mark.parametrize("n_boot", [0, -5, MIN_BOOTSTRAP - 1])
+def test_bootstrap_rejects_too_few_resamples(n_boot):
+    with pytest.raises(ValueError, match="bootstrap"):
+        bootstrap({"p": [1.0, 2.0]}, {"p": [1.5, 2.5]}, n_boot)
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "abc"])
+def test_compare_endpoint_answers_400_for_a_bad_bootstrap(client, value):
+    response = client.get(f"/metrics/compare?baseline=a&candidate=b&bootstrap={value}")
+    assert response.status_code == 400
+    assert "bootstrap" in response.get_json()["error"]
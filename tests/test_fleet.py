@@ -0,0 +1,100 @@
+import time
+
+import requests
+
+from fleet import FleetPushSink
+
+
+def _rows(node_id, first, count):
+    return [
+        {
+            "request_id": f"{node_id}-{n}",
+            "timestamp": "2026-01-01 00:00:00",
+            "unix_time": 1767225600.0 + n,
+            "model": "m",
+            "prompt": "p",
+            "response": "r",
+            "tokens_per_second": 10.0,
+        }
+        for n in range(first, first + count)
+    ]
+
+
+def _sink(collector, tmp_path, node_id):
+    return FleetPushSink(
+        collector.url, node_id=node_id, spool_dir=str(tmp_path / node_id),
+        retry_s=0.1, retry_max_s=10, timeout_s=2,
+    )
+
+
+def _nodes(collector):
+    return requests.get(f"{collector.url}/fleet/nodes", timeout=2).json()
+
+
+def _stored(collector):
+    response = requests.get(f"{collector.url}/metrics/query", params={"limit": 1000}, timeout=2)
+    return sorted(row["request_id"] for row in response.json()["rows"])
+
+
+def _wait_for(predicate, timeout_s=10):
+    deadline = time.monotonic() + timeout_s
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_nodes_push_and_resent_rows_are_ignored(collector, tmp_path):
+    a, b = _sink(collector, tmp_path, "node-a"), _sink(collector, tmp_path, "node-b")
+    try:
+        a.write_batch(_rows("node-a", 0, 5))
+        b.write_batch(_rows("node-b", 0, 3))
+        _wait_for(lambda: a.batches_sent == 1 and b.batches_sent == 1)
+
+        # A batch overlapping the first, as after a lost reply
+        a.write_batch(_rows("node-a", 3, 4))
+        _wait_for(lambda: a.batches_sent == 2)
+    finally:
+        a.close()
+        b.close()
+
+    nodes = _nodes(collector)
+    assert (nodes["node-a"]["rows"], nodes["node-a"]["duplicate_rows"]) == (7, 2)
+    assert (nodes["node-b"]["rows"], nodes["node-b"]["duplicate_rows"]) == (3, 0)
+    assert nodes["node-a"]["models"] == ["m"]
+    assert _stored(collector) == sorted(
+        [f"node-a-{n}" for n in range(7)] + [f"node-b-{n}" for n in range(3)]
+    )
+
+
+def test_spooled_batches_survive_a_collector_restart(collector, tmp_path):
+    collector.stop()
+    a, b = _sink(collector, tmp_path, "node-a"), _sink(collector, tmp_path, "node-b")
+    try:
+        a.write_batch(_rows("node-a", 0, 4))
+        b.write_batch(_rows("node-b", 0, 2))
+        time.sleep(1.0)
+
+        for sink in (a, b):
+            stats = sink.stats()
+            assert stats["batches_sent"] == 0
+            assert stats["spooled_batches"] == 1
+            # Retries at 0, 0.1, 0.3 and 0.7 s: the delay doubles
+            assert 3 <= stats["send_errors"] <= 5
+
+        collector.start()
+        _wait_for(lambda: a.batches_sent == 1 and b.batches_sent == 1)
+        assert a.stats()["spooled_batches"] == b.stats()["spooled_batches"] == 0
+        assert _stored(collector) == ["node-a-0", "node-a-1", "node-a-2", "node-a-3", "node-b-0", "node-b-1"]
+
+        # The store, not the collector's memory, knows what it already has
+        collector.stop()
+        collector.start()
+        a.write_batch(_rows("node-a", 2, 3))
+        _wait_for(lambda: a.batches_sent == 2)
+    finally:
+        a.close()
+        b.close()
+
+    node_a = _nodes(collector)["node-a"]
+    assert (node_a["rows"], node_a["duplicate_rows"]) == (1, 2)
+    assert len(_stored(collector)) == 7
@@ -0,0 +1,21 @@
+import asyncio
+
+import httpx
+
+from load_test import Result, send_request
+
+
+def test_non_json_error_body_counts_as_a_failure():
+    def handler(request):
+        return httpx.Response(502, text="<html>Bad Gateway</html>")
+
+    async def run():
+        result = Result(0, 0.0)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await send_request(client, "http://metrics/process_prompt", "hi", True, result)
+        return result
+
+    result = asyncio.run(run())
+    assert result.ok is False
+    assert result.status == 502
+    assert result.ended is not None
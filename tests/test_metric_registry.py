@@ -0,0 +1,76 @@
+import csv
+import math
+
+import pytest
+
+from metric_registry import NOVEL_METRICS, ScalarOps, VectorOps, recompute_csv
+
+
+HEADER = ["request_id", "total_energy_j", "eval_count"]
+ROWS = [
+    ["a", "10.0", "5"],
+    ["b", "", "4"],
+    ["c", "3.0", "0"],
+    ["d", "8.0", ""],
+    ["e", "9.0", "3"],
+]
+
+
+def _write(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _read(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def test_div_keeps_missing_inputs_missing():
+    out = VectorOps.div([1.0, math.nan, 1.0, 4.0], [math.nan, 2.0, 0.0, 2.0])
+    assert math.isnan(out[0]) and math.isnan(out[1])
+    assert out[2] == 0.0 and out[3] == 2.0
+    assert math.isnan(ScalarOps.div(math.nan, 2.0))
+    assert math.isnan(ScalarOps.div(1.0, math.nan))
+    assert ScalarOps.div(1.0, 0.0) == 0
+
+
+def test_recompute_leaves_missing_inputs_blank(tmp_path):
+    log, out = tmp_path / "log.csv", tmp_path / "out.csv"
+    _write(log, HEADER, ROWS)
+
+    n, names, skipped = recompute_csv(str(log), str(out), ["energy_per_token_j"])
+
+    assert (n, names, skipped) == (5, ["energy_per_token_j"], {})
+    values = [row["energy_per_token_j"] for row in _read(out)]
+    assert values == ["2.0", "", "0.0", "", "3.0"]
+
+
+def test_recompute_refuses_to_rewrite_the_log(tmp_path):
+    log = tmp_path / "log.csv"
+    _write(log, HEADER, ROWS)
+    before = log.read_bytes()
+
+    with pytest.raises(ValueError):
+        recompute_csv(str(log), str(log))
+    with pytest.raises(ValueError):
+        recompute_csv(str(log), str(tmp_path / "." / "log.csv"))
+
+    assert log.read_bytes() == before
+    assert [p.name for p in tmp_path.iterdir()] == ["log.csv"]
+
+
+def test_recompute_in_chunks_matches_one_pass(tmp_path):
+    log = tmp_path / "log.csv"
+    header = ["request_id"] + sorted(NOVEL_METRICS.base_inputs())
+    rows = [[f"r{n}"] + [str((n * 7 + k) % 11 or "") for k in range(len(header) - 1)] for n in range(23)]
+    _write(log, header, rows)
+
+    recompute_csv(str(log), str(tmp_path / "one.csv"))
+    n, names, _ = recompute_csv(str(log), str(tmp_path / "chunked.csv"), chunk_rows=4)
+
+    assert n == len(rows)
+    assert names == NOVEL_METRICS.names()
+    assert _read(tmp_path / "chunked.csv") == _read(tmp_path / "one.csv")
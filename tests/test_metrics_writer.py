@@ -0,0 +1,42 @@
+from metrics_writer import MetricsWriter
+
+
+class _ListSink:
+    def __init__(self):
+        self.rows = []
+
+    def write_batch(self, rows):
+        self.rows.extend(rows)
+
+    def close(self):
+        pass
+
+
+class _FailingSink:
+    def write_batch(self, rows):
+        raise OSError("disk full")
+
+    def close(self):
+        pass
+
+
+def test_rows_are_counted_as_written_only_when_every_sink_succeeds():
+    good = _ListSink()
+    writer = MetricsWriter([good, _FailingSink()], flush_interval_s=0.01)
+    for n in range(3):
+        writer.submit({"n": n})
+    writer.close()
+
+    stats = writer.stats()
+    assert len(good.rows) == 3
+    assert stats["rows_written"] == 0
+    assert stats["rows_failed"] == 3
+    assert stats["sink_errors"] == {"_FailingSink": stats["write_errors"]}
+
+
+def test_rows_written_with_healthy_sinks():
+    writer = MetricsWriter([_ListSink()], flush_interval_s=0.01)
+    writer.submit({"n": 0})
+    writer.close()
+    assert writer.stats()["rows_written"] == 1
+    assert writer.stats()["rows_failed"] == 0
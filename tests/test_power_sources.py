@@ -0,0 +1,157 @@
+import pytest
+
+import power_sources
+from power_sources import HwmonPowerSource, LinearPowerModel, RaplPowerSource, make_power_source
+
+
+def _write(path, value):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f"{value}\n")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Drives time.monotonic() in power_sources: clock.now = ...
+    """
+    class Clock:
+        now = 100.0
+    monkeypatch.setattr(power_sources.time, "monotonic", lambda: Clock.now)
+    return Clock
+
+
+def test_rapl_reads_package_zones_in_microjoules(tmp_path):
+    _write(tmp_path / "intel-rapl:0" / "energy_uj", 1_000_000)
+    _write(tmp_path / "intel-rapl:0" / "max_energy_range_uj", 10_000_000)
+    _write(tmp_path / "intel-rapl:1" / "energy_uj", 5_000_000)
+    # Subzones are already part of their package
+    _write(tmp_path / "intel-rapl:0:0" / "energy_uj", 7_000_000)
+    source = RaplPowerSource(root=str(tmp_path))
+    assert source.read_energy_j() == 0.0
+
+    _write(tmp_path / "intel-rapl:0" / "energy_uj", 3_500_000)
+    _write(tmp_path / "intel-rapl:1" / "energy_uj", 5_500_000)
+    _write(tmp_path / "intel-rapl:0:0" / "energy_uj", 9_000_000)
+
+    assert source.read_energy_j() == pytest.approx(3.0)
+
+
+def test_rapl_counter_wraparound(tmp_path):
+    zone = tmp_path / "intel-rapl:0"
+    _write(zone / "energy_uj", 9_000_000)
+    _write(zone / "max_energy_range_uj", 10_000_000)
+    source = RaplPowerSource(root=str(tmp_path))
+
+    _write(zone / "energy_uj", 1_000_000)
+    assert source.read_energy_j() == pytest.approx(2.0)
+    _write(zone / "energy_uj", 1_500_000)
+    assert source.read_energy_j() == pytest.approx(2.5)
+
+
+def test_rapl_without_range_counts_a_reset_from_zero(tmp_path):
+    zone = tmp_path / "intel-rapl:0"
+    _write(zone / "energy_uj", 9_000_000)
+    source = RaplPowerSource(root=str(tmp_path))
+
+    _write(zone / "energy_uj", 1_000_000)
+
+    assert source.read_energy_j() == pytest.approx(1.0)
+
+
+def test_rapl_power_from_counter_deltas(tmp_path, clock):
+    zone = tmp_path / "intel-rapl:0"
+    _write(zone / "energy_uj", 0)
+    source = RaplPowerSource(root=str(tmp_path))
+    assert source.read_power_w() == 0.0
+
+    _write(zone / "energy_uj", 6_000_000)
+    clock.now += 2.0
+
+    assert source.read_power_w() == pytest.approx(3.0)
+
+
+def test_rapl_missing_zones_or_counters(tmp_path):
+    with pytest.raises(OSError):
+        RaplPowerSource(root=str(tmp_path))
+    _write(tmp_path / "intel-rapl:0" / "max_energy_range_uj", 10_000_000)
+    with pytest.raises(OSError):
+        RaplPowerSource(root=str(tmp_path))
+
+
+def test_hwmon_prefers_energy_counters_over_power(tmp_path, clock):
+    chip = tmp_path / "hwmon0"
+    _write(chip / "name", "ina3221")
+    _write(chip / "energy1_input", 2_000_000)
+    _write(chip / "power1_input", 99_000_000)
+    source = HwmonPowerSource(root=str(tmp_path), sensors=[])
+
+    _write(chip / "energy1_input", 6_000_000)
+    clock.now += 1.0
+
+    assert source.read_power_w() == pytest.approx(4.0)
+    assert source.read_energy_j() == pytest.approx(4.0)
+
+
+def test_hwmon_power_inputs_in_microwatts(tmp_path):
+    _write(tmp_path / "hwmon0" / "name", "acpi_power")
+    _write(tmp_path / "hwmon0" / "power1_input", 1_500_000)
+    _write(tmp_path / "hwmon0" / "power2_input", 500_000)
+    source = HwmonPowerSource(root=str(tmp_path), sensors=[])
+
+    assert source.read_power_w() == pytest.approx(2.0)
+    assert source.read_energy_j() is None
+
+
+def test_hwmon_voltage_times_current_on_ina_chips(tmp_path):
+    ina = tmp_path / "hwmon0"
+    _write(ina / "name", "ina219")
+    _write(ina / "in1_input", 5000)     # mV
+    _write(ina / "curr1_input", 400)    # mA
+    _write(ina / "in2_input", 12000)    # no matching current: ignored
+    # A CPU monitor also exposes in*/curr* but does not measure the rail
+    cpu = tmp_path / "hwmon1"
+    _write(cpu / "name", "nct6775")
+    _write(cpu / "in1_input", 1200)
+    _write(cpu / "curr1_input", 30000)
+    source = HwmonPowerSource(root=str(tmp_path), sensors=[])
+
+    assert source.read_power_w() == pytest.approx(2.0)
+
+
+def test_hwmon_sensor_selection_and_missing_name(tmp_path):
+    _write(tmp_path / "hwmon0" / "power1_input", 1_000_000)
+    _write(tmp_path / "hwmon1" / "name", "ina226")
+    _write(tmp_path / "hwmon1" / "power1_input", 3_000_000)
+
+    assert HwmonPowerSource(root=str(tmp_path), sensors=[]).read_power_w() == pytest.approx(4.0)
+    assert HwmonPowerSource(root=str(tmp_path), sensors=["ina226"]).read_power_w() == pytest.approx(3.0)
+    with pytest.raises(OSError):
+        HwmonPowerSource(root=str(tmp_path), sensors=["ina260"])
+
+
+def test_hwmon_without_power_sensors(tmp_path):
+    _write(tmp_path / "hwmon0" / "name", "coretemp")
+    _write(tmp_path / "hwmon0" / "temp1_input", 45000)
+    with pytest.raises(OSError):
+        HwmonPowerSource(root=str(tmp_path), sensors=[])
+
+
+def test_auto_falls_back_from_rapl_to_hwmon_to_linear(tmp_path, monkeypatch):
+    rapl_root, hwmon_root = tmp_path / "powercap", tmp_path / "hwmon"
+
+    class Rapl(RaplPowerSource):
+        def __init__(self):
+            super().__init__(root=str(rapl_root))
+
+    class Hwmon(HwmonPowerSource):
+        def __init__(self):
+            super().__init__(root=str(hwmon_root), sensors=[])
+
+    monkeypatch.setattr(power_sources, "RaplPowerSource", Rapl)
+    monkeypatch.setattr(power_sources, "HwmonPowerSource", Hwmon)
+
+    assert isinstance(make_power_source("auto"), LinearPowerModel)
+    _write(hwmon_root / "hwmon0" / "power1_input", 1_000_000)
+    assert make_power_source("auto").name == "hwmon"
+    _write(rapl_root / "intel-rapl:0" / "energy_uj", 0)
+    assert make_power_source("auto").name == "rapl"
@@ -0,0 +1,59 @@
+import json
+
+# Chunked NDJSON that stops after one token, without the terminating chunk
+TRUNCATED_STREAM = (
+    b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+    b"Transfer-Encoding: chunked\r\n\r\n"
+    b"20\r\n" + b'{"response":"hi","done":false} \n' + b"\r\n"
+)
+
+
+def _events(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+
+
+def test_stream_cut_off_after_headers_ends_with_an_error_event(server, client, monkeypatch, raw_upstream):
+    monkeypatch.setattr(server, "OLLAMA_API_URL", raw_upstream(TRUNCATED_STREAM))
+    response = client.post("/process_prompt", json={"prompt": "a", "stream": True})
+    assert response.status_code == 200
+    events = _events(response)
+    assert events[0] == {"response": "hi", "done": False}
+    assert events[-1]["done"] is True
+    assert events[-1]["error"] == "LLM API stream failed"
+
+
+def test_stream_to_unreachable_ollama_is_a_502(server, client, monkeypatch):
+    monkeypatch.setattr(server, "OLLAMA_API_URL", "http://127.0.0.1:9/api/generate")
+    response = client.post("/process_prompt", json={"prompt": "a", "stream": True})
+    assert response.status_code == 502
+    assert response.get_json()["error"] == "LLM API unreachable"
+
+
+def test_stream_non_200_is_returned_as_its_status(server, client, monkeypatch, raw_upstream):
+    monkeypatch.setattr(server, "OLLAMA_API_URL", raw_upstream(
+        b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 4\r\n\r\nboom"))
+    response = client.post("/process_prompt", json={"prompt": "a", "stream": True})
+    assert response.status_code == 500
+    assert response.get_json()["details"] == "boom"
+
+
+def test_stream_releases_the_scheduler_slot_on_errors(server, client, monkeypatch):
+    monkeypatch.setattr(server, "OLLAMA_API_URL", "http://127.0.0.1:9/api/generate")
+    client.post("/process_prompt", json={"prompt": "a", "stream": True})
+    assert server.SCHEDULER.stats()["models"][server.MODEL_NAME]["running"] == 0
+
+
+def test_non_json_body_is_a_502(server, client, monkeypatch, raw_upstream):
+    monkeypatch.setattr(server, "OLLAMA_API_URL", raw_upstream(
+        b"HTTP/1.1 200 OK\r\nContent-Length: 9\r\n\r\nnot json!"))
+    response = client.post("/process_prompt", json={"prompt": "a"})
+    assert response.status_code == 502
+    assert response.get_json() == {"error": "Malformed LLM API response", "details": "not json!"}
+
+
+def test_hung_ollama_times_out_and_frees_the_slot(server, client, monkeypatch, raw_upstream):
+    monkeypatch.setattr(server, "OLLAMA_API_URL", raw_upstream(b"", delay_s=2.0))
+    monkeypatch.setattr(server, "OLLAMA_TIMEOUT", (1.0, 0.3))
+    response = client.post("/process_prompt", json={"prompt": "a"})
+    assert response.status_code == 504
+    assert server.SCHEDULER.stats()["models"][server.MODEL_NAME]["running"] == 0
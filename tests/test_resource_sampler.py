@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import psutil
+import pytest
+
+from resource_sampler import OllamaProcessTracker, ResourceMonitor, ResourceSampler
+
+# Burns CPU and writes to disk until killed
+BUSY = """
+import os, sys
+with open(sys.argv[1], "wb") as f:
+    while True:
+        for _ in range(20000):
+            pass
+        f.write(b"x" * 4096)
+        f.flush()
+        os.fsync(f.fileno())
+"""
+
+
+@pytest.fixture
+def fake_ollama(tmp_path):
+    """
+    A busy process whose name starts with "ollama-fake", like a model runner.
+    """
+    exe = tmp_path / "ollama-fake"
+    os.symlink(sys.executable, exe)
+    proc = subprocess.Popen([str(exe), "-c", BUSY, str(tmp_path / "out")])
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+# An "ollama-fake serve" parent with two runner children, like Ollama
+SERVER_WITH_RUNNERS = """
+import subprocess, sys, time
+runner = "import time; block = b'x' * (8 << 20); time.sleep(60)"
+children = [subprocess.Popen([sys.executable, "-c", runner]) for _ in range(2)]
+time.sleep(60)
+"""
+
+
+@pytest.fixture
+def sampler():
+    sampler = ResourceSampler(
+        interval=0.02, idle_interval=0.02, capacity=1024,
+        tracker_factory=lambda: OllamaProcessTracker(name_prefix="ollama-fake", refresh_interval=0.1),
+    )
+    yield sampler
+    sampler.stop()
+
+
+def test_process_usage_comes_from_the_sampler_thread(fake_ollama, sampler, monkeypatch):
+    request_thread_calls = []
+    main = threading.current_thread()
+
+    def spy(name, real):
+        def wrapper(*args, **kwargs):
+            if threading.current_thread() is main:
+                request_thread_calls.append(name)
+            return real(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(psutil, "process_iter", spy("process_iter", psutil.process_iter))
+    monkeypatch.setattr(psutil.Process, "memory_full_info",
+                        spy("memory_full_info", psutil.Process.memory_full_info))
+
+    sampler.ensure_started()
+    time.sleep(0.5)   # tree discovered, a few samples taken
+    monitor = ResourceMonitor(sampler)
+    monitor.start()
+    time.sleep(1.0)
+    monitor.stop()
+
+    usage = monitor.get_process_usage()
+    assert request_thread_calls == []
+    assert fake_ollama.pid in usage["ollama_pids"]
+    assert usage["ollama_cpu_time_s"] == pytest.approx(1.0, abs=0.5)
+    assert usage["ollama_io_write_bytes"] > 0
+    assert usage["ollama_pss_mb"] is None
+
+
+def test_pss_is_opt_in(fake_ollama):
+    tracker = OllamaProcessTracker(name_prefix="ollama-fake", track_pss=True)
+    try:
+        tracker.refresh(force=True)
+        assert tracker.pss_mb() > 0
+    finally:
+        tracker.close()
+
+
+def test_a_runner_spawned_while_tracking_counts_from_zero(tmp_path, sampler):
+    sampler.ensure_started()
+    time.sleep(0.1)
+    monitor = ResourceMonitor(sampler)
+    monitor.start()
+    exe = tmp_path / "ollama-fake"
+    os.symlink(sys.executable, exe)
+    proc = subprocess.Popen([str(exe), "-c", BUSY, str(tmp_path / "out")])
+    try:
+        time.sleep(1.0)
+        monitor.stop()
+    finally:
+        proc.kill()
+        proc.wait()
+    assert monitor.get_process_usage()["ollama_cpu_time_s"] > 0.5
+
+
+def test_runner_children_of_the_server_are_tracked(tmp_path):
+    exe = tmp_path / "ollama-fake"
+    os.symlink(sys.executable, exe)
+    server = subprocess.Popen([str(exe), "-c", SERVER_WITH_RUNNERS, "serve"])
+    tracker = OllamaProcessTracker(name_prefix="ollama-fake")
+    try:
+        deadline = time.monotonic() + 10
+        while len(psutil.Process(server.pid).children()) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        tracker.refresh(force=True)
+        tracker.sample()
+        assert len(tracker.processes()) == 3
+        assert set(tracker.processes().values()) == {"ollama-fake"}
+    finally:
+        tracker.close()
+        for child in psutil.Process(server.pid).children():
+            child.kill()
+        server.kill()
+        server.wait()
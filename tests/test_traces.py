@@ -0,0 +1,42 @@
+import os
+import uuid
+
+import pytest
+
+from trace_store import TraceStore
+
+
+def _trace(request_id):
+    return {
+        "request_id": request_id,
+        "start_unix": 1.0,
+        "start_ts": 10.0,
+        "sample_ts": [10.0, 10.5],
+        "columns": {"cpu": [5.0, 6.0]},
+        "token_offsets_s": [0.1, 0.2],
+    }
+
+
+def test_get_rejects_a_day_outside_the_trace_directory(tmp_path):
+    store = TraceStore(str(tmp_path / "traces"))
+    with pytest.raises(ValueError):
+        store.get(uuid.uuid4().hex, "../../etc/passwd")
+
+
+def test_get_skips_a_corrupt_segment(tmp_path):
+    store = TraceStore(str(tmp_path))
+    request_id = uuid.uuid4().hex
+    store.write_batch([{"trace": _trace(request_id)}])
+    store.close()
+    assert store.get(request_id)["token_offsets_s"].tolist() == pytest.approx([0.1, 0.2])
+
+    data_path = os.path.join(str(tmp_path), store.days()[0] + ".trc")
+    with open(data_path, "r+b") as f:
+        f.write(b"XXXX")
+    assert store.get(request_id) is None
+
+
+def test_trace_endpoint_answers_400_for_a_bad_day(server, client, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "TRACE_STORE", TraceStore(str(tmp_path)))
+    response = client.get("/traces/abc?day=../../etc")
+    assert response.status_code == 400
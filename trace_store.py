@@ -0,0 +1,390 @@
+# Per-request time-series traces
+#
+# The metric groups only keep averages and peaks of a request's samples. With
+# trace mode on, every request's timestamped resource samples and token
+# arrival times are kept as well, so the shape of a run (prompt-eval spike,
+# decode plateau, memory ramp during a load) can be looked at afterwards.
+#
+# Storage: one append-only data file per day (<TRACE_DIR>/<YYYY-MM-DD>.trc)
+# holding one binary segment per request, and next to it an index file
+# (<YYYY-MM-DD>.idx) of fixed-size records (request id, offset, length).
+# Reads memory-map both files and touch only the segment asked for, so the
+# size of a day's file does not matter.
+#
+# Segment layout (little-endian):
+#   header   magic "LTRC", version u16, column count u16, start unix time f64,
+#            request id 16 bytes, sample count u32, token count u32
+#   names    u16 length + comma-separated column names, padded to 4 bytes
+#   samples  one float32 array per column, "t_s" first (seconds since the
+#            request window opened)
+#   tokens   float32 token arrival offsets (seconds since the request was sent)
+#
+# Settings (environment variables):
+#   TRACE_MODE            1 = record traces                          (default 0)
+#   TRACE_DIR             directory of the day files                 (default traces)
+#   TRACE_RETENTION_DAYS  day files older than this are deleted      (default 0: keep all)
+#
+# Run:
+#   python trace_store.py get <request_id> [--points 200] [--csv]
+#   python trace_store.py list [--day 2025-08-01]
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# SETTINGS
+###############################################################################
+TRACE_MODE = os.environ.get("TRACE_MODE", "0") == "1"
+TRACE_DIR = os.environ.get("TRACE_DIR", "traces")
+TRACE_RETENTION_DAYS = int(os.environ.get("TRACE_RETENTION_DAYS", 0))
+
+MAGIC = b"LTRC"
+VERSION = 1
+HEADER = struct.Struct("<4sHHd16sII")
+INDEX_RECORD = struct.Struct("<16sQI")
+
+# Trace column -> ResourceMonitor attribute holding its readings
+MONITOR_COLUMNS = {
+    "cpu": "cpu_usage_readings",
+    "mem": "mem_usage_readings",
+    "power": "power_readings",
+    "process_cpu": "process_cpu_readings",
+    "ollama_cpu": "ollama_cpu_readings",
+    "ollama_rss": "ollama_rss_readings",
+}
+
+
+def parse_day(day):
+    """
+    A day file name in YYYY-MM-DD form; ValueError for anything else, since
+    the name becomes part of a file path.
+    """
+    return date.fromisoformat(day).isoformat()
+
+
+def request_key(request_id):
+    """
+    16-byte index key: the id itself for uuid hex ids, else its MD5.
+    """
+    try:
+        key = bytes.fromhex(request_id)
+        if len(key) == 16:
+            return key
+    except ValueError:
+        pass
+    return hashlib.md5(request_id.encode("utf-8")).digest()
+
+
+def trace_record(request_id, monitor, token_offsets_s=None):
+    """
+    What a row carries to the trace sink: references to the monitor's sample
+    lists, so building it on the request path copies nothing.
+    """
+    return {
+        "request_id": request_id,
+        "start_unix": monitor.start_wall,
+        "start_ts": monitor.start_ts,
+        "sample_ts": monitor.sample_timestamps,
+        "columns": {name: getattr(monitor, attr) for name, attr in MONITOR_COLUMNS.items()},
+        "token_offsets_s": token_offsets_s or [],
+    }
+
+###############################################################################
+# Encoding
+###############################################################################
+def _floats(values):
+    data = array("f", values)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+def _read_floats(buf, offset, count):
+    data = array("f")
+    data.frombytes(buf[offset:offset + 4 * count])
+    if len(data) != count:
+        raise ValueError(f"Trace segment truncated at offset {offset}")
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data
+
+
+def encode_segment(trace):
+    start_ts = trace["start_ts"]
+    columns = {"t_s": [ts - start_ts for ts in trace["sample_ts"]]}
+    columns.update(trace["columns"])
+    tokens = trace["token_offsets_s"]
+    n_samples = len(columns["t_s"])
+
+    names = ",".join(columns).encode("ascii")
+    names_block = struct.pack("<H", len(names)) + names
+    names_block += b"\0" * (-len(names_block) % 4)
+    parts = [
+        HEADER.pack(MAGIC, VERSION, len(columns), trace["start_unix"] or 0.0,
+                    request_key(trace["request_id"]), n_samples, len(tokens)),
+        names_block,
+    ]
+    for values in columns.values():
+        # A column the sampler did not fill (e.g. no process tracking) is zeros
+        parts.append(_floats(values if len(values) == n_samples else [0.0] * n_samples))
+    parts.append(_floats(tokens))
+    return b"".join(parts)
+
+
+def decode_segment(buf, offset):
+    magic, version, n_columns, start_unix, key, n_samples, n_tokens = HEADER.unpack_from(buf, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} trace segment at offset {offset}")
+    pos = offset + HEADER.size
+    (names_len,) = struct.unpack_from("<H", buf, pos)
+    names = bytes(buf[pos + 2:pos + 2 + names_len]).decode("ascii").split(",")
+    pos += 2 + names_len
+    pos += -(pos - offset) % 4
+    samples = {}
+    for name in names[:n_columns]:
+        samples[name] = _read_floats(buf, pos, n_samples)
+        pos += 4 * n_samples
+    return {
+        "request_id": key.hex(),
+        "start_unix": start_unix,
+        "samples": samples,
+        "token_offsets_s": _read_floats(buf, pos, n_tokens),
+    }
+
+###############################################################################
+# Downsampling
+###############################################################################
+def downsample(trace, max_points):
+    """
+    At most max_points per series: samples are averaged over consecutive
+    buckets, tokens keep every k-th arrival with its index (the cumulative
+    token curve stays exact at those points).
+    """
+    samples = trace["samples"]
+    n = len(samples.get("t_s", ()))
+    if max_points and n > max_points:
+        size = -(-n // max_points)
+        samples = {
+            name: [sum(values[i:i + size]) / len(values[i:i + size]) for i in range(0, n, size)]
+            for name, values in samples.items()
+        }
+    else:
+        samples = {name: list(values) for name, values in samples.items()}
+
+    tokens = trace["token_offsets_s"]
+    step = 1
+    if max_points and len(tokens) > max_points:
+        # Leaves room for the last token, which is always kept
+        step = -(-(len(tokens) - 1) // max(1, max_points - 1))
+    indices = list(range(0, len(tokens), step))
+    if tokens and indices[-1] != len(tokens) - 1:
+        indices.append(len(tokens) - 1)
+    return {
+        "request_id": trace["request_id"],
+        "start_unix": trace["start_unix"],
+        "sample_count": n,
+        "token_count": len(tokens),
+        "samples": samples,
+        "tokens": {"index": indices, "t_s": [tokens[i] for i in indices]},
+    }
+
+###############################################################################
+# TraceStore
+###############################################################################
+class TraceStore:
+    """
+    Metrics writer sink (write_batch/close) that stores the "trace" entry of
+    each row, plus random-access reads by request id.
+    """
+    def __init__(self, directory=TRACE_DIR, retention_days=TRACE_RETENTION_DAYS):
+        self.directory = directory
+        self.retention_days = retention_days
+        self._day = None
+        self._data = None
+        self._index = None
+        self.segments_written = 0
+        self.bytes_written = 0
+
+    def _paths(self, day):
+        base = os.path.join(self.directory, parse_day(day))
+        return base + ".trc", base + ".idx"
+
+    # ----------- Writing (writer thread only) -----------
+    def _open(self, day):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, index_path = self._paths(day)
+        self._data = open(data_path, "ab")
+        self._index = open(index_path, "ab")
+        self._day = day
+        self._prune()
+
+    def _prune(self):
+        if self.retention_days <= 0:
+            return
+        oldest = (date.today() - timedelta(days=self.retention_days)).isoformat()
+        for day in self.days():
+            if day < oldest:
+                for path in self._paths(day):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                logger.info(f"Deleted traces of {day}")
+
+    def write_batch(self, rows):
+        traces = [row["trace"] for row in rows if row.get("trace")]
+        if not traces:
+            return
+        day = date.today().isoformat()
+        if day != self._day:
+            self._open(day)
+        records = []
+        for trace in traces:
+            segment = encode_segment(trace)
+            offset = self._data.seek(0, os.SEEK_END)
+            self._data.write(segment)
+            records.append(INDEX_RECORD.pack(request_key(trace["request_id"]), offset, len(segment)))
+            self.bytes_written += len(segment)
+        # Data before index, so the index never points past the end of the data
+        self._data.flush()
+        self._index.write(b"".join(records))
+        self._index.flush()
+        self.segments_written += len(traces)
+
+    def close(self):
+        for f in (self._data, self._index):
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+        self._data = self._index = self._day = None
+
+    # ----------- Reading (any thread) -----------
+    def days(self):
+        if not os.path.isdir(self.directory):
+            return []
+        days = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".idx"):
+                try:
+                    days.append(parse_day(name[:-4]))
+                except ValueError:
+                    continue
+        return sorted(days)
+
+    @staticmethod
+    def _map(path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _find(self, index, key):
+        """
+        Offset and length of the newest segment stored under key, or None.
+        """
+        pos = index.rfind(key)
+        while pos >= 0:
+            if pos % INDEX_RECORD.size == 0:
+                _, offset, length = INDEX_RECORD.unpack_from(index, pos)
+                return offset, length
+            pos = index.rfind(key, 0, pos + len(key) - 1)
+        return None
+
+    def get(self, request_id, day=None):
+        """
+        Decoded trace of one request, or None. Without `day`, searches the
+        newest day files first. Raises ValueError for a malformed day; an
+        unreadable segment is logged and skipped.
+        """
+        key = request_key(request_id)
+        for d in ([day] if day else reversed(self.days())):
+            data_path, index_path = self._paths(d)
+            if not os.path.exists(index_path):
+                continue
+            index = self._map(index_path)
+            if index is None:
+                continue
+            with index:
+                found = self._find(index, key)
+            if found is None:
+                continue
+            try:
+                data = self._map(data_path)
+                if data is None:
+                    raise ValueError("empty data file")
+                with data:
+                    trace = decode_segment(data, found[0])
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Unreadable trace of {request_id} in {data_path}: {e}")
+                continue
+            trace["request_id"] = request_id
+            trace["day"] = d
+            return trace
+        return None
+
+    def list(self, day):
+        """
+        (request key, segment bytes) for every trace of one day.
+        """
+        _, index_path = self._paths(day)
+        if not os.path.exists(index_path):
+            return []
+        with open(index_path, "rb") as f:
+            return [(key.hex(), length) for key, _, length in INDEX_RECORD.iter_unpack(f.read())]
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "days": self.days(),
+            "segments_written": self.segments_written,
+            "bytes_written": self.bytes_written,
+        }
+
+###############################################################################
+# MAIN
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Read per-request traces")
+    parser.add_argument("--dir", default=TRACE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_get = sub.add_parser("get", help="print one request's trace")
+    p_get.add_argument("request_id")
+    p_get.add_argument("--day", type=parse_day, help="YYYY-MM-DD (default: search newest first)")
+    p_get.add_argument("--points", type=int, default=0, help="downsample to at most this many points")
+    p_get.add_argument("--csv", action="store_true", help="samples as CSV instead of JSON")
+    p_list = sub.add_parser("list", help="traces stored for a day")
+    p_list.add_argument("--day", type=parse_day, default=date.today().isoformat())
+    args = parser.parse_args()
+
+    store = TraceStore(args.dir)
+    if args.command == "list":
+        for key, length in store.list(args.day):
+            print(f"{key}  {length} bytes")
+        return
+
+    trace = store.get(args.request_id, args.day)
+    if trace is None:
+        sys.exit(f"No trace for {args.request_id}")
+    result = downsample(trace, args.points)
+    if args.csv:
+        names = list(result["samples"])
+        print(",".join(names))
+        for values in zip(*result["samples"].values()):
+            print(",".join(f"{v:.6g}" for v in values))
+    else:
+        print(json.dumps(dict(result, day=trace["day"]), indent=4))
+
+if __name__ == "__main__":
+    main()